@@ -101,7 +101,8 @@ def main(args):
         original_rows.append(row)
         data_on_form[row["Form_ID"]] = row
         official_cognateset_assignments[row["Form_ID"]] = row["Cognateset_ID"]
-        max_row_id = max(max_row_id, row["ID"])
+        # Row IDs are strings in the metadata, but numeric in practice
+        max_row_id = max(max_row_id, int(row["ID"]))
     official_cognatesets = swap(official_cognateset_assignments)
 
     # Find changed alignments
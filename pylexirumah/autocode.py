@@ -1,9 +1,14 @@
 #!/usr/bin/env python
 
-"""Similarity code tentative cognates in a word list and align them"""
+"""Similarity code tentative cognates in a word list and align them
+
+In the output, REFERENCE is the CLDF ID of each form and CONCEPT its
+Concept_ID, so clusters can be mapped back to the forms of the dataset.
+LingPy's own row IDs are not the form IDs.
+"""
 
 import sys
-from pycldf.util import Path
+from clldutils.path import Path
 import hashlib
 import argparse
 
@@ -17,6 +22,27 @@ from pyclts import TranscriptionSystem
 tokenizer = Tokenizer()
 bipa = TranscriptionSystem("bipa")
 
+# The columns LingPy reads from the CLDF dataset, and their LingPy names. This
+# differs from LingPy's defaults in keeping the form ID, as REFERENCE like in
+# our Edictor files, and in using the Concept_ID as concept, because our
+# ParameterTable has no Name column.
+COLUMNS = (
+    'id', 'concept_id', 'language_id', 'language_name',
+    'value', 'form', 'segments', 'language_glottocode',
+    'concept_concepticon_id', 'language_latitude', 'language_longitude',
+    'cognacy')
+NAMESPACE = (
+    ('id', 'reference'),
+    ('concept_id', 'concept'),
+    ('language_id', 'doculect'),
+    ('segments', 'tokens'),
+    ('language_glottocode', 'glottolog'),
+    ('concept_concepticon_id', 'concepticon'),
+    ('language_latitude', 'latitude'),
+    ('language_longitude', 'longitude'),
+    ('cognacy', 'cognacy'),
+    ('cogid_cognateset_id', 'cogid'))
+
 
 def sha1(path):
     return hashlib.sha1(str(path).encode('utf-8')).hexdigest()[:12]
@@ -59,6 +85,72 @@ def clean_segments(row):
     return row["segments"]
 
 
+def load_wordlist(input, soundclass="sca"):
+    """Load a CLDF wordlist as LingPy Partial object, with cleaned segments."""
+    return lingpy.compare.partial.Partial.from_cldf(
+        input, columns=COLUMNS, namespace=NAMESPACE, filter=clean_segments,
+        model=lingpy.data.model.Model(soundclass),
+        check=True)
+
+
+def ratio_parameters(ratio=1.5, initial_threshold=0.7):
+    """Turn the LexStat ratio into LingPy's pair and a file name suffix.
+
+    >>> ratio_parameters()
+    ((3, 2), '')
+    >>> ratio_parameters(2, 0.6)
+    ((2, 1), '-2-t60')
+
+    """
+    if ratio != 1.5:
+        if ratio == float("inf"):
+            ratio_pair = (1, 0)
+            ratio_str = "-inf"
+        elif ratio == int(ratio) >= 0:
+            r = int(ratio)
+            ratio_pair = (r, 1)
+            ratio_str = "-{:d}".format(r)
+        elif ratio > 0:
+            ratio_pair = (ratio, 1)
+            ratio_str = "-" + str(ratio)
+        else:
+            raise ValueError("LexStat ratio must be in [0, ∞]")
+    else:
+        ratio_pair = (3, 2)
+        ratio_str = ""
+    if initial_threshold != 0.7:
+        ratio_str += "-t{:02d}".format(int(initial_threshold * 100))
+    return ratio_pair, ratio_str
+
+
+def load_scorer(lex, input, soundclass="sca", ratio=1.5,
+                initial_threshold=0.7, runs=10000):
+    """Attach a LexStat scorer to `lex`, from cache if possible.
+
+    The scorer is cached in a `lexstats-*.tsv` file in the working directory,
+    keyed by the input path, sound class model and ratio settings.
+
+    """
+    ratio_pair, ratio_str = ratio_parameters(ratio, initial_threshold)
+    try:
+        scorers_etc = lingpy.compare.lexstat.LexStat(
+            filename='lexstats-{:}-{:s}{:s}.tsv'.format(
+                sha1(input),
+                soundclass, ratio_str))
+        lex.scorer = scorers_etc.scorer
+        lex.cscorer = scorers_etc.cscorer
+        lex.bscorer = scorers_etc.bscorer
+    except (OSError, ValueError):
+        lex.get_scorer(runs=runs, ratio=ratio_pair, threshold=initial_threshold)
+        lex.output(
+            'tsv',
+            filename='lexstats-{:}-{:s}{:s}'.format(
+                sha1(input),
+                soundclass, ratio_str),
+            ignore=[])
+    return lex
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
     parser.add_argument("input", default=Path("Wordlist-metadata.json"),
@@ -102,45 +194,9 @@ if __name__ == "__main__":
 
     dataset = get_dataset(args.input)
 
-    lex = lingpy.compare.partial.Partial.from_cldf(
-        args.input, filter=clean_segments,
-        model=lingpy.data.model.Model(args.soundclass),
-        check=True)
-
-    if args.ratio != 1.5:
-        if args.ratio == float("inf"):
-            ratio_pair = (1, 0)
-            ratio_str = "-inf"
-        if args.ratio == int(args.ratio) >= 0:
-            r = int(args.ratio)
-            ratio_pair = (r, 1)
-            ratio_str = "-{:d}".format(r)
-        elif args.ratio > 0:
-            ratio_pair = (args.ratio, 1)
-            ratio_str = "-" + str(args.ratio)
-        else:
-            raise ValueError("LexStat ratio must be in [0, ∞]")
-    else:
-        ratio_pair = (3, 2)
-        ratio_str = ""
-    if args.initial_threshold != 0.7:
-        ratio_str += "-t{:02d}".format(int(args.initial_threshold * 100))
-    try:
-        scorers_etc = lingpy.compare.lexstat.LexStat(
-            filename='lexstats-{:}-{:s}{:s}.tsv'.format(
-                sha1(args.input),
-                args.soundclass, ratio_str))
-        lex.scorer = scorers_etc.scorer
-        lex.cscorer = scorers_etc.cscorer
-        lex.bscorer = scorers_etc.bscorer
-    except (OSError, ValueError):
-        lex.get_scorer(runs=10000, ratio=ratio_pair, threshold=args.initial_threshold)
-        lex.output(
-            'tsv',
-            filename='lexstats-{:}-{:s}{:s}'.format(
-                sha1(args.input),
-                args.soundclass, ratio_str),
-            ignore=[])
+    lex = load_wordlist(args.input, args.soundclass)
+    load_scorer(lex, args.input, args.soundclass, args.ratio,
+                args.initial_threshold)
     # For some purposes it is useful to have monolithic cognate classes.
     lex.cluster(method='lexstat', threshold=args.threshold, ref='cogid',
                 cluster_method=args.cluster_method, verbose=True, override=True,
@@ -0,0 +1,364 @@
+#!/usr/bin/env python
+
+"""Import many word lists from LanguageTemplate directories in one go.
+
+`import.py` imports one template directory at a time. This script takes any
+number of template directories, and reads their lect metadata, sources and
+word lists in a pool of worker processes. Every new form is checked against
+the orthography profile of its source (Form_according_to_Source → Form, filled
+in if the template leaves the Form empty) and the orthography of its lect
+(Local_Orthography → Form), and its segments are checked against BIPA. The
+results of all directories are then merged and written in a single step: The
+LanguageTable and the sources are written once, and all new forms are
+appended to the FormTable and ValueTable (see `form_ids`).
+
+Example
+-------
+    $ python -m pylexirumah.batch_import ../wordlists/*/ --processes 4
+"""
+
+import re
+import csv
+import sys
+import argparse
+import collections
+import multiprocessing
+from collections import OrderedDict
+
+import chardet
+import csvw
+import xlrd
+import pyclts
+import pycldf
+
+from clldutils.path import Path
+from simplepybtex.exceptions import PybtexError
+
+from pylexirumah import get_dataset, repository
+from pylexirumah.coverage import Coverage
+from pylexirumah.form_ids import SynonymAllocator, append_rows
+from pylexirumah.profile_bundle import FusedTransducer
+from pylexirumah.check_transcription_systems import (
+    load_orthographic_profile, tokenizer, bipa)
+
+LECTS_DIRECTORY = "4 - language metadata"
+SOURCES_DIRECTORY = "3 - normalized metadata of original source"
+WORDLIST_DIRECTORY = "5 - wordlist created from original source"
+
+# Sources cited by the template itself, which are not new sources
+TEMPLATE_SOURCES = {
+    "glottolog", "abvd", "fieldwork_abui_lexirumah",
+    "greenbook_proto_AP_tsv", "fricke2014topics", "said1977bugis",
+    "samely2013kedang", "550122", "fricke2014hewa"}
+
+COPY_COLUMNS = ["Concept_ID", "Lect_ID", "Form_according_to_Source", "Form",
+                "Local_Orthography", "Comment"]
+
+Template = collections.namedtuple(
+    "Template", ["directory", "lects", "sources", "forms", "missing",
+                 "problems"])
+
+
+def newest_file(path, stem=None, extension=""):
+    """Find the most recently modified file in a directory.
+
+    Only files with the given stem and extension are considered.
+
+    """
+    if not path.exists():
+        raise ValueError("Path {:} does not exist.".format(path))
+    for file in sorted(path.glob("*" + extension),
+                       key=lambda p: p.lstat().st_mtime, reverse=True):
+        if stem is None or file.stem == stem:
+            return file
+    raise ValueError("No file {:}{:} found in {:}.".format(
+        stem or "*", extension, path))
+
+
+def read_table(path, stem):
+    """Read the newest xlsx or csv table with the given stem as dicts."""
+    file = newest_file(path, stem)
+    if file.suffix == ".xlsx":
+        rows = [[cell.value for cell in row] for row in
+                xlrd.open_workbook(str(file)).sheet_by_index(0).get_rows()]
+    elif file.suffix == ".csv":
+        with csvw.UnicodeReader(file.open()) as reader:
+            rows = list(reader)
+    else:
+        raise ValueError("Table {:} found, but no valid file type.".format(
+            file))
+    if not rows:
+        return []
+    header = rows[0]
+    return [dict(zip(header, row)) for row in rows[1:]]
+
+
+def read_sources(directory):
+    """Read the new sources of a template directory.
+
+    Sources are returned as (genre, ID, fields) triples, because
+    `pycldf.sources.Source` objects cannot be passed between processes.
+
+    """
+    bib = newest_file(directory / SOURCES_DIRECTORY, extension=".bib")
+    # People might have edited that file using Word, which has strange ideas
+    # about encoding.
+    with bib.open("rb") as binary:
+        data = binary.read()
+    entries = data.decode(chardet.detect(data)["encoding"] or "utf-8")
+    sources = pycldf.sources.Sources()
+    sources._add_entries(pycldf.sources.database.parse_string(
+        entries, bib_format='bibtex'))
+    return [(source.genre, source.id, dict(source))
+            for source in sources if source.id not in TEMPLATE_SOURCES]
+
+
+def read_lects(directory):
+    lects = OrderedDict()
+    for lect in read_table(directory / LECTS_DIRECTORY, "lects"):
+        if not lect["ID"]:
+            lect["ID"] = lect["Glottocode"]
+        if lect["ID"] == "abui1241-lexi":
+            # Example language, skip
+            continue
+        lect["Orthography"] = (lect["Orthography"] or "").split(":")
+        lects[lect["ID"]] = lect
+    return lects
+
+
+def read_wordlist(directory, default_lect, source_ids):
+    """Read the forms of a word list, without IDs.
+
+    Empty cells for concept or lect repeat the value of the previous row.
+
+    Returns
+    -------
+    (list, list): Forms, and forms missing from the source (with a comment)
+
+    """
+    forms = []
+    missing = []
+    previous_concept = None
+    previous_lect = default_lect
+    for row in read_table(directory / WORDLIST_DIRECTORY, "wordlist"):
+        entry = {c: row.get(c) or None for c in COPY_COLUMNS}
+        if not entry["Concept_ID"]:
+            entry["Concept_ID"] = previous_concept
+        previous_concept = entry["Concept_ID"]
+        if not entry["Lect_ID"] or entry["Lect_ID"] == "abui1241-lexi":
+            entry["Lect_ID"] = previous_lect
+        previous_lect = entry["Lect_ID"]
+        entry["Source"] = list(source_ids)
+
+        if entry["Comment"] and not entry["Form_according_to_Source"]:
+            missing.append(entry)
+        elif entry["Form_according_to_Source"]:
+            forms.append(entry)
+    return forms, missing
+
+
+def validate(forms, source_profile, lect_profiles):
+    """Check new forms against orthography profiles and BIPA.
+
+    Forms without a Form are filled in from Form_according_to_Source using
+    the source profile.
+
+    Returns
+    -------
+    list of str: Problem reports
+
+    """
+    problems = []
+    values = [str(form["Form_according_to_Source"]).strip() for form in forms]
+    if source_profile is not None:
+        expected_forms = source_profile.batch(values)
+    for f, form in enumerate(forms):
+        value = values[f]
+        if source_profile is not None:
+            expected = expected_forms[f]
+            if not form["Form"]:
+                form["Form"] = expected
+            elif form["Form"] != expected:
+                problems.append(
+                    "{:} <{:}> should be [{:}] according to the source"
+                    " orthography, but [{:}] was given.".format(
+                        form["Concept_ID"], value, expected, form["Form"]))
+        elif not form["Form"]:
+            problems.append(
+                "{:} <{:}> has no form, and its source has no orthography"
+                " profile.".format(form["Concept_ID"], value))
+            continue
+
+        for part in re.split('[.ˈˌ]', form["Form"]):
+            for segment in tokenizer(part, errors="ignore").split(" ") if part else []:
+                if isinstance(bipa[segment], pyclts.models.UnknownSound):
+                    problems.append(
+                        "{:} [{:}] contains non-BIPA segment '{:}'.".format(
+                            form["Concept_ID"], form["Form"], segment))
+
+        lect_profile = lect_profiles.get(form["Lect_ID"])
+        if lect_profile and form["Local_Orthography"]:
+            expected = lect_profile(form["Local_Orthography"])
+            if expected.replace("ˈ", "") != form["Form"].replace("ˈ", ""):
+                problems.append(
+                    "{:} <{:}> in the local orthography corresponds to [{:}],"
+                    " but the form is [{:}].".format(
+                        form["Concept_ID"], form["Local_Orthography"],
+                        expected, form["Form"]))
+    return problems
+
+
+def parse_template(arguments):
+    """Read and validate one template directory (in a worker process).
+
+    Parameters
+    ----------
+    arguments : (Path, Path, dict)
+        The template directory, the directory the orthography profiles are
+        relative to, and the orthographies of the lects already in the
+        dataset.
+
+    Returns
+    -------
+    Template
+
+    """
+    directory, root, orthographies = arguments
+    try:
+        lects = read_lects(directory)
+        sources = read_sources(directory)
+        if not sources:
+            raise ValueError("No sources for this word list found.")
+        forms, missing = read_wordlist(
+            directory, next(reversed(lects), None),
+            [id for genre, id, fields in sources])
+    except (OSError, ValueError, KeyError, csv.Error, xlrd.XLRDError,
+            PybtexError) as error:
+        return Template(directory, {}, [], [], [], [
+            "Could not read template: {:}".format(error)])
+
+    orthographies = dict(orthographies)
+    orthographies.update(
+        (id, lect["Orthography"]) for id, lect in lects.items())
+    used = {form["Lect_ID"] for form in forms}
+    lect_profiles = {
+        id: FusedTransducer(load_orthographic_profile(files, root=root))
+        for id, files in orthographies.items()
+        if id in used and files and any(files)}
+    transducer_files = sources[0][2].get("orthographic_profile")
+    source_profile = load_orthographic_profile(
+        transducer_files.split(":") if transducer_files else None, root=root)
+    if source_profile is not None:
+        source_profile = FusedTransducer(source_profile)
+    problems = validate(forms, source_profile, lect_profiles)
+    # Entries of lects without metadata would dangle in the FormTable and
+    # ValueTable, so they are reported and dropped.
+    problems.extend(
+        "Form for {:} belongs to lect {:} without metadata.".format(
+            form["Concept_ID"], form["Lect_ID"])
+        for form in forms + missing
+        if form["Lect_ID"] not in orthographies)
+    forms = [form for form in forms if form["Lect_ID"] in orthographies]
+    missing = [form for form in missing if form["Lect_ID"] in orthographies]
+    return Template(directory, lects, sources, forms, missing, problems)
+
+
+def merge(dataset, templates):
+    """Write the data of all templates to the dataset, each table once.
+
+    Returns
+    -------
+    (int, int): The numbers of new forms and new missing forms
+
+    """
+    languages = OrderedDict(
+        (lang["ID"], lang) for lang in dataset["LanguageTable"].iterdicts())
+    for template in templates:
+        languages.update(template.lects)
+    dataset["LanguageTable"].write(languages.values())
+
+    for template in templates:
+        for genre, id, fields in template.sources:
+            dataset.sources.add(pycldf.sources.Source(genre, id, **fields))
+    dataset.write_sources()
+
+    form_ids = SynonymAllocator(dataset)
+    forms = []
+    missing = []
+    for template in templates:
+        for target, entries in ((forms, template.forms),
+                                (missing, template.missing)):
+            for entry in entries:
+                entry["ID"] = form_ids.allocate(
+                    entry["Lect_ID"], entry["Concept_ID"])
+                target.append(entry)
+    append_rows(dataset, "FormTable", forms)
+    append_rows(dataset, "ValueTable", missing)
+    form_ids.save()
+    return len(forms), len(missing)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "directories", nargs="+", type=Path,
+        help="The folders containing the wordlist descriptions, derived from"
+        " the standard template.")
+    parser.add_argument(
+        "--wordlist", type=Path, default=repository,
+        help="The Wordlist to expand. (default: LexiRumah.)")
+    parser.add_argument(
+        "--processes", type=int, default=None,
+        help="Number of worker processes (default: number of CPUs)")
+    parser.add_argument(
+        "--strict", action="store_true", default=False,
+        help="Do not write anything if any problem was found. (default:"
+        " Skip templates that cannot be read, import the rest and report"
+        " all other problems.)")
+    args = parser.parse_args()
+
+    dataset = get_dataset(args.wordlist)
+    if dataset.module != 'Wordlist':
+        raise ValueError(
+            "This script can only import wordlist data to a CLDF Wordlist.")
+    orthographies = {
+        lect["ID"]: lect["Orthography"]
+        for lect in dataset["LanguageTable"].iterdicts()}
+    root = Path(str(dataset.directory))
+
+    with multiprocessing.Pool(args.processes) as pool:
+        templates = pool.map(
+            parse_template,
+            [(directory, root, orthographies)
+             for directory in args.directories],
+            chunksize=1)
+
+    readable = []
+    problems = 0
+    for template in templates:
+        for problem in template.problems:
+            print("{:}: {:}".format(template.directory, problem),
+                  file=sys.stderr)
+        problems += len(template.problems)
+        if template.lects or template.forms or template.missing:
+            readable.append(template)
+        print("{:}: {:d} lects, {:d} sources, {:d} forms, {:d} problems".format(
+            template.directory, len(template.lects), len(template.sources),
+            len(template.forms), len(template.problems)))
+
+    if args.strict and problems:
+        sys.exit("{:d} problems found, nothing written.".format(problems))
+    new_forms, new_missing = merge(dataset, readable)
+    print("Merged {:d} new forms and {:d} missing forms from {:d} word lists."
+          .format(new_forms, new_missing, len(readable)))
+
+    # Report concepts that the new lects neither attest nor record as missing
+    coverage = Coverage.from_dataset(dataset)
+    attested = coverage.per_lect()
+    for template in readable:
+        for lect in template.lects:
+            gaps = (set(coverage.unattested(lect)) -
+                    set(coverage.missing(lect)))
+            print("{:}: {:d} concepts attested, {:d} unaccounted for".format(
+                lect, attested[coverage.lect_index[lect]],
+                len(gaps)))
@@ -0,0 +1,498 @@
+#!/usr/bin/env python
+
+"""Time the hot paths of pylexirumah on reproducible inputs.
+
+Every benchmark draws its inputs from a CLDF dataset (by default LexiRumah
+itself) with a fixed random seed, so two runs on the same data measure the
+same work. Each benchmark is run a number of times, and the best and median
+times are stored in a JSON file under the current git commit, so that the
+timings of different commits can be compared before a release. Runs on
+uncommitted changes are stored under the commit hash with the suffix
+`-dirty`, and runs on different inputs are kept apart.
+
+Benchmarks whose dependencies cannot be loaded are reported as skipped.
+
+Example
+-------
+    $ python -m pylexirumah.benchmark
+    $ python -m pylexirumah.benchmark needleman_wunsch upgma --compare HEAD~1
+    $ python -m pylexirumah.benchmark --cldf synthetic-100x/cldf-metadata.json
+"""
+
+import io
+import atexit
+import csv
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import datetime
+import platform
+import tempfile
+import statistics
+import contextlib
+import subprocess
+from collections import OrderedDict
+
+from clldutils.path import Path
+
+from pylexirumah import get_dataset, repository
+
+RESULTS = Path(__file__).parent.parent / "benchmarks.json"
+
+BENCHMARKS = OrderedDict()
+
+
+def scratch():
+    """Create a temporary directory, removed when the benchmarks are done."""
+    directory = tempfile.mkdtemp()
+    atexit.register(shutil.rmtree, directory, ignore_errors=True)
+    return Path(directory)
+
+
+def benchmark(function):
+    """Register a benchmark.
+
+    A benchmark takes the `Inputs` and does all its preparation, then returns
+    the function to be timed, or a pair of that function and another one to
+    reset any state it changed before the next run.
+
+    """
+    BENCHMARKS[function.__name__] = function
+    return function
+
+
+class Inputs:
+    """Reproducible samples of a dataset for the benchmarks.
+
+    Parameters
+    ----------
+    metadata : Path
+        CLDF metadata file of the dataset
+    size : int
+        How many forms to sample
+    seed : int
+        The seed of the random sample
+
+    """
+    def __init__(self, metadata, size=500, seed=0):
+        self.metadata = Path(metadata)
+        self.size = size
+        self.seed = seed
+        self.dataset = get_dataset(self.metadata)
+        self.all_forms = list(self.dataset["FormTable"].iterdicts())
+        if not self.all_forms:
+            raise ValueError(
+                "The FormTable of {:} has no forms to benchmark.".format(
+                    self.metadata))
+        self.random = random.Random(seed)
+        self.forms = self.random.sample(
+            self.all_forms, min(size, len(self.all_forms)))
+
+    def pairs(self, n):
+        """Draw pairs of forms of the same concept, or any forms if needed."""
+        by_concept = OrderedDict()
+        for form in self.forms:
+            by_concept.setdefault(form["Concept_ID"], []).append(form)
+        pairs = [(a, b) for forms in by_concept.values()
+                 for a, b in zip(forms, forms[1:])]
+        while len(pairs) < n:
+            pairs.append(tuple(self.random.sample(self.forms, 2)))
+        return pairs[:n]
+
+    def orthographies(self):
+        """Map the lects of the sampled forms to their profile files."""
+        lects = {lect["ID"]: lect.get("Orthography")
+                 for lect in self.dataset["LanguageTable"].iterdicts()}
+        return {form["Lect_ID"]: lects.get(form["Lect_ID"])
+                for form in self.forms}
+
+    def describe(self):
+        return OrderedDict([
+            ("dataset", str(self.metadata)),
+            ("forms", len(self.all_forms)),
+            ("sample", len(self.forms)),
+            ("seed", self.seed)])
+
+
+@benchmark
+def get_dataset_forms(inputs):
+    """Load the dataset and read its FormTable."""
+    def run():
+        list(get_dataset(inputs.metadata)["FormTable"].iterdicts())
+    return run
+
+
+@benchmark
+def transducer(inputs):
+    """Apply and undo the orthographic profiles of the sampled lects."""
+    from pylexirumah.check_transcription_systems import Transducer
+    from pylexirumah.profile_bundle import parse_profile
+
+    root = inputs.metadata.parent
+    orthographies = inputs.orthographies()
+    profiles = {}
+    work = []
+    for form in inputs.forms:
+        orthography = orthographies[form["Lect_ID"]] or []
+        if isinstance(orthography, str):
+            orthography = orthography.split(":")
+        for name in orthography:
+            if not name:
+                continue
+            if name not in profiles:
+                try:
+                    with (root / name).open(encoding="utf-8") as lines:
+                        profiles[name] = Transducer(parse_profile(lines))
+                except (OSError, ValueError, NotImplementedError):
+                    profiles[name] = None
+            if profiles[name] is not None:
+                work.append((profiles[name],
+                             form["Form_according_to_Source"] or "",
+                             form["Form"] or ""))
+
+    def run():
+        for profile, source, form in work:
+            profile(source)
+            profile.undo(form)
+    return run
+
+
+@benchmark
+def needleman_wunsch(inputs):
+    """Align pairs of segmented forms of the same concept."""
+    from pylexirumah.check_transcription_systems import needleman_wunsch
+
+    pairs = [(a["Segments"] or [], b["Segments"] or [])
+             for a, b in inputs.pairs(200)]
+
+    def run():
+        for x, y in pairs:
+            needleman_wunsch(x, y)
+    return run
+
+
+@benchmark
+def tokenize_clpa(inputs):
+    """Segment the sampled forms with CLPA."""
+    from pylexirumah.segment import tokenize_clpa
+
+    forms = [form["Form"] for form in inputs.forms if form["Form"]]
+
+    def run():
+        for form in forms:
+            tokenize_clpa(form)
+    return run
+
+
+@benchmark
+def resolve_brackets(inputs):
+    """Resolve the bracketed forms in the source, or sampled forms with
+    optional parts added."""
+    from pylexirumah.brackets import resolve_brackets
+
+    strings = [form["Form_according_to_Source"]
+               for form in inputs.all_forms
+               if "(" in (form["Form_according_to_Source"] or "")]
+    if len(strings) < len(inputs.forms):
+        rng = random.Random(inputs.seed)
+        for form in inputs.forms[:len(inputs.forms) - len(strings)]:
+            string = form["Form"] or ""
+            cuts = sorted(rng.sample(range(len(string) + 1),
+                                     min(4, len(string) + 1)))
+            parts = [string[i:j] for i, j in zip([0] + cuts, cuts + [None])]
+            strings.append("".join(
+                "({:})".format(p) if k % 2 and p else p
+                for k, p in enumerate(parts)))
+
+    def run():
+        for string in strings:
+            for variant in resolve_brackets(string):
+                pass
+    return run
+
+
+@benchmark
+def upgma(inputs):
+    """Cluster the lects by the distances of their cognate classes."""
+    import numpy
+    from pylexirumah.align import upgma
+    from pylexirumah.util import cognate_sets
+
+    classes = OrderedDict()
+    lect_of = {form["ID"]: form["Lect_ID"] for form in inputs.all_forms}
+    for cognateset, forms in cognate_sets(inputs.dataset).items():
+        for form in forms:
+            if form in lect_of:
+                classes.setdefault(lect_of[form], set()).add(cognateset)
+    lects = sorted(classes)[:60]
+    distances = numpy.array(
+        [[1 - len(classes[a] & classes[b]) / len(classes[a] | classes[b])
+          for b in lects] for a in lects])
+
+    def run():
+        upgma(distances.copy(), lects)
+    return run
+
+
+@benchmark
+def cognate_sets(inputs):
+    """Collect the cognate sets of the dataset."""
+    from pylexirumah.util import cognate_sets
+
+    def run():
+        cognate_sets(inputs.dataset)
+    return run
+
+
+@benchmark
+def edictor_export(inputs):
+    """Export the dataset as a LingPy/Edictor word list."""
+    from pylexirumah.lingpycldf import cldf
+
+    target = scratch()
+
+    class Args:
+        args = (str(inputs.metadata), str(target / "edictor.tsv"))
+
+    def run():
+        cldf(Args)
+    return run
+
+
+def edictor_changes(dataset, seed=0, moved=0.05, realigned=0.02):
+    """Write the current cognate classes as an Edictor file, with changes.
+
+    A fraction of the forms is moved to another cognate class of the same
+    concept, or to a new one, and a fraction gets a new alignment.
+
+    Returns
+    -------
+    str: The Edictor file, as tab-separated values
+
+    """
+    from pylexirumah.compact_cognates import latest_assignments
+
+    rng = random.Random(seed)
+    concept_of = {form["ID"]: form["Concept_ID"]
+                  for form in dataset["FormTable"].iterdicts()}
+    assignments = latest_assignments(dataset)
+    codes = {}
+    classes_of_concept = OrderedDict()
+    for form, row in assignments.items():
+        code = codes.setdefault(row["Cognateset_ID"], len(codes) + 1)
+        classes_of_concept.setdefault(concept_of.get(form), []).append(code)
+
+    out = io.StringIO()
+    writer = csv.writer(out, delimiter="\t", lineterminator="\n")
+    writer.writerow(["ID", "REFERENCE", "CONCEPT", "COGID", "ALIGNMENT"])
+    for i, (form, row) in enumerate(assignments.items(), 1):
+        code = codes[row["Cognateset_ID"]]
+        alignment = list(row["Alignment"] or [])
+        if rng.random() < moved:
+            code = rng.choice(classes_of_concept[concept_of.get(form)] + [
+                len(codes) + i])
+        if alignment and rng.random() < realigned:
+            alignment.insert(rng.randrange(len(alignment) + 1), "-")
+        writer.writerow([i, form, concept_of.get(form), code,
+                         " ".join(alignment)])
+    return out.getvalue()
+
+
+@benchmark
+def append_changed_cognate_classes(inputs):
+    """Merge an Edictor file with changed cognate classes into a copy of the
+    dataset."""
+    from pylexirumah.append_changed_cognate_classes import main
+
+    directory = scratch() / "cldf"
+    shutil.copytree(str(inputs.metadata.parent), str(directory),
+                    ignore=shutil.ignore_patterns("*.npz", "*.idx", "*.ids",
+                                                  "*.checks", "p.bundle*"))
+    metadata = directory / inputs.metadata.name
+    dataset = get_dataset(metadata)
+    edictor = edictor_changes(dataset, inputs.seed)
+    # The merge appends to the CognateTable and may add its source
+    originals = {path: path.read_bytes() if path.exists() else None
+                 for path in list(directory.glob("*.csv")) +
+                 [Path(str(dataset.bibpath))]}
+
+    class Args:
+        cldf = metadata
+        source_id = "edictor"
+        cogid = "COGID"
+
+    def run():
+        Args.edictor = io.StringIO(edictor)
+        with contextlib.redirect_stdout(io.StringIO()):
+            main(Args)
+
+    def reset():
+        for path, content in originals.items():
+            if content is None:
+                if path.exists():
+                    path.unlink()
+            else:
+                path.write_bytes(content)
+    return run, reset
+
+
+def measure(run, reset=None, repeat=5):
+    """Time `repeat` calls of `run`, resetting before each.
+
+    Returns
+    -------
+    list of float: The times in seconds
+
+    """
+    times = []
+    for _ in range(repeat):
+        if reset is not None:
+            reset()
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def git(*arguments):
+    return subprocess.check_output(
+        ("git",) + arguments, cwd=str(Path(__file__).parent),
+        universal_newlines=True, stderr=subprocess.DEVNULL).strip()
+
+
+def resolve(revision="HEAD"):
+    """Abbreviate the hash of a commit, as results are stored under it."""
+    try:
+        return git("rev-parse", "--short", revision)
+    except (OSError, subprocess.CalledProcessError):
+        return revision
+
+
+def dirty():
+    """Check whether tracked files have uncommitted changes."""
+    try:
+        return bool(git("status", "--porcelain", "--untracked-files=no"))
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def find_run(runs, inputs):
+    """Find the stored run of a commit on the same inputs, if any."""
+    for run in runs:
+        if run.get("inputs") == inputs:
+            return run
+    return None
+
+
+def run_benchmarks(inputs, names=None, repeat=5, log=sys.stderr):
+    """Run benchmarks by name, all by default.
+
+    Returns
+    -------
+    OrderedDict mapping names to dicts with best and median time, or to
+    the reason the benchmark was skipped
+
+    """
+    results = OrderedDict()
+    for name in names or BENCHMARKS:
+        try:
+            prepared = BENCHMARKS[name](inputs)
+        except Exception as e:
+            results[name] = {"skipped": "{:}: {:}".format(
+                type(e).__name__, e)}
+            print(name, "skipped", results[name]["skipped"],
+                  sep="\t", file=log)
+            continue
+        run, reset = prepared if isinstance(prepared, tuple) else (
+            prepared, None)
+        times = measure(run, reset, repeat)
+        results[name] = OrderedDict([
+            ("best", min(times)),
+            ("median", statistics.median(times)),
+            ("repeat", repeat)])
+        print(name, "{:.4f}".format(min(times)), sep="\t", file=log)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "benchmarks", nargs="*", metavar="BENCHMARK",
+        help="Benchmarks to run (default: all of {:})".format(
+            ", ".join(BENCHMARKS)))
+    parser.add_argument(
+        "--cldf", type=Path, default=repository,
+        help="CLDF metadata file of the dataset (default: LexiRumah)")
+    parser.add_argument(
+        "--size", type=int, default=500,
+        help="Number of forms to sample (default: 500)")
+    parser.add_argument(
+        "--seed", type=int, default=0,
+        help="Seed of the random sample (default: 0)")
+    parser.add_argument(
+        "--repeat", type=int, default=5,
+        help="How often to run each benchmark (default: 5)")
+    parser.add_argument(
+        "--results", type=Path, default=RESULTS,
+        help="JSON file with the results by commit (default: {:})".format(
+            RESULTS.name))
+    parser.add_argument(
+        "--compare", default=None, metavar="COMMIT",
+        help="Show the change of best times relative to this commit")
+    args = parser.parse_args()
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error("Unknown benchmark {:}".format(name))
+
+    try:
+        with args.results.open(encoding="utf-8") as stored:
+            history = json.load(stored, object_pairs_hook=OrderedDict)
+    except (OSError, ValueError):
+        history = OrderedDict()
+    for revision, runs in history.items():
+        # Older files stored a single run per commit
+        if isinstance(runs, dict):
+            history[revision] = [runs]
+
+    inputs = Inputs(args.cldf, args.size, args.seed)
+    described = inputs.describe()
+    results = run_benchmarks(inputs, args.benchmarks, args.repeat)
+    changed = dirty()
+    runs = history.setdefault(
+        resolve() + ("-dirty" if changed else ""), [])
+    entry = find_run(runs, described)
+    if entry is None:
+        entry = OrderedDict()
+        runs.append(entry)
+    elif changed:
+        # The uncommitted changes may not be those timed before
+        entry.clear()
+    entry["date"] = datetime.datetime.now().isoformat(timespec="seconds")
+    entry["python"] = platform.python_version()
+    entry["machine"] = platform.node()
+    entry["inputs"] = described
+    entry.setdefault("results", OrderedDict()).update(results)
+    with args.results.open("w", encoding="utf-8") as stored:
+        json.dump(history, stored, indent=1)
+
+    baseline = None
+    if args.compare:
+        baseline = find_run(
+            history.get(resolve(args.compare)) or history.get(
+                args.compare) or [], described)
+        if baseline is None:
+            parser.error("No results stored for {:} on these inputs".format(
+                args.compare))
+    for name, result in results.items():
+        if "skipped" in result:
+            print(name, "skipped", sep="\t")
+            continue
+        line = [name, "{:.4f}".format(result["best"]),
+                "{:.4f}".format(result["median"])]
+        before = baseline and baseline["results"].get(name, {}).get("best")
+        if before:
+            line.append("{:+.1%}".format(result["best"] / before - 1))
+        print(*line, sep="\t")
@@ -0,0 +1,172 @@
+"""Forms with optional parts in brackets, without enumerating the variants.
+
+A form like `(no )bracket(s)` stands for all variants with or without the
+contents of each bracket. With k brackets there are 2^k variants, so instead
+of listing them, `BracketVariants` keeps the form as a sequence of fixed and
+optional parts, and finds out whether a string is one of the variants, and
+which, in a single pass over the parts.
+"""
+
+import re
+
+WORD_EDGES = re.compile(r"^[\s_]+|[\s_]+$")
+
+
+def trim(string):
+    """Strip whitespace and word boundaries from both ends of a string.
+
+    >>> trim(" _a b_ ")
+    'a b'
+
+    """
+    return WORD_EDGES.sub("", string)
+
+
+class BracketVariants:
+    """The variants of a form with optional parts in (non-nested) brackets.
+
+    Variants are numbered like the forms generated by `resolve_brackets`:
+    Variant i contains the j-th bracket (counting from 0) if bit k-1-j of i
+    is set, so variant 0 drops all brackets and the last variant keeps all.
+
+    Parameters
+    ----------
+    string : str
+    strip : bool
+        Whether to trim whitespace and '_' from the ends of the variants
+
+    >>> v = BracketVariants("(no )bracket(s)", strip=True)
+    >>> len(v), list(v)
+    (4, ['bracket', 'brackets', 'no bracket', 'no brackets'])
+    >>> v.index("no bracket"), v.index("no brackets!")
+    (2, None)
+    >>> BracketVariants("a(b)" * 40).index("a" * 40 + "b")
+    1
+
+    """
+    def __init__(self, string, strip=False):
+        self.string = string
+        self.strip = strip
+        self.fixed = []
+        self.optional = []
+        rest = string
+        while "(" in rest:
+            opening = rest.index("(")
+            closing = rest.index(")")
+            if closing < opening or "(" in rest[opening + 1:closing]:
+                raise ValueError(
+                    "Form {:} has unbalanced or nested brackets.".format(
+                        string))
+            self.fixed.append(rest[:opening])
+            self.optional.append(rest[opening + 1:closing])
+            rest = rest[closing + 1:]
+        self.fixed.append(rest)
+
+    def __len__(self):
+        return 2 ** len(self.optional)
+
+    def variant(self, i):
+        """Build the i-th variant."""
+        k = len(self.optional)
+        parts = [self.fixed[0]]
+        for j, (optional, fixed) in enumerate(
+                zip(self.optional, self.fixed[1:])):
+            if i >> (k - 1 - j) & 1:
+                parts.append(optional)
+            parts.append(fixed)
+        string = "".join(parts)
+        return trim(string) if self.strip else string
+
+    def __getitem__(self, i):
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self.variant(i)
+
+    def __iter__(self):
+        return (self.variant(i) for i in range(len(self)))
+
+    def index(self, target, normalize=None):
+        """Find the first variant equal to target, without enumerating them.
+
+        Parameters
+        ----------
+        target : str
+        normalize : function, optional
+            A function deleting characters, such as stress marks, which is
+            applied to the target and to every part before comparing
+
+        Returns
+        -------
+        int or None: The number of the first matching variant
+
+        """
+        if target is None:
+            return None
+        if normalize is None:
+            normalize = str
+        target = normalize(target)
+        fixed = [normalize(f) for f in self.fixed]
+        optional = [normalize(o) for o in self.optional]
+        if self.strip and target != trim(target):
+            return None
+
+        # A deterministic automaton accepting target, surrounded by word
+        # edges if variants are trimmed. States 0..n count the characters of
+        # target read so far; state n + 1 is the trailing edge.
+        n = len(target)
+
+        def run(state, string):
+            for char in string:
+                edge = self.strip and (char.isspace() or char == "_")
+                if state == 0 and edge:
+                    continue
+                elif state < n and char == target[state]:
+                    state += 1
+                elif state >= n and edge:
+                    state = n + 1
+                else:
+                    return None
+            return state
+
+        accept = {n, n + 1}
+        states = range(n + 2)
+        # Which states can still reach acceptance before each part
+        feasible = [None] * (2 * len(optional) + 2)
+        feasible[-1] = accept
+        for p in range(len(optional), 0, -1):
+            after = feasible[2 * p + 1]
+            feasible[2 * p] = {s for s in states
+                               if run(s, fixed[p]) in after}
+            feasible[2 * p - 1] = feasible[2 * p] | {
+                s for s in states
+                if run(s, optional[p - 1]) in feasible[2 * p]}
+        state = run(0, fixed[0])
+        if state is None or state not in feasible[1]:
+            return None
+
+        # Drop every bracket that can be dropped, from the first on
+        i = 0
+        for p, part in enumerate(optional, 1):
+            i <<= 1
+            if state not in feasible[2 * p]:
+                state = run(state, part)
+                i |= 1
+            state = run(state, fixed[p])
+        return i
+
+
+def resolve_brackets(string, strip=False):
+    """Resolve a string into all description without brackets
+
+    For a `string` with matching parentheses, but without nested parentheses,
+    yield every combination of the contents of any parenthesis being present or
+    absent.
+
+    >>> list(resolve_brackets("no brackets"))
+    ['no brackets']
+
+    >>> sorted(list(resolve_brackets("(no )bracket(s)")))
+    ['bracket', 'brackets', 'no bracket', 'no brackets']
+
+    """
+    return iter(BracketVariants(string, strip))
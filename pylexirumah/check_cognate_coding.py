@@ -1,11 +1,22 @@
 #!/usr/bin/env python
 
-"""Compare cognates in a CLDF Wordlist with a pairwise gold standard"""
+"""Compare cognates in a CLDF Wordlist with a gold standard
 
-from pycldf.util import Path
-import argparse
+The gold standard is either a CSV file of pairwise judgements (the default,
+see `goldstandard/AggregatePairJudgements.csv`), or another CLDF Wordlist
+whose cognate classes are taken as the gold partition of every concept. In
+the latter case, gold and predicted classes are cross-tabulated per concept,
+and pairwise as well as B-cubed precision and recall are reported.
+"""
 
 import csv
+import argparse
+import functools
+import multiprocessing
+
+import numpy
+
+from clldutils.path import Path
 from pylexirumah.util import get_dataset, cognate_sets
 
 
@@ -16,12 +27,281 @@ def pprint_form(form_id):
         forms[form_id][c_concept],
         " ".join(forms[form_id][c_segm])))
 
+
+def factorize(values):
+    """Code hashable values as consecutive integers.
+
+    >>> factorize(["b", "a", "b", ("x", "y")])
+    array([0, 1, 0, 2])
+
+    """
+    codes = {}
+    return numpy.array([codes.setdefault(tuple(v) if isinstance(v, list) else v,
+                                         len(codes))
+                        for v in values],
+                       dtype=numpy.int64)
+
+
+def load_gold_pairs(gold, column_id_1="ID1", column_id_2="ID2",
+                    gold_column="Cognate"):
+    """Load pairwise cognate judgements from a CSV file.
+
+    Rows without a numerical judgement (such as "DISAGREE") are skipped.
+
+    Returns
+    -------
+    (list of str, list of str, numpy.array of bool)
+        The form IDs of both sides of each pair, and whether the pair is
+        judged to be cognate (judgement > 0).
+
+    """
+    ids1, ids2, judgements = [], [], []
+    with gold.open(encoding="utf-8") as goldfile:
+        for line in csv.DictReader(goldfile):
+            try:
+                judgement = float(line[gold_column])
+            except ValueError:
+                continue
+            ids1.append(line[column_id_1])
+            ids2.append(line[column_id_2])
+            judgements.append(judgement > 0)
+    return ids1, ids2, numpy.array(judgements, dtype=bool)
+
+
+def load_gold_partition(gold):
+    """Load the cognate classes of a CLDF Wordlist as a gold partition.
+
+    Forms without a cognate class are left out.
+
+    Returns
+    -------
+    (list of str, list of str, list)
+        The form IDs, their concepts and their gold cognate classes.
+
+    """
+    gold_dataset = get_dataset(gold)
+    gold_codings = {
+        form: code
+        for code, forms in cognate_sets(gold_dataset).items()
+        for form in forms}
+    g_id = gold_dataset["FormTable", "id"].name
+    g_concept = gold_dataset["FormTable", "parameterReference"].name
+    form_ids, concepts, codes = [], [], []
+    for row in gold_dataset["FormTable"].iterdicts():
+        form = row[g_id]
+        if form not in gold_codings:
+            continue
+        form_ids.append(form)
+        concepts.append(row[g_concept])
+        codes.append(gold_codings[form])
+    return form_ids, concepts, codes
+
+
+def load_lingpy_codings(path):
+    """Load the forms and partial cognate codes of a LingPy word list.
+
+    Forms are keyed by their LingPy row ID as a string, to match the form IDs
+    read by `load_gold_pairs`.
+
+    Returns
+    -------
+    (dict, dict)
+        The forms, as dicts of their LingPy entries, and their cognate codes.
+
+    """
+    import lingpy
+    dataset = lingpy.LexStat(str(path))
+    forms = {str(row):
+        {e: dataset[row][dataset.header[e]]
+         for e in dataset.entries
+         if e in dataset.header}
+        for row in dataset}
+    codings = {
+        form: row["partial_ids"]
+        for form, row in forms.items()}
+    return forms, codings
+
+
+def pair_statistics(ids1, ids2, judgements, codings):
+    """Classify each gold pair as true/false positive/negative.
+
+    Uncoded forms count as false negatives, as in the original checker.
+
+    Returns
+    -------
+    numpy.array of int, shape (len(judgements), 4)
+        One-hot rows for (true positive, false negative, false positive,
+        true negative), suitable for summation and bootstrap resampling.
+
+    """
+    missing = object()
+    c1 = [codings.get(f, missing) for f in ids1]
+    c2 = [codings.get(f, missing) for f in ids2]
+    coded = numpy.array([a is not missing and b is not missing
+                         for a, b in zip(c1, c2)], dtype=bool)
+    codes = factorize(c1 + c2)
+    same = codes[:len(c1)] == codes[len(c1):]
+    positive = judgements
+    return numpy.stack([
+        coded & positive & same,
+        ~coded | (positive & ~same),
+        coded & ~positive & same,
+        coded & ~positive & ~same]).T.astype(numpy.int64)
+
+
+def pair_scores(statistics):
+    """Compute precision, recall and F-score from summed pair statistics."""
+    tp, fn, fp, tn = statistics
+    return {
+        "precision": tp / (tp + fp) if tp + fp else float("nan"),
+        "recall": tp / (tp + fn) if tp + fn else float("nan"),
+        "f-score": 2 * tp / (2 * tp + fp + fn) if tp + fp + fn else float("nan")}
+
+
+def contingency_tables(concepts, gold, predicted):
+    """Cross-tabulate gold and predicted cognate classes within concepts.
+
+    All arguments are parallel sequences with one entry per form. Classes are
+    integer-coded per concept, so that a cognate class spanning several
+    concepts is treated as separate classes in each.
+
+    Returns
+    -------
+    (numpy.array, numpy.array, numpy.array, numpy.array, numpy.array, list)
+        For every non-empty cell of the contingency tables: its concept, gold
+        class and predicted class code and its count; the sizes of all gold
+        classes and of all predicted classes; and the list of concepts.
+
+    """
+    concept_ids = {}
+    concept_codes = numpy.array(
+        [concept_ids.setdefault(c, len(concept_ids)) for c in concepts],
+        dtype=numpy.int64)
+    gold_codes = factorize(zip(concepts, gold))
+    predicted_codes = factorize(zip(concepts, predicted))
+
+    n_predicted = predicted_codes.max() + 1 if len(predicted_codes) else 0
+    cells, counts = numpy.unique(
+        gold_codes * n_predicted + predicted_codes, return_counts=True)
+    cell_gold = cells // max(n_predicted, 1)
+    cell_predicted = cells % max(n_predicted, 1)
+
+    gold_concept = numpy.zeros(gold_codes.max() + 1 if len(gold_codes) else 0,
+                               dtype=numpy.int64)
+    gold_concept[gold_codes] = concept_codes
+    return (gold_concept[cell_gold], cell_gold, cell_predicted, counts,
+            numpy.bincount(gold_codes), numpy.bincount(predicted_codes),
+            list(concept_ids))
+
+
+def partition_statistics(concepts, gold, predicted):
+    """Compute per-concept sufficient statistics for clustering scores.
+
+    Returns
+    -------
+    (numpy.array, list)
+        An array of shape (number of concepts, 6) with columns: true positive
+        pairs, gold pairs, predicted pairs, B-cubed precision sum, B-cubed
+        recall sum and number of forms; and the list of concepts.
+
+    """
+    (cell_concept, cell_gold, cell_predicted, counts,
+     gold_sizes, predicted_sizes, concept_list) = contingency_tables(
+         concepts, gold, predicted)
+    n = len(concept_list)
+
+    def per_concept(weights):
+        return numpy.bincount(cell_concept, weights=weights, minlength=n)
+
+    counts = counts.astype(float)
+    gold_per_cell = gold_sizes[cell_gold].astype(float)
+    predicted_per_cell = predicted_sizes[cell_predicted].astype(float)
+    # Each gold and each predicted class has at least one cell, so summing
+    # over cells with the right normalization yields the class pair counts.
+    return numpy.stack([
+        per_concept(counts * (counts - 1) / 2),
+        per_concept(counts * (gold_per_cell - 1) / 2),
+        per_concept(counts * (predicted_per_cell - 1) / 2),
+        per_concept(counts ** 2 / predicted_per_cell),
+        per_concept(counts ** 2 / gold_per_cell),
+        per_concept(counts)]).T, concept_list
+
+
+def partition_scores(statistics):
+    """Compute pairwise and B-cubed scores from summed concept statistics."""
+    tp, gold_pairs, predicted_pairs, b_precision, b_recall, n = statistics
+
+    def f(p, r):
+        return 2 * p * r / (p + r) if p + r else 0.0
+
+    p = tp / predicted_pairs if predicted_pairs else 1.0
+    r = tp / gold_pairs if gold_pairs else 1.0
+    bp = b_precision / n if n else float("nan")
+    br = b_recall / n if n else float("nan")
+    return {
+        "pairwise precision": p, "pairwise recall": r, "pairwise f-score": f(p, r),
+        "B-cubed precision": bp, "B-cubed recall": br, "B-cubed f-score": f(bp, br)}
+
+
+def _bootstrap_replicates(statistics, score, replicates, seed):
+    random = numpy.random.RandomState(seed)
+    n = len(statistics)
+    results = []
+    for _ in range(replicates):
+        weights = numpy.bincount(random.randint(n, size=n), minlength=n)
+        results.append(score(weights @ statistics))
+    return results
+
+
+def bootstrap(statistics, score, replicates=1000, processes=None, seed=0,
+              confidence=0.95):
+    """Bootstrap confidence intervals for scores over resampled units.
+
+    Rows of `statistics` are the resampling units (gold pairs or concepts).
+    Each replicate draws units with replacement, sums their rows and passes
+    the sum to `score`, which must return a dict of numbers. The replicates
+    are distributed over a process pool.
+
+    Returns
+    -------
+    dict mapping score names to (lower, upper) bounds
+
+    """
+    processes = processes or multiprocessing.cpu_count()
+    chunks = [replicates // processes + (i < replicates % processes)
+              for i in range(processes)]
+    job = functools.partial(_bootstrap_replicates, statistics, score)
+    with multiprocessing.Pool(processes) as pool:
+        results = pool.starmap(
+            job, [(chunk, seed + i) for i, chunk in enumerate(chunks) if chunk])
+    results = [r for chunk in results for r in chunk]
+    alpha = (1 - confidence) / 2
+    return {
+        key: tuple(numpy.nanquantile([r[key] for r in results],
+                                     [alpha, 1 - alpha]))
+        for key in results[0]}
+
+
+def print_scores(scores, intervals=None, end="\n"):
+    for key, value in scores.items():
+        if intervals:
+            print("{:}: {:.4f} [{:.4f}, {:.4f}]".format(
+                key, value, *intervals[key]), end=end)
+        else:
+            print("{:}: {:.4f}".format(key, value), end=end)
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
     parser.add_argument("gold",
                         type=Path,
                         help="A CSV file listing pairs of forms and whether"
-                        " they should be considered cognates or not.")
+                        " they should be considered cognates or not, or a"
+                        " CLDF dataset if --gold-format is 'cldf'.")
+    parser.add_argument("--gold-format", default="pairs",
+                        choices=["pairs", "cldf"],
+                        help="Whether GOLD contains pairwise judgements or"
+                        " a full cognate coding (default: pairs)")
     parser.add_argument("--column-id-1", default="ID1",
                         help="Header of first column containing Form_IDs in"
                         " GOLD (default: ID1)")
@@ -44,19 +324,18 @@ if __name__ == "__main__":
     parser.add_argument("--ssv", default=False,
                         action="store_true",
                         help="Output one line, not many")
+    parser.add_argument("--bootstrap", default=0, type=int,
+                        help="Number of bootstrap replicates for confidence"
+                        " intervals (default: 0, no intervals)")
+    parser.add_argument("--processes", default=None, type=int,
+                        help="Number of worker processes for the bootstrap"
+                        " (default: number of CPUs)")
+    parser.add_argument("--seed", default=0, type=int,
+                        help="Random seed for the bootstrap (default: 0)")
     args = parser.parse_args()
 
     if args.lingpy:
-        import lingpy
-        dataset = lingpy.LexStat(str(args.codings))
-        forms = {row:
-            {e: dataset[row][dataset.header[e]]
-             for e in dataset.entries
-             if e in dataset.header}
-            for row in dataset}
-        codings = {
-            form: row["partial_ids"]
-            for form, row in forms.items()}
+        forms, codings = load_lingpy_codings(args.codings)
         c_id = "reference"
         c_lect = "doculect"
         c_concept = "concept"
@@ -83,51 +362,41 @@ if __name__ == "__main__":
         def pprint_form(form):
             pass
 
-    true_positives = 0
-    false_positives = 0
-    true_negatives = 0
-    false_negatives = 0
-
-    for line in csv.DictReader(args.gold.open()):
-        try:
-            judgement = float(line[args.gold_column])
-        except ValueError:
-            continue
+    end = " " if args.ssv else "\n"
+    print(args.codings, end=end)
 
-        form1 = int(line[args.column_id_1])
-        form2 = int(line[args.column_id_2])
-        c1 = codings.get(form1)
-        c2 = codings.get(form2)
-        if c1 is None or c2 is None:
-            # These forms are not coded. This is bad.
-            false_negatives += 1
-        elif judgement > 0:
-            if c1==c2:
-                # When judgement is positive, we want the cognate classes to be the same. This is fine.
-                true_positives += 1
-            else:
-                # These forms are in disagreement with the gold standard!
-                false_negatives += 1
+    if args.gold_format == "cldf":
+        gold_forms, concepts, gold = load_gold_partition(args.gold)
+        # Uncoded forms are singletons of their own
+        predicted = [codings.get(form, ("uncoded", form))
+                     for form in gold_forms]
+        statistics, concept_list = partition_statistics(
+            concepts, gold, predicted)
+        print("Concepts:", len(concept_list), "Forms:", len(concepts), end=end)
+        score = partition_scores
+    else:
+        ids1, ids2, judgements = load_gold_pairs(
+            args.gold, args.column_id_1, args.column_id_2, args.gold_column)
+        statistics = pair_statistics(ids1, ids2, judgements, codings)
+        for (tp, fn, fp, tn), form1, form2 in zip(statistics, ids1, ids2):
+            if fn and form1 in codings and form2 in codings:
                 message(form1, "should be cognate with", form2)
-                pprint_form(form1)
-                pprint_form(form2)
-        else:
-            if c1==c2:
-                # These forms are in disagreement with the gold standard!
-                false_positives += 1
+            elif fp:
                 message(form1, "should not be cognate with", form2)
-                pprint_form(form1)
-                pprint_form(form2)
             else:
-                # When judgement is positive, we want the cognate classes to be the same. This is fine.
-                true_negatives += 1
-
-    end = " " if args.ssv else "\n"
-    print(args.codings, end=end)
-    print("    Data:", "T", "F", end=end)
-    print("Target: T", true_positives, false_negatives, end=end)
-    print("Target: F", false_positives, true_negatives, end=end)
-    print("F-Score:",
-          2 * true_positives / (2 * true_positives + false_positives + false_negatives))
+                continue
+            pprint_form(form1)
+            pprint_form(form2)
 
+        true_positives, false_negatives, false_positives, true_negatives = (
+            statistics.sum(0))
+        print("    Data:", "T", "F", end=end)
+        print("Target: T", true_positives, false_negatives, end=end)
+        print("Target: F", false_positives, true_negatives, end=end)
+        score = pair_scores
 
+    intervals = None
+    if args.bootstrap:
+        intervals = bootstrap(statistics, score, args.bootstrap,
+                              processes=args.processes, seed=args.seed)
+    print_scores(score(statistics.sum(0)), intervals, end=end)
@@ -2,7 +2,10 @@
 
 import re
 import sys
+import json
+import hashlib
 import argparse
+import functools
 import itertools
 from collections import OrderedDict
 from clldutils.path import Path
@@ -39,6 +42,9 @@ tokenizer = Tokenizer(Profile(*({"Grapheme": x, "mapping": x} for x in sounds)),
                       errors_ignore = lambda c: c)
 
 from pylexirumah import get_dataset, repository
+from pylexirumah.brackets import BracketVariants
+from pylexirumah.profile_bundle import (
+    ProfileBundle, FusedTransducer, parse_profile)
 
 
 def needleman_wunsch(x, y, lodict={}, gop=-2.5, gep=-1.75, local=False, indel=''):
@@ -119,31 +125,6 @@ def needleman_wunsch(x, y, lodict={}, gop=-2.5, gep=-1.75, local=False, indel=''
     return score, alg
 
 
-def resolve_brackets(string):
-    """Resolve a string into all description without brackets
-
-    For a `string` with matching parentheses, but without nested parentheses,
-    yield every combination of the contents of any parenthesis being present or
-    absent.
-
-    >>> list(resolve_brackets("no brackets"))
-    ["no brackets"]
-
-    >>> sorted(list(resolve_brackets("(no )bracket(s)")))
-    ["bracket", "brackets", "no bracket", "no brackets"]
-
-    """
-    if "(" in string:
-        opening = string.index("(")
-        closing = string.index(")")
-        for form in resolve_brackets(string[:opening] + string[closing+1:]):
-            yield form.strip().strip("_")
-        for form in resolve_brackets(string[:opening] + string[opening+1:closing] + string[closing+1:]):
-            yield form.strip().strip("_")
-    else:
-        yield string
-
-
 class Transducer:
     def __init__(self, rules):
         self.rules = rules
@@ -251,29 +232,81 @@ def load_orthographic_profile(transducer_files, root=repository.parent, transduc
         try:
             transducer_cache[file]
         except KeyError:
-            # That file is not in our cache yet, we have to load it and
+            # That file is not in our cache yet. Take its compiled form from
+            # the profile bundle if that is up to date, otherwise load it and
             # turn it into a function.
-            substitutions = []
-            for rule in (root / file).open(encoding="utf-8"):
-                rule = rule.strip("\n")
-                rule = rule.strip("\r")
-                if "//" in rule:
-                    rule = rule[:rule.index("//")]
-                if not rule.strip():
-                    continue
-                if "[" in rule or "#def" in rule:
-                    raise NotImplementedError("Context groups are not supported yet.")
-                try:
-                    before, after = rule.split("\t")
-                except ValueError:
-                    print(rule)
-                    raise
-                substitutions.append((before, after))
-            transducer_cache[file] = Transducer(substitutions)
+            transducer = open_bundle(root).get(file)
+            if transducer is None:
+                with (root / file).open(encoding="utf-8") as rules:
+                    transducer = Transducer(parse_profile(rules))
+            transducer_cache[file] = transducer
         orthographic_profile.append(transducer_cache[file])
     return orthographic_profile
 
 
+@functools.lru_cache(maxsize=None)
+def open_bundle(root):
+    return ProfileBundle(root)
+
+
+class CheckCache:
+    """The results of checking forms in earlier runs of this script.
+
+    For every form, the cache stores the messages and the resulting Form,
+    Segments and Local_Orthography, under a hash of everything the checks
+    depend on: the form's Value, Form, Segments and Local_Orthography, the
+    names and contents of the profile files of its source and its lect, and
+    the checking options. Forms whose hash is unchanged need not be checked
+    again; their messages are replayed instead.
+
+    """
+    def __init__(self, path, root=repository.parent):
+        self.path = Path(path)
+        self.root = root
+        self.digests = {}
+        try:
+            with self.path.open(encoding="utf-8") as cache:
+                self.results = json.load(cache)
+        except (OSError, ValueError):
+            self.results = {}
+
+    def profile(self, transducer_files):
+        """Describe profile files by their names and content hashes."""
+        if transducer_files is None:
+            return None
+        described = []
+        for file in transducer_files:
+            if file not in self.digests:
+                try:
+                    self.digests[file] = hashlib.sha1(
+                        (self.root / file).read_bytes()).hexdigest()
+                except OSError:
+                    self.digests[file] = None
+            described.append([file, self.digests[file]])
+        return described
+
+    @staticmethod
+    def key(*parts):
+        return hashlib.sha1(json.dumps(
+            parts, default=str, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    def get(self, form_id, key):
+        """Return the cached (messages, form, segments, orthography) or None."""
+        entry = self.results.get(form_id)
+        if entry is None or entry[0] != key:
+            return None
+        return entry[1:]
+
+    def put(self, form_id, key, messages, form, segments, orthography):
+        self.results[form_id] = [
+            key, list(messages), form,
+            segments and [str(s) for s in segments], orthography]
+
+    def save(self):
+        with self.path.open("w", encoding="utf-8") as cache:
+            json.dump(self.results, cache, ensure_ascii=False)
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Import word lists from a new source into LexiRumah.")
     parser.add_argument("directory", nargs="?",
@@ -308,6 +341,9 @@ if __name__ == "__main__":
         Form→Orthography: Keep <quiet>, <report> differences, <override>
         differences or <fill> empty cells. A list of three space-separated
         entries from these options. (Default: report override fill)""")
+    parser.add_argument(
+        "--recheck", default=False, action="store_true",
+        help="Check all forms, even those unchanged since the last run.")
     args = parser.parse_args()
 
     if args.check_stress:
@@ -358,15 +394,18 @@ if __name__ == "__main__":
             "This script can only import wordlist data to a CLDF Wordlist.")
 
     language_orthographies = {None: None}
+    language_orthography_files = {None: None}
 
     c_languageid = dataset["LanguageTable", "id"].name
 
     for line in dataset["LanguageTable"].iterdicts():
         transducer_files = line.get("Orthography") # This property is not codified by CLDF
+        language_orthography_files[line[c_languageid]] = transducer_files
         if not transducer_files:
             language_orthographies[line[c_languageid]] = None
         else:
-            language_orthographies[line[c_languageid]] = load_orthographic_profile(transducer_files)
+            language_orthographies[line[c_languageid]] = FusedTransducer(
+                load_orthographic_profile(transducer_files))
 
     transcription_systems = {None: None}
 
@@ -379,13 +418,21 @@ if __name__ == "__main__":
     c_id = dataset["FormTable", "id"].name
     c_orth = "Local_Orthography" # This property is not codified by CLDF
 
-    message = print
+    cache = CheckCache(
+        str(Path(str(dataset.directory)) / str(dataset["FormTable"].url)) +
+        ".checks")
+    source_profile_files = {}
+
+    def message(text):
+        messages.append(text)
+        print(text)
 
     lines = []
     original_lines_of_this_source = []
     new_lines_of_this_source = []
     previous_source = None
     for line in dataset["FormTable"].iterdicts():
+        messages = []
         # Load the line's main source, that is, the first entry in the sources list.
 
         if args.match:
@@ -414,6 +461,28 @@ if __name__ == "__main__":
 
         original_lines_of_this_source.append(line.copy())
 
+        # Replay the results of an earlier run if nothing the checks depend on
+        # has changed.
+        if main_source not in source_profile_files:
+            try:
+                source_profile_files[main_source] = dataset.sources[
+                    main_source]["orthographic_profile"].split(":")
+            except KeyError:
+                source_profile_files[main_source] = None
+        key = cache.key(
+            [line[c_value], line[c_form], line[c_segments], line[c_orth]],
+            cache.profile(source_profile_files[main_source]),
+            cache.profile(language_orthography_files.get(line[c_language])),
+            args.step, args.check_stress)
+        cached = None if args.recheck else cache.get(line[c_id], key)
+        if cached is not None:
+            # The messages from before the lookup were just printed again
+            for text in cached[0][len(messages):]:
+                print(text)
+            line[c_form], line[c_segments], line[c_orth] = cached[1:]
+            new_lines_of_this_source.append(line)
+            continue
+
         if not line[c_value] or line[c_value] == '-':
             if args.step[1] == "quiet":
                 pass
@@ -446,6 +515,8 @@ if __name__ == "__main__":
             orthographic_profile = load_orthographic_profile(transducer_files)
             if orthographic_profile:
                 print(*(str(o) for o in orthographic_profile))
+            if orthographic_profile is not None:
+                orthographic_profile = FusedTransducer(orthographic_profile)
             transcription_systems[main_source] = orthographic_profile
 
         if args.step[0] == 'quiet':
@@ -465,15 +536,18 @@ if __name__ == "__main__":
                         "invalid cell containing two different forms.".format(line[c_id], line[c_value]))
 
                 # Apply substitutions to form
-                form = (line[c_value] or '').strip()
-                for transducer in orthographic_profile:
-                    form = transducer(form)
+                form = orthographic_profile((line[c_value] or '').strip())
 
             if form != line[c_form]:
-                resolutions = [drop_stress(r) for r in resolve_brackets(form)]
-                if len(resolutions) > 1 and drop_stress(line[c_form]) in resolutions:
-                    variant = resolutions.index(drop_stress(line[c_form]))
-                    resolution = list(resolve_brackets(form))[variant]
+                try:
+                    variants = BracketVariants(form, strip=True)
+                except ValueError:
+                    variants = [form]
+                    variant = None
+                else:
+                    variant = variants.index(line[c_form], drop_stress)
+                if len(variants) > 1 and variant is not None:
+                    resolution = variants[variant]
                     if len(resolution) > len(line[c_form]):
                         message("Form {:} has original value <{:}>, which contains brackets. Canonically, it would be [{:}] according to the orthography. Variant form [{:}] was given explicitly. Taking form [{:}] as compromise.".format(line[c_id], line[c_value], form, line[c_form], resolution))
                         form = resolution
@@ -481,8 +555,8 @@ if __name__ == "__main__":
                         message("Form {:} has original value <{:}>, which contains brackets. Canonically, it would be [{:}] according to the orthography. Variant form [{:}] was given explicitly.".format(line[c_id], line[c_value], form, line[c_form]))
                         form = line[c_form]
                 elif not line[c_form]:
-                    if len(resolutions) > 1:
-                        form = [drop_stress(r) for r in resolve_brackets(form)][0]
+                    if len(variants) > 1:
+                        form = drop_stress(variants[0])
                     message(
                         "Form {:} has original value <{:}>, which corresponds to"
                         " [{:}] according to the orthography; no form given."
@@ -546,9 +620,8 @@ if __name__ == "__main__":
             orth_form = line[c_orth] or ""
             match = False
             if orth_form:
-                expected_form = orth_form
-                for transducer in language_orthography:
-                    expected_form = transducer(expected_form)
+                expected_form = (language_orthography(orth_form)
+                                 if language_orthography else orth_form)
 
                 if drop_stress(expected_form) == drop_stress(line[c_form]):
                     match = True
@@ -556,8 +629,8 @@ if __name__ == "__main__":
             # If that does not work, try tranforming the form to the local
             # orthography by reverse-applying the language's orthography.
             expected_orth = line[c_form]
-            for transducer in reversed(language_orthography):
-                expected_orth = transducer.undo(expected_orth)
+            if language_orthography:
+                expected_orth = language_orthography.undo(expected_orth)
             expected_orth = expected_orth.replace("_", " ").replace("+", "-").strip()
 
             if match:
@@ -578,12 +651,15 @@ if __name__ == "__main__":
             if args.step[2] == "override" or (args.step[2] == "fill" and not line[c_orth]):
                 line[c_orth] = expected_orth
 
+        cache.put(line[c_id], key, messages,
+                  line[c_form], line[c_segments], line[c_orth])
         new_lines_of_this_source.append(line)
 
     maybe_extend(
         lines,
         new_lines_of_this_source,
         original_lines_of_this_source)
+    cache.save()
 
     if args.override != 'none':
         dataset["FormTable"].write(lines)
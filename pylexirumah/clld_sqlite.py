@@ -14,11 +14,15 @@ import os
 import argparse
 import json
 import sys
+import time
+import hashlib
 
 import pycldf
 
 import lexirumah
 import transaction
+from sqlalchemy import (
+    inspect, func, select, Table, Column, MetaData, String)
 
 from clld.scripts.util import parsed_args
 from clld.lib.bibtex import EntryType
@@ -44,6 +48,7 @@ model_is_available = True
 
 from . import get_dataset
 from .util import identifier
+from .compact_cognates import latest_assignments
 
 
 ICONS = {
@@ -320,13 +325,13 @@ def import_cognatesets(dataset, forms, bibliography, contribution, cognatesets={
     cognateset_by_formid = {}
     cognateset_forms = {}
 
-    for row in dataset["CognateTable"].iterdicts():
-        # Only incorporate the newest cognate codings, and be robust about that
+    # Only incorporate the newest cognate codings, and be robust about that
+    for form_id, row in latest_assignments(dataset).items():
         try:
             cs = cognateset_forms.setdefault(row["Cognateset_ID"], [])
-            cs.append(forms[row["Form_ID"]].name)
+            cs.append(forms[form_id].name)
             row["CognateForms"] = cs
-            cognateset_by_formid[row["Form_ID"]] = row
+            cognateset_by_formid[form_id] = row
         except KeyError:
             continue
     for row in cognateset_by_formid.values():
@@ -351,10 +356,509 @@ def import_cognatesets(dataset, forms, bibliography, contribution, cognatesets={
                 source=bibliography[source]))
 
 
-def db_main():
+# Bulk loading
+def foreign_key(cls, relationship):
+    """Name the column attribute holding the foreign key of a relationship."""
+    column, = inspect(cls).relationships[relationship].local_columns
+    return column.key
+
+
+def bulk_insert(cls, rows, chunk_size=5000, timings=None):
+    """Insert plain rows of a model class using SQLAlchemy Core.
+
+    `rows` are dicts mapping column attribute names of `cls` to values. They
+    are split over all tables of the joined table inheritance hierarchy of
+    `cls`, and inserted with `executemany` in chunks of `chunk_size`, without
+    creating any ORM objects. Primary keys are allocated consecutively after
+    the largest one already present in the base table, so they are consistent
+    across the joined tables and with objects flushed through the ORM
+    before. The polymorphic discriminator and `jsondata` are filled in as the
+    ORM would do it.
+
+    Returns
+    -------
+    list of int: The primary keys of the inserted rows, in order
+
+    """
+    start = time.perf_counter()
+    mapper = inspect(cls)
+    tables = []
+    for m in reversed(list(mapper.iterate_to_root())):
+        if m.local_table not in tables:
+            tables.append(m.local_table)
+    connection = DBSession.connection()
+    base_pk, = tables[0].primary_key.columns
+    next_pk = (connection.execute(select([func.max(base_pk)])).scalar() or 0) + 1
+
+    values = {table: [] for table in tables}
+    pks = []
+    for pk, row in enumerate(rows, next_pk):
+        pks.append(pk)
+        split = {table: {} for table in tables}
+        row.setdefault("jsondata", {})
+        for key, value in row.items():
+            column = mapper.columns[key]
+            split[column.table][column.key] = value
+        if mapper.polymorphic_on is not None:
+            split[mapper.polymorphic_on.table][mapper.polymorphic_on.key] = (
+                mapper.polymorphic_identity)
+        for table, table_values in split.items():
+            primary_key, = table.primary_key.columns
+            table_values[primary_key.key] = pk
+            values[table].append(table_values)
+
+    for table in tables:
+        for i in range(0, len(values[table]), chunk_size):
+            connection.execute(table.insert(), values[table][i:i + chunk_size])
+
+    if timings is not None:
+        timings[cls.__name__] = (len(pks), time.perf_counter() - start)
+    return pks
+
+
+def load_loans(wordlist):
+    """Map Form IDs to the highest loan status given in the BorrowingTable."""
+    loans = {}
+    for loan in wordlist["BorrowingTable"].iterdicts():
+        if loan["Status"] > loans.get(loan["Form_ID_Target"], 0):
+            loans[loan["Form_ID_Target"]] = loan["Status"]
+    return loans
+
+
+def counterpart_values(row, loans):
+    """Translate a FormTable row into the column values of its Counterpart."""
+    return {
+        "id": row["ID"],
+        "orthographic_form": row["Local_Orthography"],
+        "loan": loans.get(row["ID"], 0),
+        "comment": row["Comment"],
+        "name": row["Form"],
+        "segments": " ".join([c or '' for c in row["Segments"]])}
+
+
+def bulk_import_forms(wordlist, concepticon, languages, bibliography,
+                      contribution, timings=None):
+    """Load the forms, their value sets and references as bulk inserts.
+
+    This is the bulk counterpart of `import_forms`. The languages, sources
+    and the contribution must have been flushed to the database already, so
+    that their primary keys are known. Like through the ORM, where concepts
+    are only reached by cascade from their value sets, only the concepts
+    with forms are added to the database.
+
+    Returns
+    -------
+    dict mapping Form IDs to (primary key, form) pairs
+
+    """
+    loans = load_loans(wordlist)
+
+    valuesets = {}
+    counterparts = []
+    references = []
+    for row in wordlist["FormTable"].iterdicts():
+        language = row["Lect_ID"]
+        feature = row["Concept_ID"]
+        vsid = identifier("{:s}-{:}".format(language, feature))
+        if vsid not in valuesets:
+            valuesets[vsid] = {
+                "id": vsid,
+                foreign_key(ValueSet, "parameter"): feature,
+                foreign_key(ValueSet, "language"): languages[language].pk,
+                foreign_key(ValueSet, "contribution"): contribution.pk}
+        counterpart = counterpart_values(row, loans)
+        counterpart[foreign_key(Counterpart, "valueset")] = vsid
+        counterparts.append(counterpart)
+        references.append([
+            (bibliography[s].pk, row["Form_according_to_Source"])
+            for s in row["Source"]])
+
+    c_parameter = foreign_key(ValueSet, "parameter")
+    features = list(dict.fromkeys(
+        valueset[c_parameter] for valueset in valuesets.values()))
+    DBSession.add_all([concepticon[feature] for feature in features])
+    DBSession.flush()
+    for valueset in valuesets.values():
+        valueset[c_parameter] = concepticon[valueset[c_parameter]].pk
+
+    vs_pks = dict(zip(
+        valuesets, bulk_insert(ValueSet, valuesets.values(), timings=timings)))
+    c_valueset = foreign_key(Counterpart, "valueset")
+    for counterpart in counterparts:
+        counterpart[c_valueset] = vs_pks[counterpart[c_valueset]]
+    pks = bulk_insert(Counterpart, counterparts, timings=timings)
+
+    c_counterpart = foreign_key(CounterpartReference, "counterpart")
+    c_source = foreign_key(CounterpartReference, "source")
+    bulk_insert(CounterpartReference, (
+        {c_counterpart: pk, c_source: source, "form_given_as": given_as}
+        for pk, form_references in zip(pks, references)
+        for source, given_as in form_references), timings=timings)
+
+    return {counterpart["id"]: (pk, counterpart["name"])
+            for pk, counterpart in zip(pks, counterparts)}
+
+
+def bulk_import_cognatesets(dataset, forms, bibliography, contribution,
+                            timings=None):
+    """Load the current cognate class assignments as bulk inserts.
+
+    This is the bulk counterpart of `import_cognatesets`; `forms` is the
+    dictionary returned by `bulk_import_forms`.
+
+    """
+    assignments = [
+        row for form_id, row in latest_assignments(dataset).items()
+        if form_id in forms]
+    members = {}
+    for row in assignments:
+        members.setdefault(row["Cognateset_ID"], []).append(
+            forms[row["Form_ID"]][1])
+
+    cognateset_pks = dict(zip(members, bulk_insert(Cognateset, (
+        {"id": cognateset_id,
+         foreign_key(Cognateset, "contribution"): contribution.pk,
+         "name": sorted(names)[len(names) // 2]}
+        for cognateset_id, names in members.items()), timings=timings)))
+
+    assoc_pks = bulk_insert(CognatesetCounterpart, (
+        {foreign_key(CognatesetCounterpart, "cognateset"):
+             cognateset_pks[row["Cognateset_ID"]],
+         foreign_key(CognatesetCounterpart, "counterpart"):
+             forms[row["Form_ID"]][0],
+         "doubt": "LexStat" in row["Source"],
+         "alignment": (None if not row["Alignment"]
+                       else " ".join(row["Alignment"]))}
+        for row in assignments), timings=timings)
+
+    c_source = foreign_key(CognatesetCounterpartReference, "source")
+    bulk_insert(CognatesetCounterpartReference, (
+        {"cognatesetcounterpart_pk": pk, c_source: bibliography[source].pk}
+        for pk, row in zip(assoc_pks, assignments)
+        for source in row["Source"]), timings=timings)
+
+
+# Incremental update
+cldf_hashes = Table(
+    "cldfhash", MetaData(),
+    Column("table", String, primary_key=True),
+    Column("id", String, primary_key=True),
+    Column("hash", String))
+
+
+def chunked(sequence, size=500):
+    """Split a sequence, such as a list of keys for an IN clause, in chunks.
+
+    >>> list(chunked([1, 2, 3], 2))
+    [[1, 2], [3]]
+
+    """
+    sequence = list(sequence)
+    for i in range(0, len(sequence), size):
+        yield sequence[i:i + size]
+
+
+def row_hash(row, *extra):
+    """Hash the content of a CLDF row, and of anything else it depends on.
+
+    >>> row_hash({"ID": "a", "Form": "x"}) == row_hash({"Form": "x", "ID": "a"})
+    True
+
+    """
+    return hashlib.sha1(json.dumps(
+        [row, extra], sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def cldf_row_hashes(dataset, loans=None):
+    """Hash the FormTable rows and the current CognateTable rows by Form ID.
+
+    The hash of a form includes its loan status from the BorrowingTable.
+
+    Returns
+    -------
+    dict mapping (table, ID) pairs to hashes
+
+    """
+    if loans is None:
+        loans = load_loans(dataset)
+    hashes = {}
+    for row in dataset["FormTable"].iterdicts():
+        hashes["FormTable", row["ID"]] = row_hash(row, loans.get(row["ID"], 0))
+    for form_id, row in latest_assignments(dataset).items():
+        hashes["CognateTable", form_id] = row_hash(row)
+    return hashes
+
+
+def record_hashes(hashes):
+    """Store the row hashes of the dataset the database now represents."""
+    connection = DBSession.connection()
+    cldf_hashes.create(connection, checkfirst=True)
+    connection.execute(cldf_hashes.delete())
+    if hashes:
+        connection.execute(cldf_hashes.insert(), [
+            {"table": table, "id": id, "hash": hash}
+            for (table, id), hash in hashes.items()])
+
+
+def bulk_delete(cls, pks):
+    """Delete rows of a model class by primary key using SQLAlchemy Core.
+
+    The rows are deleted from all tables of the joined table inheritance
+    hierarchy of `cls`, most specific table first.
+
+    """
+    tables = []
+    for m in inspect(cls).iterate_to_root():
+        if m.local_table not in tables:
+            tables.append(m.local_table)
+    connection = DBSession.connection()
+    for chunk in chunked(pks):
+        for table in tables:
+            primary_key, = table.primary_key.columns
+            connection.execute(table.delete().where(primary_key.in_(chunk)))
+
+
+def pks_where(cls, column, values):
+    """Find the primary keys of all rows of `cls` with `column` in `values`."""
+    pks = []
+    for chunk in chunked(values):
+        pks.extend(pk for pk, in DBSession.query(cls.pk).filter(
+            getattr(cls, column).in_(chunk)))
+    return pks
+
+
+def refresh_cache(languages, parameters, cognatesets):
+    """Recompute cached counts of the given languages, concepts and cognate sets.
+
+    This is the part of `prime_cache` that depends on the forms, restricted to
+    the objects touched by `sync_main`: the `representation` of lects and
+    concepts (their number of value sets) and of cognate sets (their number
+    of forms), for those models which have that column.
+
+    """
+    vs_language = getattr(ValueSet, foreign_key(ValueSet, "language"))
+    vs_parameter = getattr(ValueSet, foreign_key(ValueSet, "parameter"))
+    cc_cognateset = getattr(
+        CognatesetCounterpart, foreign_key(CognatesetCounterpart, "cognateset"))
+    for cls, pks, count in [
+            (LexiRumahLanguage, languages,
+             lambda pk: DBSession.query(ValueSet).filter(vs_language == pk)),
+            (Concept, parameters,
+             lambda pk: DBSession.query(ValueSet).filter(vs_parameter == pk)),
+            (Cognateset, cognatesets,
+             lambda pk: DBSession.query(CognatesetCounterpart).filter(
+                 cc_cognateset == pk))]:
+        if not hasattr(cls, "representation"):
+            continue
+        for pk in pks:
+            obj = DBSession.query(cls).get(pk)
+            if obj is not None:
+                obj.representation = count(pk).count()
+
+
+def sync_main():
+    """Update an existing database to the current state of the dataset.
+
+    Forms and current cognate class assignments are compared with the
+    database by ID, and with the row hashes recorded when the database was
+    last built or updated (see `record_hashes`). Only added, changed and
+    deleted forms, and the value sets, references, cognate sets and cognate
+    class memberships depending on them, are written; afterwards, cached
+    counts are refreshed for the affected lects, concepts and cognate sets.
+
+    Lects, concepts and sources are not updated. If a form refers to one that
+    is not yet in the database, a ValueError is raised, and the database has
+    to be rebuilt from scratch.
+
+    Returns
+    -------
+    dict: The numbers of added, changed and deleted forms, and of re-coded
+    forms
+
+    """
+    dataset = get_dataset()
+    DBSession.flush()
+    connection = DBSession.connection()
+    cldf_hashes.create(connection, checkfirst=True)
+    recorded = {(row.table, row.id): row.hash
+                for row in connection.execute(cldf_hashes.select())}
+    loans = load_loans(dataset)
+    hashes = cldf_row_hashes(dataset, loans)
+    rows = {row["ID"]: row for row in dataset["FormTable"].iterdicts()}
+    # The current assignments were hashed above; the rows of the re-coded
+    # forms are looked up by form later, through the CognateIndex
+    assigned = {id for table, id in hashes if table == "CognateTable"}
+
+    contribution = DBSession.query(Provider).one()
+    concepts = dict(DBSession.query(Concept.id, Concept.pk))
+    languages = dict(DBSession.query(LexiRumahLanguage.id, LexiRumahLanguage.pk))
+    sources = dict(DBSession.query(LexiRumahSource.id, LexiRumahSource.pk))
+    valuesets = dict(DBSession.query(ValueSet.id, ValueSet.pk))
+
+    c_valueset = foreign_key(Counterpart, "valueset")
+    c_counterpart = foreign_key(CounterpartReference, "counterpart")
+    c_source = foreign_key(CounterpartReference, "source")
+    cc_counterpart = foreign_key(CognatesetCounterpart, "counterpart")
+    cc_cognateset = foreign_key(CognatesetCounterpart, "cognateset")
+    ccr_source = foreign_key(CognatesetCounterpartReference, "source")
+
+    db_forms = dict(DBSession.query(Counterpart.id, Counterpart.pk))
+    added = [id for id in rows if id not in db_forms]
+    deleted = [id for id in db_forms if id not in rows]
+    changed = [id for id in rows if id in db_forms and
+               recorded.get(("FormTable", id)) != hashes["FormTable", id]]
+    db_assigned = {
+        id for id, in DBSession.query(Counterpart.id).join(
+            CognatesetCounterpart,
+            getattr(CognatesetCounterpart, cc_counterpart) == Counterpart.pk)}
+    recoded = {
+        id for id in db_assigned | assigned
+        if recorded.get(("CognateTable", id)) !=
+        hashes.get(("CognateTable", id))}
+    recoded.update(added, changed, deleted)
+
+    for id in added + changed:
+        row = rows[id]
+        if row["Lect_ID"] not in languages:
+            raise ValueError("Unknown lect {:} of form {:}".format(
+                row["Lect_ID"], id))
+        if row["Concept_ID"] not in concepts:
+            raise ValueError("Unknown concept {:} of form {:}".format(
+                row["Concept_ID"], id))
+        for source in row["Source"]:
+            if source not in sources:
+                raise ValueError("Unknown source {:} of form {:}".format(
+                    source, id))
+
+    # Collect the lects and concepts before and after the update
+    affected_languages = set()
+    affected_parameters = set()
+    for chunk in chunked(db_forms[id] for id in changed + deleted):
+        for language, parameter in DBSession.query(
+                getattr(ValueSet, foreign_key(ValueSet, "language")),
+                getattr(ValueSet, foreign_key(ValueSet, "parameter"))).join(
+                    Counterpart,
+                    getattr(Counterpart, c_valueset) == ValueSet.pk).filter(
+                        Counterpart.pk.in_(chunk)):
+            affected_languages.add(language)
+            affected_parameters.add(parameter)
+
+    # Remove the cognate class memberships of re-coded forms
+    assocs = pks_where(CognatesetCounterpart, cc_counterpart,
+                       [db_forms[id] for id in recoded if id in db_forms])
+    affected_cognatesets = set()
+    for chunk in chunked(assocs):
+        affected_cognatesets.update(
+            pk for pk, in DBSession.query(
+                getattr(CognatesetCounterpart, cc_cognateset)).filter(
+                    CognatesetCounterpart.pk.in_(chunk)))
+    bulk_delete(CognatesetCounterpartReference, pks_where(
+        CognatesetCounterpartReference, "cognatesetcounterpart_pk", assocs))
+    bulk_delete(CognatesetCounterpart, assocs)
+
+    # Remove deleted forms, and the references of changed forms
+    old = [db_forms[id] for id in changed + deleted]
+    bulk_delete(CounterpartReference,
+                pks_where(CounterpartReference, c_counterpart, old))
+    bulk_delete(Counterpart, [db_forms[id] for id in deleted])
+
+    # Create missing value sets
+    new_valuesets = {}
+    for id in added + changed:
+        row = rows[id]
+        affected_languages.add(languages[row["Lect_ID"]])
+        affected_parameters.add(concepts[row["Concept_ID"]])
+        vsid = identifier("{:s}-{:}".format(row["Lect_ID"], row["Concept_ID"]))
+        if vsid not in valuesets and vsid not in new_valuesets:
+            new_valuesets[vsid] = {
+                "id": vsid,
+                foreign_key(ValueSet, "parameter"): concepts[row["Concept_ID"]],
+                foreign_key(ValueSet, "language"): languages[row["Lect_ID"]],
+                foreign_key(ValueSet, "contribution"): contribution.pk}
+    valuesets.update(zip(new_valuesets, bulk_insert(
+        ValueSet, new_valuesets.values())))
+
+    def values(id):
+        row = rows[id]
+        counterpart = counterpart_values(row, loans)
+        counterpart[c_valueset] = valuesets[identifier("{:s}-{:}".format(
+            row["Lect_ID"], row["Concept_ID"]))]
+        return counterpart
+
+    # Update changed and insert added forms, with their references
+    for id in changed:
+        counterpart = DBSession.query(Counterpart).get(db_forms[id])
+        for key, value in values(id).items():
+            setattr(counterpart, key, value)
+    DBSession.flush()
+    db_forms.update(zip(added, bulk_insert(
+        Counterpart, [values(id) for id in added])))
+    bulk_insert(CounterpartReference, (
+        {c_counterpart: db_forms[id],
+         c_source: sources[source],
+         "form_given_as": rows[id]["Form_according_to_Source"]}
+        for id in changed + added
+        for source in rows[id]["Source"]))
+
+    bulk_delete(ValueSet, [
+        pk for pk, in DBSession.query(ValueSet.pk).filter(~ValueSet.values.any())])
+
+    # Assign re-coded forms to their current cognate classes
+    cognatesets = dict(DBSession.query(Cognateset.id, Cognateset.pk))
+    coded = list(latest_assignments(
+        dataset, [id for id in recoded if id in rows]).values())
+    new_cognatesets = sorted({
+        row["Cognateset_ID"] for row in coded} - set(cognatesets))
+    cognatesets.update(zip(new_cognatesets, bulk_insert(Cognateset, (
+        {"id": cognateset_id,
+         foreign_key(Cognateset, "contribution"): contribution.pk,
+         "name": cognateset_id}
+        for cognateset_id in new_cognatesets))))
+    assoc_pks = bulk_insert(CognatesetCounterpart, (
+        {cc_cognateset: cognatesets[row["Cognateset_ID"]],
+         cc_counterpart: db_forms[row["Form_ID"]],
+         "doubt": "LexStat" in row["Source"],
+         "alignment": (None if not row["Alignment"]
+                       else " ".join(row["Alignment"]))}
+        for row in coded))
+    bulk_insert(CognatesetCounterpartReference, (
+        {"cognatesetcounterpart_pk": pk, ccr_source: sources[source]}
+        for pk, row in zip(assoc_pks, coded)
+        for source in row["Source"]))
+    DBSession.expire_all()
+
+    # Rename or remove the cognate sets whose members changed
+    affected_cognatesets.update(
+        cognatesets[row["Cognateset_ID"]] for row in coded)
+    members = {}
+    for chunk in chunked(affected_cognatesets):
+        for cognateset, name in DBSession.query(
+                getattr(CognatesetCounterpart, cc_cognateset),
+                Counterpart.name).join(
+                    Counterpart,
+                    getattr(CognatesetCounterpart, cc_counterpart) ==
+                    Counterpart.pk).filter(
+                        getattr(CognatesetCounterpart, cc_cognateset).in_(
+                            chunk)):
+            members.setdefault(cognateset, []).append(name)
+    bulk_delete(Cognateset, affected_cognatesets - set(members))
+    DBSession.expire_all()
+    for pk, names in members.items():
+        DBSession.query(Cognateset).get(pk).name = sorted(names)[
+            len(names) // 2]
+
+    refresh_cache(affected_languages, affected_parameters, members)
+    record_hashes(hashes)
+    return {"added": len(added), "changed": len(changed),
+            "deleted": len(deleted), "recoded": len(recoded)}
+
+
+def db_main(bulk=True):
     """Build the database.
 
-    Load the CLDF dataset and turn it into a SQLite dataset.
+    Load the CLDF dataset and turn it into a SQLite dataset. With `bulk`,
+    forms, references and cognate sets are inserted in batches with
+    SQLAlchemy Core instead of one ORM object at a time.
     """
     dataset = get_dataset()
 
@@ -411,22 +915,51 @@ def db_main():
     concepticon = import_concepticon(dataset)
     languages = import_languages(dataset)
     sources = import_sources(dataset, contribution=provider)
-    forms = import_forms(dataset, concepticon, languages, sources, contribution=provider)
-    cognatesets = import_cognatesets(dataset, forms, sources, contribution=provider)
+    if bulk:
+        DBSession.add(provider)
+        DBSession.flush()
+        timings = {}
+        forms = bulk_import_forms(dataset, concepticon, languages, sources,
+                                  contribution=provider, timings=timings)
+        bulk_import_cognatesets(dataset, forms, sources,
+                                contribution=provider, timings=timings)
+        for table, (rows, seconds) in timings.items():
+            print("{:s}: {:d} rows in {:.2f}s".format(table, rows, seconds))
+    else:
+        forms = import_forms(dataset, concepticon, languages, sources, contribution=provider)
+        cognatesets = import_cognatesets(dataset, forms, sources, contribution=provider)
+    DBSession.flush()
+    record_hashes(cldf_row_hashes(dataset))
 
 
 def main():
-    """Construct a new database from scratch."""
+    """Construct a new database from scratch, or update it with --sync."""
     print(os.path.join(
                   os.path.dirname(__file__),
                   "lexirumah_for_create_database.ini"))
     args = parsed_args(
+        (("--orm",), dict(
+            action="store_true", default=False,
+            help="Create forms and cognate sets through the ORM, one object"
+            " at a time, instead of bulk inserts")),
+        (("--sync",), dict(
+            action="store_true", default=False,
+            help="Update the existing database with the changes to the"
+            " forms and cognate classes since it was built, instead of"
+            " building it from scratch")),
         args=[os.path.join(
                   os.path.dirname(__file__),
-                  "lexirumah_for_create_database.ini")])
+                  "lexirumah_for_create_database.ini")] + sys.argv[1:])
+
+    if args.sync:
+        with transaction.manager:
+            changes = sync_main()
+        print("{added:d} forms added, {changed:d} changed, {deleted:d} deleted,"
+              " {recoded:d} re-coded.".format(**changes))
+        return
 
     with transaction.manager:
-        db_main()
+        db_main(bulk=not args.orm)
     with transaction.manager:
         prime_cache(args)
 
@@ -1,59 +1,271 @@
 #!/usr/bin/env python
 
-from bisect import bisect
+"""Compare the cognate classes of concepts across clades.
+
+For every concept, list the cognate classes that are shared by all clades and
+those that are attested in only some of them, and rank concepts by stability,
+that is, by how few cognate classes they have across all groups of lects.
+
+Groups are given as Glottolog clades, from which other clades can be excluded
+with '-': `lama1292-alor1247` is Lamaholot without Alorese. Lects in none of
+the clades form an additional group, which counts towards stability, but is
+not compared.
+
+Example
+-------
+    $ python -m pylexirumah.cognate_classes_below lama1292-alor1247 alor1247
+"""
+
+import argparse
+from collections import OrderedDict
+
+import numpy
 
 from clldutils.path import Path
-from .util import glottolog_clade, get_dataset, lexirumah_glottocodes
-
-repository = (Path(__file__).parent.parent /
-              "cldf" / "Wordlist-metadata.json")
-
-lexirumah = get_dataset(repository)
-cognateclass_by_form = {}
-for cognate in lexirumah["CognateTable"].iterdicts():
-    cognateclass_by_form[cognate["Form_ID"]] = cognate["Cognateset_ID"]
-
-groups = [set(lexirumah_glottocodes(lexirumah)),
-          glottolog_clade("lama1292", lexirumah),
-          glottolog_clade("alor1247", lexirumah)]
-groups[1] -= groups[2]
-groups[0] -= groups[1]
-groups[0] -= groups[2]
-
-attested_cognate_sets = {}
-
-cognates_by_class = {}
-for form in lexirumah["FormTable"].iterdicts():
-    concept = form["Concept_ID"]
-    lect = form["Lect_ID"]
-    cognates_by_class.setdefault(
-        cognateclass_by_form.get(form["ID"]), set()).add(
-        (concept, lect, form["Form"]))
-    for g, group in enumerate(groups):
-        if lect in group:
-            concept_classes = attested_cognate_sets.setdefault(
-                concept, [set() for g_ in groups])[g]
-            concept_classes.add(cognateclass_by_form.get(form["ID"]))
-
-concepts = []
-concept_stability = []
-for concept, concept_classes in attested_cognate_sets.items():
-    order = len(
-        set.union(*concept_classes))
-    i = bisect(concept_stability, order)
-    concepts.insert(i, concept)
-    concept_stability.insert(i, order)
-
-for concept in concepts:
-    concept_classes = attested_cognate_sets[concept][1:]
-    intersection = set.intersection(*concept_classes)
-    if set.union(*concept_classes) == intersection:
-        del attested_cognate_sets[concept]
-    else:
+
+from pylexirumah import get_dataset, repository
+from pylexirumah.util import glottolog_clade, lexirumah_glottocodes
+from pylexirumah.check_cognate_coding import factorize
+from pylexirumah.compact_cognates import latest_assignments
+
+
+class CladeStability:
+    """The incidence of cognate classes in groups of lects, by concept.
+
+    Cognate classes are integer-coded per concept, like in
+    `check_cognate_coding.contingency_tables`, and `incidence[k, g]` says
+    whether class k is attested in group g. All statistics are computed from
+    this matrix for all concepts at once. Forms without a cognate class are
+    ignored.
+
+    Parameters
+    ----------
+    concepts, classes, lects : sequences
+        Parallel, with the concept, cognate class and lect of every form
+    groups : dict mapping group names to sets of lect IDs
+        The groups may overlap.
+
+    >>> s = CladeStability(
+    ...     ["eye", "eye", "eye", "leg", "leg"], [1, 1, 2, 3, 3],
+    ...     ["a", "b", "c", "a", "b"],
+    ...     OrderedDict([("A", {"a"}), ("B", {"b", "c"})]))
+    >>> s.concepts, s.union().tolist(), s.intersection().tolist()
+    (['eye', 'leg'], [2, 1], [1, 1])
+    >>> s.exclusive().tolist()
+    [[0, 1], [0, 0]]
+    >>> s.ranked()
+    [('leg', 1, 1), ('eye', 2, 1)]
+
+    """
+    def __init__(self, concepts, classes, lects, groups):
+        self.groups = list(groups)
+        coded = [(c, k, l) for c, k, l in zip(concepts, classes, lects)
+                 if k is not None]
+        concept_ids = OrderedDict()
+        concept_codes = numpy.array(
+            [concept_ids.setdefault(c, len(concept_ids)) for c, k, l in coded],
+            dtype=numpy.int64)
+        self.concepts = list(concept_ids)
+        class_codes = factorize((c, k) for c, k, l in coded)
+        self.class_names = [None] * (
+            class_codes.max() + 1 if len(class_codes) else 0)
+        for (c, k, l), code in zip(coded, class_codes):
+            self.class_names[code] = k
+        self.class_concept = numpy.zeros(len(self.class_names), numpy.int64)
+        self.class_concept[class_codes] = concept_codes
+
+        # Which lect belongs to which groups, as (lect, group) coordinates
+        lect_ids = {}
+        lect_codes = numpy.array(
+            [lect_ids.setdefault(l, len(lect_ids)) for c, k, l in coded],
+            dtype=numpy.int64)
+        member_lect, member_group = numpy.array(
+            [(lect_ids[l], g)
+             for g, name in enumerate(self.groups) for l in groups[name]
+             if l in lect_ids],
+            dtype=numpy.int64).reshape(-1, 2).T
+        membership = numpy.zeros((len(lect_ids), len(self.groups)), bool)
+        membership[member_lect, member_group] = True
+
+        # Class × group incidence: OR over the forms of each class
+        self.incidence = numpy.zeros(
+            (len(self.class_names), len(self.groups)), bool)
+        pairs = numpy.unique(class_codes * len(lect_ids) + lect_codes)
+        numpy.logical_or.at(self.incidence, pairs // max(len(lect_ids), 1),
+                            membership[pairs % max(len(lect_ids), 1)])
+
+    def _select(self, groups):
+        if groups is None:
+            return self.incidence
+        return self.incidence[:, [self.groups.index(g) for g in groups]]
+
+    def _per_concept(self, classes):
+        return numpy.bincount(self.class_concept[classes],
+                              minlength=len(self.concepts))
+
+    def per_group(self):
+        """Count the classes of every concept in every group.
+
+        Returns
+        -------
+        numpy.array of shape (concepts, groups)
+
+        """
+        classes, groups = numpy.nonzero(self.incidence)
+        return numpy.bincount(
+            self.class_concept[classes] * len(self.groups) + groups,
+            minlength=len(self.concepts) * len(self.groups)).reshape(
+                len(self.concepts), len(self.groups))
+
+    def union(self, groups=None):
+        """Count the classes of every concept attested in any of the groups."""
+        return self._per_concept(self._select(groups).any(1))
+
+    def intersection(self, groups=None):
+        """Count the classes of every concept attested in all of the groups."""
+        return self._per_concept(self._select(groups).all(1))
+
+    def exclusive(self, groups=None):
+        """Count the classes of every concept attested in only one group.
+
+        Returns
+        -------
+        numpy.array of shape (concepts, groups)
+
+        """
+        incidence = self._select(groups)
+        classes, g = numpy.nonzero(incidence & (
+            incidence.sum(1) == 1)[:, None])
+        return numpy.bincount(
+            self.class_concept[classes] * incidence.shape[1] + g,
+            minlength=len(self.concepts) * incidence.shape[1]).reshape(
+                len(self.concepts), incidence.shape[1])
+
+    def ranked(self, groups=None):
+        """Rank concepts from the most to the least stable.
+
+        Concepts with fewer classes in all groups together are more stable;
+        ties are broken by more classes shared between all groups.
+
+        Returns
+        -------
+        list of (concept, union, intersection) triples
+
+        """
+        union = self.union(groups)
+        intersection = self.intersection(groups)
+        order = numpy.lexsort((-intersection, union))
+        return [(self.concepts[i], int(union[i]), int(intersection[i]))
+                for i in order]
+
+    def classes(self, concept, groups=None):
+        """List the classes of a concept shared by all groups, and by group.
+
+        Returns
+        -------
+        (list, OrderedDict): The shared classes, and for every group the
+        classes attested in it but not shared by all groups
+
+        """
+        groups = self.groups if groups is None else groups
+        incidence = self._select(groups)
+        mine = self.class_concept == self.concepts.index(concept)
+        shared = mine & incidence.all(1)
+        return ([self.class_names[k] for k in numpy.flatnonzero(shared)],
+                OrderedDict(
+                    (g, [self.class_names[k] for k in numpy.flatnonzero(
+                        mine & incidence[:, i] & ~shared)])
+                    for i, g in enumerate(groups)))
+
+
+def clade_stability(dataset, groups):
+    """Compute the `CladeStability` of the current cognate classes.
+
+    Parameters
+    ----------
+    dataset : pycldf.Wordlist
+    groups : dict mapping group names to sets of lect IDs
+
+    """
+    cognateclass_by_form = {
+        form: row["Cognateset_ID"]
+        for form, row in latest_assignments(dataset).items()}
+    forms = list(dataset["FormTable"].iterdicts())
+    return CladeStability(
+        [form["Concept_ID"] for form in forms],
+        [cognateclass_by_form.get(form["ID"]) for form in forms],
+        [form["Lect_ID"] for form in forms],
+        groups)
+
+
+def clade_groups(dataset, clades):
+    """Resolve clade specifications like 'lama1292-alor1247' to lect sets.
+
+    Returns
+    -------
+    OrderedDict mapping the specifications to sets of lect IDs, with the
+    lects in none of them in an additional group named ''
+
+    """
+    groups = OrderedDict()
+    for spec in clades:
+        code, *excluded = spec.split("-")
+        groups[spec] = set(glottolog_clade(code, dataset))
+        for other in excluded:
+            groups[spec] -= set(glottolog_clade(other, dataset))
+    rest = set(lexirumah_glottocodes(dataset, {}))
+    for lects in groups.values():
+        rest -= lects
+    groups[""] = rest
+    return groups
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "clades", nargs="*", default=["lama1292-alor1247", "alor1247"],
+        help="Glottocodes of the clades to compare, optionally excluding"
+        " subclades with '-' (default: lama1292-alor1247 alor1247)")
+    parser.add_argument(
+        "--cldf", type=Path, default=repository,
+        help="CLDF metadata file of the dataset (default: LexiRumah)")
+    parser.add_argument(
+        "--ranking", action="store_true", default=False,
+        help="Only print the concepts ranked by stability")
+    args = parser.parse_args()
+
+    dataset = get_dataset(args.cldf)
+    stability = clade_stability(dataset, clade_groups(dataset, args.clades))
+
+    if args.ranking:
+        for concept, union, intersection in stability.ranked():
+            print(concept, union, intersection, sep="\t")
+        parser.exit()
+
+    members = {}
+    for form in dataset["FormTable"].iterdicts():
+        members.setdefault(form["Concept_ID"], []).append(
+            (form["Lect_ID"], form["Form"], form["ID"]))
+    cognateclass_by_form = {
+        form: row["Cognateset_ID"]
+        for form, row in latest_assignments(dataset).items()}
+
+    def show(concept, cognateclass, indent):
+        print(indent, {(concept, lect, value)
+                       for lect, value, id in members[concept]
+                       if cognateclass_by_form.get(id) == cognateclass})
+
+    union = stability.union(args.clades)
+    intersection = stability.intersection(args.clades)
+    for concept, _, _ in stability.ranked():
+        i = stability.concepts.index(concept)
+        if union[i] == intersection[i]:
+            continue
         print(concept)
-        for cognateclass in intersection:
-            print("", cognates_by_class[cognateclass])
-        for g, classes in enumerate(concept_classes):
+        shared, by_clade = stability.classes(concept, args.clades)
+        for cognateclass in shared:
+            show(concept, cognateclass, "")
+        for g, classes in enumerate(by_clade.values()):
             print("", g)
-            for cognateclass in classes - intersection:
-                print(" ", cognates_by_class[cognateclass])
+            for cognateclass in classes:
+                show(concept, cognateclass, " ")
@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+
+"""Compact the append-only CognateTable to one current row per form.
+
+The CognateTable of LexiRumah is append-only: Every merge of Edictor changes
+(see `append_changed_cognate_classes.py`) adds new rows, and the newest row
+for a form is its current cognate class assignment. This script rewrites the
+table to contain only those current rows, moves all superseded rows to a
+separate history file, and builds a persistent Form_ID → row index, so that
+readers can look up the current assignment of a form without a full scan.
+
+Example
+-------
+    $ python -m pylexirumah.compact_cognates cldf/cldf-metadata.json
+"""
+
+import csv
+import json
+import argparse
+from collections import OrderedDict
+
+from clldutils.path import Path
+
+from pylexirumah import get_dataset, repository
+
+
+def latest_assignments(dataset, forms=None):
+    """Load the current cognate class assignment for every form.
+
+    The CognateTable is read from top to bottom, later rows for the same form
+    replace earlier ones. If only some `forms` are wanted, their rows are
+    looked up through the `CognateIndex` instead.
+
+    Parameters
+    ----------
+    dataset : pycldf.Wordlist
+    forms : iterable of str, optional
+        The Form IDs to load the assignments of (default: all)
+
+    Returns
+    -------
+    OrderedDict mapping Form IDs to CognateTable rows (dicts)
+
+    """
+    if forms is not None:
+        return OrderedDict(CognateIndex(dataset).rows(forms))
+    c_form = dataset["CognateTable", "formReference"].name
+    current = OrderedDict()
+    for row in dataset["CognateTable"].iterdicts():
+        current.pop(row[c_form], None)
+        current[row[c_form]] = row
+    return current
+
+
+def rows_with_offsets(path, encoding="utf-8"):
+    """Read a CSV file, yielding the byte offset of each row with the row.
+
+    The header row is not yielded.
+
+    >>> import tempfile
+    >>> f = Path(tempfile.mkdtemp()) / "x.csv"
+    >>> _ = f.open("w").write('A,B\\n1,"x\\ny"\\n2,z\\n')
+    >>> list(rows_with_offsets(f))
+    [(4, ['1', 'x\\ny']), (12, ['2', 'z'])]
+
+    """
+    offsets = []
+
+    def lines():
+        offset = 0
+        with path.open("rb") as binary:
+            for line in binary:
+                offsets.append(offset)
+                offset += len(line)
+                yield line.decode(encoding)
+
+    reader = csv.reader(lines())
+    next(reader)
+    consumed = len(offsets)
+    for row in reader:
+        yield offsets[consumed], row
+        consumed = len(offsets)
+
+
+class CognateIndex:
+    """A persistent index from Form_ID to the current CognateTable row.
+
+    The index is stored as JSON next to the CognateTable, and remembers the
+    size and modification time of the table it was built from. If the table
+    has changed since – for example because new Edictor changes were appended
+    – the index is rebuilt on first access.
+
+    >>> index = CognateIndex(get_dataset())  # doctest: +SKIP
+    >>> index["abui1241-fuime-leg-1"]["Cognateset_ID"]  # doctest: +SKIP
+    'leg-1'
+
+    """
+    def __init__(self, dataset, index_file=None):
+        self.table = dataset["CognateTable"]
+        self.path = Path(str(dataset.directory)) / str(self.table.url)
+        self.index_file = Path(index_file or str(self.path) + ".idx")
+        self.c_form = dataset["CognateTable", "formReference"].name
+        self._offsets = None
+
+    def stamp(self):
+        stat = self.path.stat()
+        return [stat.st_size, stat.st_mtime_ns]
+
+    @property
+    def offsets(self):
+        if self._offsets is None:
+            try:
+                with self.index_file.open(encoding="utf-8") as index:
+                    data = json.load(index)
+                if data["stamp"] == self.stamp():
+                    self._offsets = data["offsets"]
+            except (OSError, ValueError, KeyError):
+                pass
+        if self._offsets is None:
+            self.build()
+        return self._offsets
+
+    def build(self):
+        """Scan the CognateTable and write the index file."""
+        columns = [c.name for c in self.table.tableSchema.columns]
+        form_column = columns.index(self.c_form)
+        self._offsets = {}
+        for offset, row in rows_with_offsets(self.path):
+            self._offsets[row[form_column]] = offset
+        with self.index_file.open("w", encoding="utf-8") as index:
+            json.dump({"stamp": self.stamp(), "offsets": self._offsets}, index)
+        return self._offsets
+
+    def __contains__(self, form_id):
+        return form_id in self.offsets
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __iter__(self):
+        return iter(self.offsets)
+
+    def __getitem__(self, form_id):
+        """Read the current CognateTable row of the form from disk."""
+        if form_id not in self.offsets:
+            raise KeyError(form_id)
+        return dict(self.rows([form_id]))[form_id]
+
+    def rows(self, form_ids):
+        """Read the current rows of some forms, in the order of the table.
+
+        Forms without a row are skipped.
+
+        """
+        offsets = sorted(
+            (self.offsets[form], form) for form in set(form_ids)
+            if form in self.offsets)
+        with self.path.open("rb") as binary:
+            for offset, form in offsets:
+                binary.seek(offset)
+                lines = (line.decode("utf-8") for line in binary)
+                raw = next(csv.reader(lines))
+                yield form, OrderedDict(
+                    (column.name, column.read(value))
+                    for column, value in zip(
+                        self.table.tableSchema.columns, raw))
+
+    def get(self, form_id, default=None):
+        try:
+            return self[form_id]
+        except KeyError:
+            return default
+
+
+def compact(dataset, history=None):
+    """Rewrite the CognateTable to contain only the current assignments.
+
+    All superseded rows are appended to the `history` CSV file (by default
+    `cognates-history.csv` next to the CognateTable), which has the same
+    columns as the CognateTable.
+
+    Returns
+    -------
+    (int, int): The number of rows kept and the number of rows archived
+
+    """
+    table = dataset["CognateTable"]
+    c_form = dataset["CognateTable", "formReference"].name
+    columns = table.tableSchema.columns
+    if history is None:
+        history = Path(str(dataset.directory)) / "cognates-history.csv"
+
+    all_rows = list(table.iterdicts())
+    newest = {row[c_form]: r for r, row in enumerate(all_rows)}
+    current = [row for r, row in enumerate(all_rows)
+               if newest[row[c_form]] == r]
+    superseded = [row for r, row in enumerate(all_rows)
+                  if newest[row[c_form]] != r]
+
+    new_file = not history.exists()
+    with history.open("a", encoding="utf-8", newline="") as archive:
+        writer = csv.writer(archive)
+        if new_file:
+            writer.writerow([c.name for c in columns])
+        for row in superseded:
+            writer.writerow([c.write(row[c.name]) for c in columns])
+
+    table.write(current)
+    CognateIndex(dataset).build()
+    return len(current), len(superseded)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "cldf", nargs="?", type=Path, default=repository,
+        help="CLDF metadata file for the dataset to be compacted"
+        " (default: LexiRumah)")
+    parser.add_argument(
+        "--history", type=Path, default=None,
+        help="CSV file to append the superseded rows to"
+        " (default: cognates-history.csv next to the CognateTable)")
+    parser.add_argument(
+        "--index-only", action="store_true", default=False,
+        help="Do not rewrite the CognateTable, only rebuild the index")
+    args = parser.parse_args()
+
+    dataset = get_dataset(args.cldf)
+    if args.index_only:
+        print("Indexed {:d} forms.".format(len(CognateIndex(dataset).build())))
+    else:
+        kept, archived = compact(dataset, history=args.history)
+        print("Kept {:d} current rows, archived {:d} superseded rows.".format(
+            kept, archived))
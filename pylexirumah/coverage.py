@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+
+"""Which concepts are attested for which lects, as a packed bitmap.
+
+A `Coverage` holds one row of bits per lect and one bit per concept, packed
+into bytes with `numpy.packbits`: one bitmap for the forms of the FormTable
+(attested), and one for the entries of the ValueTable (concepts checked, but
+missing from the source). Coverage per lect, per concept and per clade, and
+the concepts attested in at least k lects, are computed for all lects or
+concepts at once with vectorized operations on the bitmaps.
+
+Example
+-------
+    $ python -m pylexirumah.coverage --min-lects 100
+    $ python -m pylexirumah.coverage --missing abui1241-takal
+"""
+
+import argparse
+from collections import OrderedDict
+
+import numpy
+
+from clldutils.path import Path
+
+from pylexirumah import get_dataset, repository
+
+# Number of set bits of every byte value
+POPCOUNT = numpy.unpackbits(
+    numpy.arange(256, dtype=numpy.uint8)[:, None], axis=1).sum(1)
+
+
+class Coverage:
+    """Packed lect × concept bitmaps of attested and missing concepts.
+
+    Parameters
+    ----------
+    lects : list of str
+    concepts : list of str
+    pairs : iterable of (lect, concept)
+        The attested lect-concept pairs
+    missing : iterable of (lect, concept), optional
+        Lect-concept pairs explicitly recorded as missing
+
+    >>> c = Coverage(["a", "b"], ["x", "y", "z"],
+    ...              [("a", "x"), ("a", "y"), ("b", "x")], [("b", "z")])
+    >>> c.per_lect().tolist(), c.per_concept().tolist()
+    ([2, 1], [2, 1, 0])
+    >>> c.concepts_attested_in(2), c.unattested("b"), c.missing("b")
+    (['x'], ['y', 'z'], ['z'])
+    >>> c.per_clade({"all": ["a", "b"]})["all"].tolist()
+    [True, True, False]
+
+    """
+    def __init__(self, lects, concepts, pairs, missing=()):
+        self.lects = list(lects)
+        self.concepts = list(concepts)
+        self.lect_index = {l: i for i, l in enumerate(self.lects)}
+        self.concept_index = {c: i for i, c in enumerate(self.concepts)}
+        self.attested_bits = self._pack(pairs)
+        self.missing_bits = self._pack(missing)
+
+    def _pack(self, pairs):
+        dense = numpy.zeros((len(self.lects), len(self.concepts)), dtype=bool)
+        rows, columns = [], []
+        for lect, concept in pairs:
+            rows.append(self.lect_index[lect])
+            columns.append(self.concept_index[concept])
+        dense[rows, columns] = True
+        return numpy.packbits(dense, axis=1)
+
+    @classmethod
+    def from_dataset(cls, dataset):
+        """Build the coverage bitmaps of a CLDF wordlist.
+
+        Lects and concepts are taken in the order of the LanguageTable and
+        ParameterTable, followed by any others that only occur in forms.
+
+        """
+        def references(table):
+            try:
+                rows = dataset[table]
+            except KeyError:
+                return []
+            c_lect = dataset[table, "languageReference"].name
+            c_concept = dataset[table, "parameterReference"].name
+            return [(row[c_lect], row[c_concept]) for row in rows.iterdicts()]
+
+        def ids(table):
+            try:
+                return [row[dataset[table, "id"].name]
+                        for row in dataset[table].iterdicts()]
+            except KeyError:
+                return []
+
+        pairs = references(dataset.primary_table)
+        missing = references("ValueTable") if (
+            dataset.primary_table != "ValueTable") else []
+        lects = OrderedDict.fromkeys(ids("LanguageTable"))
+        concepts = OrderedDict.fromkeys(ids("ParameterTable"))
+        for lect, concept in pairs + missing:
+            lects.setdefault(lect)
+            concepts.setdefault(concept)
+        return cls(lects, concepts, pairs, missing)
+
+    def _unpack(self, bits):
+        return numpy.unpackbits(
+            bits, axis=1, count=len(self.concepts)).astype(bool)
+
+    def attested(self, lect, concept):
+        i, j = self.lect_index[lect], self.concept_index[concept]
+        return bool(self.attested_bits[i, j // 8] & (0x80 >> (j % 8)))
+
+    def per_lect(self):
+        """Count the attested concepts of every lect."""
+        return POPCOUNT[self.attested_bits].sum(1)
+
+    def per_concept(self):
+        """Count the lects attesting every concept."""
+        return self._unpack(self.attested_bits).sum(0)
+
+    def per_clade(self, clades):
+        """Find the concepts attested in any lect of each clade.
+
+        Parameters
+        ----------
+        clades : dict mapping clade names to lists of lect IDs
+
+        Returns
+        -------
+        dict mapping clade names to boolean arrays over the concepts
+
+        """
+        result = OrderedDict()
+        for clade, lects in clades.items():
+            rows = [self.lect_index[l] for l in lects if l in self.lect_index]
+            bits = numpy.bitwise_or.reduce(
+                self.attested_bits[rows], axis=0) if rows else (
+                    numpy.zeros(self.attested_bits.shape[1], numpy.uint8))
+            result[clade] = self._unpack(bits[None, :])[0]
+        return result
+
+    def concepts_attested_in(self, k):
+        """List the concepts attested in at least k lects."""
+        return [self.concepts[j]
+                for j in numpy.flatnonzero(self.per_concept() >= k)]
+
+    def unattested(self, lect):
+        """List the concepts without forms for a lect."""
+        row = self._unpack(self.attested_bits[[self.lect_index[lect]]])[0]
+        return [self.concepts[j] for j in numpy.flatnonzero(~row)]
+
+    def missing(self, lect):
+        """List the concepts recorded as missing from the sources of a lect."""
+        row = self._unpack(self.missing_bits[[self.lect_index[lect]]])[0]
+        return [self.concepts[j] for j in numpy.flatnonzero(row)]
+
+
+def families(dataset):
+    """Group the lects of a dataset by their Family."""
+    clades = OrderedDict()
+    for lect in dataset["LanguageTable"].iterdicts():
+        clades.setdefault(lect.get("Family") or "", []).append(lect["ID"])
+    return clades
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--cldf", type=Path, default=repository,
+        help="CLDF metadata file of the dataset (default: LexiRumah)")
+    parser.add_argument(
+        "--min-lects", type=int, default=None,
+        help="List the concepts attested in at least this many lects")
+    parser.add_argument(
+        "--missing", nargs="+", default=None, metavar="LECT",
+        help="List the concepts without forms for these lects")
+    parser.add_argument(
+        "--families", action="store_true", default=False,
+        help="Show the number of concepts attested in each family")
+    args = parser.parse_args()
+
+    dataset = get_dataset(args.cldf)
+    coverage = Coverage.from_dataset(dataset)
+    if args.min_lects is not None:
+        for concept in coverage.concepts_attested_in(args.min_lects):
+            print(concept)
+    elif args.missing:
+        for lect in args.missing:
+            recorded = set(coverage.missing(lect))
+            for concept in coverage.unattested(lect):
+                print(lect, concept,
+                      "missing from source" if concept in recorded else "",
+                      sep="\t")
+    elif args.families:
+        for family, attested in coverage.per_clade(families(dataset)).items():
+            print(family, attested.sum(), sep="\t")
+    else:
+        for lect, n in zip(coverage.lects, coverage.per_lect()):
+            print(lect, n, sep="\t")
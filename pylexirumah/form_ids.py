@@ -0,0 +1,146 @@
+"""Allocate IDs for new forms and append them to the dataset.
+
+Form IDs in LexiRumah have the shape `{Lect_ID}-{Concept_ID}-{n}`, where n
+counts the synonyms of a lect for a concept. Instead of reading the whole
+FormTable to find the next free n whenever a word list is imported, a
+`SynonymAllocator` keeps the highest n of every (lect, concept) pair in a JSON
+file next to the FormTable. Together with `append_rows`, which adds rows to
+the end of a table file instead of rewriting it, importing a word list only
+costs time proportional to its own size.
+"""
+
+import csv
+import json
+
+from clldutils.path import Path
+
+ID_FORMAT = "{:}-{:}-{:d}"
+
+# The tables whose IDs follow ID_FORMAT and are allocated together
+TABLES = ["FormTable", "ValueTable"]
+
+
+def table_path(dataset, table):
+    return Path(str(dataset.directory)) / str(dataset[table].url)
+
+
+def synonym_index(row):
+    """Parse the synonym index from the ID of a form, if it has one.
+
+    >>> synonym_index({"ID": "abui1241-fuime-leg-2", "Lect_ID": "abui1241-fuime",
+    ...                "Concept_ID": "leg"})
+    2
+    >>> synonym_index({"ID": "6072", "Lect_ID": "bima1247", "Concept_ID": "leg"})
+
+    """
+    prefix = "{:}-{:}-".format(row["Lect_ID"], row["Concept_ID"])
+    if row["ID"].startswith(prefix) and row["ID"][len(prefix):].isdigit():
+        return int(row["ID"][len(prefix):])
+    return None
+
+
+class SynonymAllocator:
+    """A persistent allocator of new form IDs.
+
+    The state is stored as JSON (by default in `forms.csv.ids` next to the
+    FormTable), together with the size and modification time of the tables
+    it was computed from. If the tables were changed by anything else than
+    `append_rows` followed by `save`, the state is recomputed from the tables
+    on first use.
+
+    IDs are never reused: the next ID of a (lect, concept) pair follows the
+    highest synonym index ever seen, not the number of forms.
+
+    """
+    def __init__(self, dataset, state_file=None):
+        self.dataset = dataset
+        self.tables = [t for t in TABLES if self._has_table(t)]
+        self.state_file = Path(
+            state_file or str(table_path(dataset, "FormTable")) + ".ids")
+        self._highest = None
+
+    def _has_table(self, table):
+        try:
+            self.dataset[table]
+        except KeyError:
+            return False
+        return True
+
+    def stamp(self):
+        stamp = []
+        for table in self.tables:
+            stat = table_path(self.dataset, table).stat()
+            stamp.append([stat.st_size, stat.st_mtime_ns])
+        return stamp
+
+    @property
+    def highest(self):
+        if self._highest is None:
+            try:
+                with self.state_file.open(encoding="utf-8") as state:
+                    data = json.load(state)
+                if data["stamp"] == self.stamp():
+                    self._highest = {
+                        tuple(key.split("\t")): n
+                        for key, n in data["highest"].items()}
+            except (OSError, ValueError, KeyError):
+                pass
+        if self._highest is None:
+            self.scan()
+        return self._highest
+
+    def scan(self):
+        """Recompute the highest synonym indices from the tables."""
+        self._highest = {}
+        for table in self.tables:
+            for row in self.dataset[table].iterdicts():
+                n = synonym_index(row)
+                if n is not None:
+                    key = row["Lect_ID"], row["Concept_ID"]
+                    self._highest[key] = max(self._highest.get(key, 0), n)
+        return self._highest
+
+    def allocate(self, lect, concept):
+        """Reserve and return the next free ID for a form."""
+        key = lect, concept
+        self.highest[key] = self.highest.get(key, 0) + 1
+        return ID_FORMAT.format(lect, concept, self.highest[key])
+
+    def save(self):
+        """Store the state, stamped with the current state of the tables.
+
+        Call this after the rows with the allocated IDs have been written.
+
+        """
+        with self.state_file.open("w", encoding="utf-8") as state:
+            json.dump({
+                "stamp": self.stamp(),
+                "highest": {"\t".join(key): n
+                            for key, n in self.highest.items()}}, state)
+
+
+def append_rows(dataset, table, rows):
+    """Append rows (dicts) to the file of a table, without rewriting it.
+
+    Returns
+    -------
+    int: The number of rows appended
+
+    """
+    path = table_path(dataset, table)
+    columns = dataset[table].tableSchema.columns
+    with path.open("rb") as binary:
+        binary.seek(0, 2)
+        needs_newline = binary.tell() > 0
+        if needs_newline:
+            binary.seek(-1, 2)
+            needs_newline = binary.read(1) != b"\n"
+    n = 0
+    with path.open("a", encoding="utf-8", newline="") as file:
+        if needs_newline:
+            file.write("\n")
+        writer = csv.writer(file, lineterminator="\n")
+        for row in rows:
+            writer.writerow([c.write(row.get(c.name)) for c in columns])
+            n += 1
+    return n
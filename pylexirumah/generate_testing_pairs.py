@@ -1,108 +1,308 @@
-import bisect
+#!/usr/bin/env python
+
+"""Sample pairs of forms for manual cognate judgement, ranked by distance
+
+For every concept, pairs of forms in the same cognate class (positives) and in
+different cognate classes (negatives) are drawn by reservoir sampling, before
+any alignment is computed. Only the sampled pairs are aligned, and the scored
+pairs of all concepts are merged into one list sorted by distance.
+"""
+
+import sys
+import math
+import heapq
 import random
+import argparse
 import itertools
 import collections
 
 import lingpy
 import lingpy.compare.partial
+from clldutils.path import Path
 
-from . import get_dataset
+from pylexirumah import get_dataset, repository
+from pylexirumah.score_store import ScoreStore, fingerprint, file_fingerprint
 
-lexirumah = get_dataset()
+# The lects we have worked on most, which used to be the only ones sampled.
+FAMILIAR_LANGUAGES = {
+    "koto1251", "lama1277-kalik", "alor1247-besar", "alor1247-pandai",
+    "sika1262-tanai", "abui1241-takal", "kaer1234",
+    "pura1258", "adan1251-otvai", "kelo1247-bring"}
 
-lex = lingpy.compare.partial.Partial("lexstats.tsv",
-        col="lect_id", row="concept_id", segments="segments", transcription="form")
+Form = collections.namedtuple(
+    "Form", ["id", "lect", "segments", "cognateset", "row", "concept"])
 
-assigned_to_cognateset = {}
-for entry in lexirumah["CognateTable"].iterdicts():
-    assigned_to_cognateset[entry["Form_ID"]] = entry["Cognateset_ID"]
 
-lex_by_id = {
-    lex[row][lex.header["id"]]: row
-    for row in lex}
+def reservoir_sample(iterable, k, rng=random):
+    """Draw a uniform sample of at most k elements from an iterable.
 
-familiar_languages = {
-    "koto1251", "lama1277-kalik", "alor1247-besar", "alor1247-pandai",
-    "lama1277-kalik", "sika1262-tanai", "abui1241-takal", "kaer1234",
-    "pura1258", "adan1251-otvai", "kelo1247-bring"}
+    This is Li's Algorithm L: after the reservoir is filled, it skips ahead
+    by geometrically distributed gaps, so it only ever holds k elements and
+    touches O(k log(n/k)) random numbers. If k is None, all elements are
+    returned.
 
-indonesian_loans = set()
-
-forms_by_concept = {}
-for form in lexirumah["FormTable"].iterdicts():
-    id = form["ID"]
-    concept = form["Concept_ID"]
-    row = lex_by_id.get(str(id))
-
-    segments = form["Segments"]
-    if not segments:
-        continue
-    lect = form["Lect_ID"]
-
-    if lect == "indo1316-lexi":
-        indonesian_loans.add(assigned_to_cognateset.get(id))
-    if lect not in familiar_languages:
-        continue
-
-    forms_by_concept.setdefault(concept, []).append(
-        (id,
-         lect,
-         segments,
-         assigned_to_cognateset.get(id),
-         row,
-         concept)
-    )
-
-lects = collections.defaultdict(
-    lambda: "Austronesian",
-    {row["ID"]: row["Family"] for row in lexirumah["LanguageTable"].iterdicts()})
-
-pairs = {True: [],
-         False: []}
-distances = {True: [],
-             False: []}
-for concept, forms in forms_by_concept.items():
-    for f1, f2 in itertools.combinations(forms, 2):
-        if f1[2] == f2[2]:
-            continue
-        same_class = (f1[3] == f2[3] and f1[3] is not None)
-        if not same_class and random.random() > 0.1:
+    >>> len(reservoir_sample(range(1000), 10, random.Random(0)))
+    10
+    >>> sorted(reservoir_sample("abc", 5))
+    ['a', 'b', 'c']
+
+    """
+    iterator = iter(iterable)
+    if k is None:
+        return list(iterator)
+    reservoir = list(itertools.islice(iterator, k))
+    if len(reservoir) < k or k == 0:
+        return reservoir
+    w = rng.random() ** (1 / k)
+    # Once w underflows to 0, no further element would ever be picked
+    while w > 0:
+        # Unlike log(1 - w), log1p(-w) does not round to 0 for tiny w
+        skip = int(math.log(rng.random() or 1e-300) / math.log1p(-w))
+        try:
+            element = next(itertools.islice(
+                iterator, min(skip, sys.maxsize), None))
+        except StopIteration:
+            return reservoir
+        reservoir[rng.randrange(k)] = element
+        w *= rng.random() ** (1 / k)
+    return reservoir
+
+
+def candidate_pairs(forms, excluded_cognatesets=frozenset()):
+    """Lazily generate positive and negative pairs of forms of one concept.
+
+    Pairs with identical segments, and pairs involving a cognate class in
+    `excluded_cognatesets` (such as loans from Indonesian) are skipped.
+
+    Returns
+    -------
+    (generator, generator)
+        Positive pairs (same cognate class) and negative pairs.
+
+    """
+    forms = [f for f in forms if f.cognateset not in excluded_cognatesets]
+    by_class = collections.OrderedDict()
+    for form in forms:
+        if form.cognateset is not None:
+            by_class.setdefault(form.cognateset, []).append(form)
+
+    def positives():
+        for members in by_class.values():
+            for f1, f2 in itertools.combinations(members, 2):
+                if f1.segments != f2.segments:
+                    yield f1, f2
+
+    def negatives():
+        for f1, f2 in itertools.combinations(forms, 2):
+            if f1.cognateset == f2.cognateset and f1.cognateset is not None:
+                continue
+            if f1.segments != f2.segments:
+                yield f1, f2
+
+    return positives(), negatives()
+
+
+def load_forms(dataset, lects=None):
+    """Collect the forms with segments of the dataset by concept.
+
+    Returns
+    -------
+    (dict, set)
+        Forms by concept, and the cognate classes of Indonesian forms.
+
+    """
+    assigned_to_cognateset = {}
+    for entry in dataset["CognateTable"].iterdicts():
+        assigned_to_cognateset[entry["Form_ID"]] = entry["Cognateset_ID"]
+
+    indonesian_loans = set()
+    forms_by_concept = collections.OrderedDict()
+    for form in dataset["FormTable"].iterdicts():
+        segments = form["Segments"]
+        if not segments:
             continue
-        if f1[3] in indonesian_loans or f2[3] in indonesian_loans:
+        id = form["ID"]
+        lect = form["Lect_ID"]
+        if lect == "indo1316-lexi":
+            indonesian_loans.add(assigned_to_cognateset.get(id))
+        if lects and lect not in lects:
             continue
-        if f1[4] and f2[4]:
-            _, _, score = lex.align_pairs(f1[4], f2[4], pprint=False)
+        forms_by_concept.setdefault(form["Concept_ID"], []).append(Form(
+            id, lect, tuple(segments), assigned_to_cognateset.get(id),
+            None, form["Concept_ID"]))
+    indonesian_loans.discard(None)
+    return forms_by_concept, indonesian_loans
+
+
+def sample_pairs(forms_by_concept, positives=None, negatives=20, seed=None,
+                 excluded_cognatesets=frozenset()):
+    """Stratified sample of pairs: per concept, positives and negatives.
+
+    Returns
+    -------
+    dict mapping True (positive) and False (negative) to lists, one per
+    concept, of sampled pairs
+
+    """
+    rng = random.Random(seed)
+    pairs = {True: [], False: []}
+    for concept, forms in forms_by_concept.items():
+        same, different = candidate_pairs(forms, excluded_cognatesets)
+        pairs[True].append(reservoir_sample(same, positives, rng))
+        pairs[False].append(reservoir_sample(different, negatives, rng))
+    return pairs
+
+
+def ranked(chunks, score):
+    """Score pairs chunk by chunk and merge them into one ascending stream.
+
+    `score` maps a list of pairs to the list of their scores. Every chunk is
+    scored and sorted on its own; the sorted chunks are then merged lazily
+    with a heap, instead of inserting every score into one sorted list.
+
+    >>> list(ranked([[3, 1], [2]], lambda chunk: [x / 10 for x in chunk]))
+    [(1, 0.1), (2, 0.2), (3, 0.3)]
+
+    """
+    sorted_chunks = []
+    for chunk in chunks:
+        sorted_chunks.append(sorted(
+            ((d, i, pair) for i, (pair, d) in enumerate(zip(chunk, score(chunk)))),
+            key=lambda x: x[:2]))
+    for d, i, pair in heapq.merge(*sorted_chunks, key=lambda x: x[0]):
+        yield pair, d
+
+
+def pairwise_scorer(lex=None, store=None, lexstat_file=None):
+    """Return a function scoring a list of pairs of Forms by alignment distance.
+
+    If a LingPy LexStat object is given and both forms are rows in it, its
+    scorer is used; otherwise, SCA distances are computed by `pw_align`. If a
+    `ScoreStore` is given, SCA distances – and LexStat distances, if the
+    scorer was loaded from `lexstat_file` – are looked up there first. SCA
+    distances are stored by segments only, LexStat distances by segments and
+    lect, because the LexStat scorer differs between pairs of lects.
+
+    """
+    sca = fingerprint("pw_align", "sca", "distance")
+    if lex is not None and lexstat_file:
+        lexstat = fingerprint("align_pairs", file_fingerprint(lexstat_file))
+    else:
+        lexstat = None
+
+    def align(f1, f2):
+        if lex is not None and f1.row and f2.row:
+            _, _, d = lex.align_pairs(f1.row, f2.row, pprint=False)
         else:
-            _, _, score = lingpy.align.pairwise.pw_align(
-                f1[2], f2[2],
-                distance=True)
-        i = bisect.bisect(distances[same_class], score)
-        distances[same_class].insert(i, score)
-        pairs[same_class].insert(i, (f1, f2))
-
-def format_output(f1, f2, d, file):
-    id1, lect1, s1, cogid1, row1, concept1 = f1
-    id2, lect2, s2, cogid2, row2, concept2 = f2
-
-    if not (lect1 in familiar_languages and lect2 in familiar_languages):
-        return
-
-    print(concept1, d,
-          lect1, lects[lect1][:2], " ".join(s1), row1,
-          lect2, lects[lect2][:2], " ".join(s2), row2,
+            _, _, d = lingpy.align.pairwise.pw_align(
+                f1.segments, f2.segments, distance=True)
+        return d
+
+    def key(method, f1, f2):
+        # LexStat scores depend on the doculects, not only on the segments
+        if method == lexstat:
+            return (f1.lect,) + f1.segments, (f2.lect,) + f2.segments
+        return f1.segments, f2.segments
+
+    def score(pairs):
+        if store is None:
+            return [align(f1, f2) for f1, f2 in pairs]
+        scores = [None] * len(pairs)
+        batches = {}
+        for i, (f1, f2) in enumerate(pairs):
+            if lex is not None and f1.row and f2.row:
+                if lexstat is None:
+                    scores[i] = align(f1, f2)
+                    continue
+                batches.setdefault(lexstat, []).append(i)
+            else:
+                batches.setdefault(sca, []).append(i)
+        for method, indices in batches.items():
+            batch = [pairs[i] for i in indices]
+            by_key = {key(method, f1, f2): (f1, f2) for f1, f2 in batch}
+            cached = store.cached(
+                method, [key(method, f1, f2) for f1, f2 in batch],
+                lambda a, b: align(*by_key[a, b]))
+            for i, d in zip(indices, cached):
+                scores[i] = d
+        return scores
+    return score
+
+
+def format_output(f1, f2, d, lects, file):
+    print(f1.concept, d,
+          f1.lect, lects[f1.lect][:2], " ".join(f1.segments), f1.id,
+          f2.lect, lects[f2.lect][:2], " ".join(f2.segments), f2.id,
           sep="\t", file=file)
 
-with open("check_these.tsv", "w") as out:
-    print("concept1", "d",
-          "Lect 1", "F1", "Form1", "ID1",
-          "Lect 2", "F2", "Form2", "ID2",
-          sep="\t", file=out)
-    for (f1, f2), d in zip(pairs[True], distances[True]):
-        format_output(f1, f2, d, out)
-    print("concept1", "d",
-          "Lect 1", "F1", "Form1", "ID1",
-          "Lect 2", "F2", "Form2", "ID2",
-          sep="\t", file=out)
-    for (f1, f2), d in zip(pairs[False], distances[False]):
-        format_output(f1, f2, d, out)
 
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--dataset", type=Path, default=repository,
+        help="CLDF metadata file of the dataset (default: LexiRumah)")
+    parser.add_argument(
+        "--lexstat", default=None,
+        help="LingPy LexStat file with a computed scorer, such as the"
+        " lexstats-*.tsv written by autocode.py. (default: Use SCA"
+        " distances)")
+    parser.add_argument(
+        "--output", type=argparse.FileType("w"), default="check_these.tsv",
+        help="File to write the ranked pairs to (default: check_these.tsv)")
+    parser.add_argument(
+        "--lects", nargs="+", default=None,
+        help="Only sample pairs among these lects (default: all lects)")
+    parser.add_argument(
+        "--familiar", action="store_const", const=FAMILIAR_LANGUAGES,
+        dest="lects",
+        help="Only sample pairs among the lects we are most familiar with")
+    parser.add_argument(
+        "--positives", type=int, default=None,
+        help="Number of same-class pairs to sample per concept"
+        " (default: all)")
+    parser.add_argument(
+        "--negatives", type=int, default=20,
+        help="Number of different-class pairs to sample per concept"
+        " (default: 20)")
+    parser.add_argument(
+        "--seed", type=int, default=None,
+        help="Random seed, for reproducible samples")
+    parser.add_argument(
+        "--score-store", type=Path, default=None,
+        help="SQLite file to cache alignment scores in across runs"
+        " (default: do not cache)")
+    args = parser.parse_args()
+
+    lexirumah = get_dataset(args.dataset)
+    forms_by_concept, indonesian_loans = load_forms(lexirumah, args.lects)
+
+    lex = None
+    if args.lexstat:
+        lex = lingpy.compare.partial.Partial(args.lexstat)
+        c_id = lex.header["reference" if "reference" in lex.header else "id"]
+        lex_by_id = {lex[row][c_id]: row for row in lex}
+        for concept, forms in forms_by_concept.items():
+            forms_by_concept[concept] = [
+                f._replace(row=lex_by_id.get(str(f.id))) for f in forms]
+
+    lects = collections.defaultdict(
+        lambda: "Austronesian",
+        {row["ID"]: row["Family"]
+         for row in lexirumah["LanguageTable"].iterdicts()})
+
+    pairs = sample_pairs(forms_by_concept, args.positives, args.negatives,
+                         seed=args.seed,
+                         excluded_cognatesets=indonesian_loans)
+    store = ScoreStore(args.score_store) if args.score_store else None
+    score = pairwise_scorer(lex, store, args.lexstat)
+
+    with args.output as out:
+        for same_class in (True, False):
+            print("concept1", "d",
+                  "Lect 1", "F1", "Form1", "ID1",
+                  "Lect 2", "F2", "Form2", "ID2",
+                  sep="\t", file=out)
+            for (f1, f2), d in ranked(pairs[same_class], score):
+                format_output(f1, f2, d, lects, out)
+    if store is not None:
+        store.close()
@@ -1,25 +1,52 @@
+"""Look up the administrative regions of lects from their coordinates.
+
+Regions are looked up in the GeoNames web service. Lookups for different lects
+run concurrently in an asyncio pipeline, limited to a steady request rate by a
+token bucket, over a small pool of persistent HTTP connections, and are retried
+with exponential backoff when GeoNames is overloaded or the connection fails.
+Results are cached by coordinates in a JSON file, so re-runs only query
+GeoNames for lects that are new or have moved.
+
+Example
+-------
+    $ python -m pylexirumah.geo_lookup --rate 2
+"""
+
 import geopy
 import geopy.geocoders as gc
-from geopy.distance import vincenty as distance
 from pycldf import Wordlist
 from clldutils.path import Path
 
 import json
+import time
+import asyncio
+import argparse
+import http.client
 import urllib
+import urllib.parse
+import urllib.request
 
-from time import sleep
-from pylexirumah import get_dataset
+from pylexirumah import get_dataset, repository
 
 try:
     geonames_username = Path(__file__).parent.joinpath("username").open().read().strip()
     geonames = gc.GeoNames(username=geonames_username, timeout=None)
 except FileNotFoundError:
+    geonames_username = None
     geonames = None
 nominatim = gc.Nominatim(user_agent="lexirumah")
 
 detail={"ID": ["ADM2", "ADM3"],
         "TL": []}
 
+GEONAMES_URL = "http://api.geonames.org"
+DEFAULT_CACHE = Path(__file__).parent.parent / "regions.json"
+
+# GeoNames status codes that mean 'try again later': limits exceeded and
+# server overloaded, see http://www.geonames.org/export/webservice-exception.html
+RETRY_STATUS = {18, 19, 20, 22}
+
+
 def get_region(latitude, longitude):
     return json.load(urllib.request.urlopen(
         "http://api.geonames.org/countrySubdivisionJSON?lat={lat:f}&lng={lng:f}&username={user:}&level=2".format(lat=latitude, lng=longitude, user=geonames_username)))
@@ -51,23 +78,279 @@ def get_region(latitude, longitude):
             continue
     return address
 
+
+class GeocodingError(Exception):
+    """A GeoNames request failed, even after retrying."""
+
+
+class TokenBucket:
+    """An asyncio rate limiter.
+
+    Up to `capacity` requests may be made at once, after which requests are
+    admitted at a steady `rate` per second.
+
+    """
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity,
+                    self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class RegionCache:
+    """A persistent mapping from coordinates to regions.
+
+    Coordinates are rounded to 4 decimal places (about 10 m), so that
+    insignificant changes in the LanguageTable do not cause new lookups.
+
+    """
+    def __init__(self, path=DEFAULT_CACHE):
+        self.path = Path(path)
+        try:
+            with self.path.open(encoding="utf-8") as cache:
+                self.regions = json.load(cache)
+        except (OSError, ValueError):
+            self.regions = {}
+
+    @staticmethod
+    def key(latitude, longitude):
+        """
+        >>> RegionCache.key(-8.23601, 124.678)
+        '-8.2360,124.6780'
+        """
+        return "{:.4f},{:.4f}".format(float(latitude), float(longitude))
+
+    def __contains__(self, coordinates):
+        return self.key(*coordinates) in self.regions
+
+    def __getitem__(self, coordinates):
+        return self.regions[self.key(*coordinates)]
+
+    def __setitem__(self, coordinates, region):
+        self.regions[self.key(*coordinates)] = region
+
+    def save(self):
+        with self.path.open("w", encoding="utf-8") as cache:
+            json.dump(self.regions, cache, indent=1, sort_keys=True)
+
+
+class GeoNamesClient:
+    """Make rate-limited, retried GeoNames requests from asyncio code.
+
+    The blocking requests run in a thread pool, each on one of `connections`
+    persistent HTTP connections, which are reused across requests.
+
+    Parameters
+    ----------
+    username : str
+        The GeoNames user name
+    base_url : str
+        The GeoNames web service, or a local server mimicking it
+    rate : float
+        Requests per second
+    connections : int
+        Maximal number of concurrent requests
+    retries : int
+        How often to retry a failed request, with exponential backoff
+    backoff : float
+        Seconds to wait before the first retry
+
+    """
+    def __init__(self, username, base_url=GEONAMES_URL, rate=1.0,
+                 connections=4, retries=3, backoff=1.0, timeout=30):
+        self.username = username
+        url = urllib.parse.urlsplit(base_url)
+        self.scheme = url.scheme
+        self.host = url.netloc
+        self.prefix = url.path.rstrip("/")
+        self.rate = rate
+        self.connections = connections
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.requests = 0
+
+    def open(self):
+        """Set up the rate limiter and the connections.
+
+        This must be called from within the event loop that makes the
+        requests; `regions` does so itself.
+
+        """
+        self.bucket = TokenBucket(self.rate)
+        self.pool = asyncio.Queue()
+        for i in range(self.connections):
+            self.pool.put_nowait(self.connect())
+
+    def close(self):
+        while not self.pool.empty():
+            self.pool.get_nowait().close()
+
+    def connect(self):
+        if self.scheme == "https":
+            return http.client.HTTPSConnection(self.host, timeout=self.timeout)
+        return http.client.HTTPConnection(self.host, timeout=self.timeout)
+
+    def fetch(self, connection, method, parameters):
+        """Make one blocking request on an open connection."""
+        self.requests += 1
+        connection.request("GET", "{:}/{:}?{:}".format(
+            self.prefix, method, urllib.parse.urlencode(parameters)))
+        response = connection.getresponse()
+        body = response.read()
+        if response.status != 200:
+            raise GeocodingError("HTTP status {:d}".format(response.status))
+        return json.loads(body.decode("utf-8"))
+
+    async def request(self, method, **parameters):
+        """Query a GeoNames JSON method, such as `findNearbyJSON`."""
+        parameters["username"] = self.username
+        loop = asyncio.get_event_loop()
+        for attempt in range(self.retries + 1):
+            await self.bucket.acquire()
+            connection = await self.pool.get()
+            try:
+                data = await loop.run_in_executor(
+                    None, self.fetch, connection, method, parameters)
+            except (OSError, http.client.HTTPException, ValueError,
+                    GeocodingError):
+                # Start from a fresh connection after a broken response
+                connection.close()
+                connection = self.connect()
+                data = None
+            finally:
+                self.pool.put_nowait(connection)
+            if data is not None:
+                status = data.get("status", {}).get("value")
+                if status is None:
+                    return data
+                if status not in RETRY_STATUS:
+                    raise GeocodingError(data["status"].get("message"))
+            await asyncio.sleep(self.backoff * 2 ** attempt)
+        raise GeocodingError("{:} failed after {:d} attempts".format(
+            method, self.retries + 1))
+
+    async def region(self, latitude, longitude):
+        """Look up the region of a coordinate, as a list of names.
+
+        The list goes from the most specific (such as the ADM3 district) to
+        the country, as with `get_region`.
+
+        """
+        coordinates = {"lat": latitude, "lng": longitude}
+        places = await self.request("findNearbyPlaceNameJSON", **coordinates)
+        for_country = places["geonames"][0]
+        address = [for_country["adminName1"], for_country["countryName"]]
+        for d in detail.get(for_country["countryCode"].upper(), []):
+            elements = await self.request(
+                "findNearbyJSON", featureCode=d, **coordinates)
+            try:
+                address.insert(0, elements["geonames"][0]["name"])
+            except (KeyError, IndexError):
+                continue
+        return address
+
+    async def regions(self, coordinates):
+        """Look up the regions of many coordinates concurrently.
+
+        Returns
+        -------
+        list, parallel to `coordinates`, of regions or None for failed lookups
+
+        """
+        self.open()
+
+        async def lookup(latitude, longitude):
+            try:
+                return await self.region(latitude, longitude)
+            except (GeocodingError, KeyError, IndexError):
+                return None
+        try:
+            return await asyncio.gather(
+                *(lookup(*c) for c in coordinates))
+        finally:
+            self.close()
+
+
+def update_regions(lects, client, cache):
+    """Fill in the Region of LanguageTable rows from their coordinates.
+
+    Coordinates not in the cache are looked up with the client, and the
+    results are added to the cache. Rows without coordinates, and rows whose
+    lookup failed, are left unchanged.
+
+    Returns
+    -------
+    int: The number of coordinates looked up online
+
+    """
+    missing = sorted({
+        cache.key(lect["Latitude"], lect["Longitude"])
+        for lect in lects
+        if lect["Latitude"] is not None and lect["Longitude"] is not None
+        and (lect["Latitude"], lect["Longitude"]) not in cache})
+    coordinates = [tuple(map(float, key.split(","))) for key in missing]
+    if coordinates:
+        loop = asyncio.new_event_loop()
+        try:
+            regions = loop.run_until_complete(client.regions(coordinates))
+        finally:
+            loop.close()
+        for c, region in zip(coordinates, regions):
+            if region:
+                cache[c] = region
+    for lect in lects:
+        latlon = (lect["Latitude"], lect["Longitude"])
+        if latlon[0] is not None and latlon in cache:
+            lect["Region"] = ", ".join(cache[latlon])
+    return len(coordinates)
+
+
 if __name__ == "__main__":
-    data = get_dataset()
-    lang = data["LanguageTable"]
-    updated = []
-    for language in lang.iterdicts():
-        if not language["Latitude"]:
-            updated.append(language)
-            continue
-        print(language["Name"])
-        latlon = (language["Latitude"], language["Longitude"])
-        print("{:10.5f} {:10.5f}".format(*latlon))
-        region = get_region(*latlon)
-        sleep(1)
-        print(region)
-        if not region:
-            continue
-        language["Region"] = ", ".join(region)
-        updated.append(language)
-    data.write(LanguageTable=updated)
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--cldf", type=Path, default=repository,
+        help="CLDF metadata file of the dataset (default: LexiRumah)")
+    parser.add_argument(
+        "--cache", type=Path, default=DEFAULT_CACHE,
+        help="JSON file caching regions by coordinates"
+        " (default: regions.json in the repository)")
+    parser.add_argument(
+        "--username", default=geonames_username,
+        help="GeoNames user name (default: the content of"
+        " pylexirumah/username)")
+    parser.add_argument(
+        "--url", default=GEONAMES_URL,
+        help="GeoNames web service URL (default: {:})".format(GEONAMES_URL))
+    parser.add_argument(
+        "--rate", type=float, default=1.0,
+        help="Maximal GeoNames requests per second (default: 1)")
+    parser.add_argument(
+        "--connections", type=int, default=4,
+        help="Number of concurrent connections (default: 4)")
+    args = parser.parse_args()
 
+    data = get_dataset(args.cldf)
+    lects = list(data["LanguageTable"].iterdicts())
+    cache = RegionCache(args.cache)
+    client = GeoNamesClient(args.username, args.url, rate=args.rate,
+                            connections=args.connections)
+    looked_up = update_regions(lects, client, cache)
+    cache.save()
+    print("Looked up {:d} coordinates in {:d} requests.".format(
+        looked_up, client.requests))
+    data["LanguageTable"].write(lects)
@@ -1,33 +1,149 @@
+"""List the sound inventories contained in a CLDF Wordlist
+
+The segments of the FormTable are taken from its `SegmentStore`, where every
+distinct segment is interned to an integer ID. Each symbol of the store is
+normalized through BIPA only once, and the sound inventories are counted for
+all lects at once with `numpy.bincount`, giving a lect × sound matrix.
+
+The store is cached next to the FormTable and rebuilt when it changes, see
+`pylexirumah.segment_store`.
+
+Example
+-------
+    $ python -m pylexirumah.get_phonetic_inventories --matrix sounds.tsv
+"""
+
+import csv
+import json
 import argparse
-import collections
+
+import numpy
 import pyclts
 
+from clldutils.path import Path
+
 bipa = pyclts.TranscriptionSystem()
 
 from pylexirumah import get_dataset, repository
-parser = argparse.ArgumentParser(
-    description="List the sound inventories contained in a CLDF Wordlist")
-parser.add_argument("--dataset", default=None)
-args = parser.parse_args()
-dataset = get_dataset(args.dataset)
+from pylexirumah.segment_store import SegmentStore
 
-inventories = collections.defaultdict(collections.Counter)
 
-c_language = dataset["FormTable", "languageReference"].name
-c_segments = dataset["FormTable", "segments"].name
+class SoundInventories:
+    """Counts of the BIPA sounds of every lect, as a lect × sound matrix.
 
-for row in dataset["FormTable"].iterdicts():
-    normalized = [str(bipa[x]) for x in row[c_segments]]
-    inventories[row[c_language]].update(normalized)
+    Parameters
+    ----------
+    store : SegmentStore
+        The segments of the forms, such as `SegmentStore.from_dataset`
+        returns
 
-all = collections.Counter()
-for language, inventory in inventories.items():
-    print(language)
-    for item, frequency in inventory.most_common():
-        print("\t{:}\t{:d}".format(item, frequency))
-    all.update(inventory)
-    print()
+    Attributes
+    ----------
+    lects : list of str
+        The row labels of `counts`
+    sounds : list of str
+        The column labels of `counts`
+    sound_of : numpy.ndarray
+        The index in `sounds` of the normalized sound of each symbol of the
+        store
+    counts : numpy.ndarray
+        How often each sound occurs in the forms of each lect
+
+    """
+    def __init__(self, store):
+        self.store = store
+        self.lects = store.lects
+        self.lect_ids = {l: i for i, l in enumerate(self.lects)}
+        self.sounds = []
+        self.sound_ids = {}
+        sound_of = []
+        for symbol in store.symbols.symbols:
+            sound = str(bipa[symbol])
+            if sound not in self.sound_ids:
+                self.sound_ids[sound] = len(self.sounds)
+                self.sounds.append(sound)
+            sound_of.append(self.sound_ids[sound])
+        self.sound_of = numpy.array(sound_of, dtype=numpy.int64)
+        # Boundary markers are counted as well, like all other segments
+        by_symbol = store.counts(boundaries=True)
+        self.counts = numpy.zeros((len(self.lects), len(self.sounds)),
+                                  dtype=by_symbol.dtype)
+        numpy.add.at(self.counts.T, self.sound_of, by_symbol.T)
+
+    @classmethod
+    def from_dataset(cls, dataset, cache_file=None):
+        """Count the inventories of the forms of a dataset.
+
+        Parameters
+        ----------
+        dataset : pycldf.Wordlist
+        cache_file : str or Path, optional
+            Where to keep the segment store (default: next to the FormTable)
+
+        """
+        return cls(SegmentStore.from_dataset(dataset, cache_file))
 
-print("Summa")
-for item, frequency in all.most_common():
-    print("\t{:}\t{:d}".format(item, frequency))
+    def inventory(self, lect):
+        """List the sounds of a lect with their frequencies, most common first.
+        """
+        row = self.counts[self.lect_ids[lect]]
+        order = numpy.argsort(-row, kind="stable")
+        return [(self.sounds[j], int(row[j])) for j in order if row[j]]
+
+    def total(self):
+        """List all sounds with their frequencies, most common first."""
+        row = self.counts.sum(0)
+        order = numpy.argsort(-row, kind="stable")
+        return [(self.sounds[j], int(row[j])) for j in order if row[j]]
+
+    def write_matrix(self, path):
+        """Write the lect × sound matrix as tab-separated values."""
+        with Path(path).open("w", encoding="utf-8", newline="") as out:
+            writer = csv.writer(out, delimiter="\t", lineterminator="\n")
+            writer.writerow(["Lect_ID"] + self.sounds)
+            for lect, row in zip(self.lects, self.counts.tolist()):
+                writer.writerow([lect] + row)
+
+    def write_inventories(self, path):
+        """Write the inventories of all lects as JSON."""
+        with Path(path).open("w", encoding="utf-8") as out:
+            json.dump({lect: dict(self.inventory(lect))
+                       for lect in self.lects
+                       if self.counts[self.lect_ids[lect]].any()},
+                      out, ensure_ascii=False, indent=1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="List the sound inventories contained in a CLDF Wordlist")
+    parser.add_argument("--dataset", default=None)
+    parser.add_argument(
+        "--matrix", type=Path, default=None,
+        help="Write the lect × sound counts to this TSV file")
+    parser.add_argument(
+        "--inventories", type=Path, default=None,
+        help="Write the inventories of all lects to this JSON file")
+    args = parser.parse_args()
+    dataset = get_dataset(args.dataset)
+
+    inventories = SoundInventories.from_dataset(dataset)
+
+    if args.matrix:
+        inventories.write_matrix(args.matrix)
+    if args.inventories:
+        inventories.write_inventories(args.inventories)
+    if args.matrix or args.inventories:
+        parser.exit()
+
+    for language in inventories.lects:
+        inventory = inventories.inventory(language)
+        if not inventory:
+            continue
+        print(language)
+        for item, frequency in inventory:
+            print("\t{:}\t{:d}".format(item, frequency))
+        print()
+
+    print("Summa")
+    for item, frequency in inventories.total():
+        print("\t{:}\t{:d}".format(item, frequency))
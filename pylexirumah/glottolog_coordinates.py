@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+
+"""Look up coordinates of Glottolog languoids from a persistent index.
+
+Walking the whole Glottolog tree with `Glottolog.languoids()` takes much
+longer than anything else scripts like `plot_parameters.py` do with it. The
+`CoordinateIndex` walks it once, and stores the coordinates of all languoids
+by Glottocode and ISO code in a JSON file, together with the version of the
+Glottolog repository (as given by `git describe`). The index is rebuilt when
+the Glottolog version changes.
+
+Example
+-------
+    $ python -m pylexirumah.glottolog_coordinates ../glottolog abui1241 abz
+"""
+
+import json
+import argparse
+import subprocess
+
+from clldutils.path import Path
+
+DEFAULT_INDEX = Path(__file__).parent.parent / "glottolog-coordinates.json"
+
+
+def glottolog_repos(repos=None):
+    """Resolve the path of the Glottolog repository as pyglottolog does."""
+    from pyglottolog.api import Glottolog
+    return Path(str(Glottolog(repos).repos))
+
+
+def repository_version(path):
+    """Describe the version of a git checkout, or None if it is not one.
+
+    Uncommitted changes are part of the description, so they invalidate the
+    index, too.
+
+    """
+    try:
+        return subprocess.check_output(
+            ["git", "-C", str(path), "describe", "--always", "--tags",
+             "--dirty"], stderr=subprocess.DEVNULL).decode("utf-8").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class CoordinateIndex:
+    """A persistent map from Glottocodes and ISO codes to (lat, lon).
+
+    Parameters
+    ----------
+    repos : str or Path, optional
+        Path to a local clone of clld/glottolog, as for `pyglottolog`.
+    path : str or Path
+        The JSON file holding the index (default: glottolog-coordinates.json
+        in the repository).
+
+    If the version of the Glottolog repository cannot be determined (because
+    it is an export instead of a git clone), the index is rebuilt every time.
+
+    """
+    def __init__(self, repos=None, path=DEFAULT_INDEX):
+        self.repos = repos
+        self.path = Path(path)
+        self._coordinates = None
+
+    @property
+    def coordinates(self):
+        if self._coordinates is None:
+            repos = glottolog_repos(self.repos)
+            version = repository_version(repos)
+            try:
+                with self.path.open(encoding="utf-8") as index:
+                    data = json.load(index)
+                if version is not None and data["version"] == version:
+                    self._coordinates = {
+                        code: tuple(latlon)
+                        for code, latlon in data["coordinates"].items()}
+            except (OSError, ValueError, KeyError):
+                pass
+            if self._coordinates is None:
+                self.build(repos, version)
+        return self._coordinates
+
+    def build(self, repos=None, version=None):
+        """Walk the Glottolog tree and write the index file."""
+        from pyglottolog.api import Glottolog
+        if repos is None:
+            repos = glottolog_repos(self.repos)
+            version = repository_version(repos)
+        coordinates = {}
+        for lang in Glottolog(repos).languoids():
+            if lang.latitude is not None:
+                coordinates.setdefault(lang.id, (lang.latitude, lang.longitude))
+                if lang.iso:
+                    coordinates.setdefault(
+                        lang.iso, (lang.latitude, lang.longitude))
+        with self.path.open("w", encoding="utf-8") as index:
+            json.dump({"version": version, "repos": str(repos),
+                       "coordinates": coordinates}, index)
+        self._coordinates = coordinates
+        return coordinates
+
+    def __contains__(self, code):
+        return code in self.coordinates
+
+    def __getitem__(self, code):
+        return self.coordinates[code]
+
+    def __len__(self):
+        return len(self.coordinates)
+
+    def get(self, code, default=None):
+        return self.coordinates.get(code, default)
+
+    def items(self):
+        return self.coordinates.items()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "glottolog_repos", nargs="?", default=None,
+        help="Path to local clone of clld/glottolog")
+    parser.add_argument(
+        "codes", nargs="*",
+        help="Glottocodes or ISO codes to look up (default: only make sure"
+        " the index is up to date)")
+    parser.add_argument(
+        "--index", type=Path, default=DEFAULT_INDEX,
+        help="JSON file holding the index"
+        " (default: glottolog-coordinates.json in the repository)")
+    parser.add_argument(
+        "--rebuild", action="store_true", default=False,
+        help="Rebuild the index even if the Glottolog version is unchanged")
+    args = parser.parse_args()
+
+    index = CoordinateIndex(args.glottolog_repos, args.index)
+    if args.rebuild:
+        index.build()
+    for code in args.codes:
+        latlon = index.get(code)
+        print(code, *(latlon or ("", "")), sep="\t")
+    if not args.codes:
+        print("{:d} codes with coordinates in the index.".format(len(index)))
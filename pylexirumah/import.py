@@ -3,7 +3,7 @@
 import sys
 import argparse
 import itertools
-from collections import OrderedDict, Counter
+from collections import OrderedDict
 from clldutils.path import Path
 
 import chardet
@@ -14,7 +14,8 @@ import pycldf
 import pyclts
 
 from pylexirumah import (get_dataset, repository)
-from pylexirumah.check_transcription_systems import load_orthographic_profile, tokenizer, resolve_brackets, bipa
+from pylexirumah.form_ids import SynonymAllocator, append_rows
+from pylexirumah.check_transcription_systems import load_orthographic_profile, tokenizer, bipa
 
 
 parser = argparse.ArgumentParser(description="Import word lists from a new source into LexiRumah.")
@@ -159,17 +160,11 @@ for source in new_sources:
     dataset.sources.add(source)
 dataset.write_sources()
 
-print("Loading existing forms from previous wordlists ...")
+print("Loading the form IDs of previous wordlists ...")
 forms = dataset["FormTable"]
-all_rows = list(forms.iterdicts())
-old_forms = len(all_rows)
-
-syn = Counter([
-    (entry["Lect_ID"], entry["Concept_ID"])
-    for entry in all_rows])
-
-empty = dataset["ValueTable"]
-empty_forms = list(empty.iterdicts())
+form_ids = SynonymAllocator(dataset)
+new_forms = []
+empty_forms = []
 
 print("Preparing to load additional forms from new wordlist ...")
 copy_columns = ["Concept_ID", "Lect_ID", "Form_according_to_Source", "Form", "Local_Orthography", "Comment"]
@@ -198,12 +193,6 @@ for r, row in enumerate(rows):
         new_entry["Lect_ID"] = previous_lect
     previous_lect = new_entry["Lect_ID"]
 
-    syn[new_entry["Lect_ID"], new_entry["Concept_ID"]] += 1
-
-    new_entry['ID'] = "{:}-{:}-{:d}".format(
-        new_entry["Lect_ID"], new_entry["Concept_ID"],
-        syn[new_entry["Lect_ID"], new_entry["Concept_ID"]])
-
     if new_entry["Lect_ID"] not in languages:
         raise ValueError(
             "No metadata found for lect {:} of form in line {:d}.".format(
@@ -212,16 +201,20 @@ for r, row in enumerate(rows):
     new_entry["Source"] = new_sources_field
 
     if new_entry["Comment"] and not (new_entry["Form_according_to_Source"]):
-        empty_forms.append(new_entry)
-        continue
+        target = empty_forms
     elif not (new_entry["Form_according_to_Source"]):
         continue
+    else:
+        target = new_forms
 
-    all_rows.append(new_entry)
+    new_entry['ID'] = form_ids.allocate(
+        new_entry["Lect_ID"], new_entry["Concept_ID"])
+    target.append(new_entry)
 
-print("Found {:d} new forms.".format(len(all_rows) - old_forms))
+print("Found {:d} new forms.".format(len(new_forms)))
 
-print("Writing all forms, old and new, back to file ...")
-forms.write(all_rows)
-empty.write(empty_forms)
+print("Appending the new forms to file ...")
+append_rows(dataset, "FormTable", new_forms)
+append_rows(dataset, "ValueTable", empty_forms)
+form_ids.save()
 print("Word list data merged.")
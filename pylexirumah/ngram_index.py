@@ -0,0 +1,315 @@
+#!/usr/bin/env python
+
+"""Search forms and glosses by substring or similarity using an n-gram index.
+
+Every value of the indexed columns – Form, Local_Orthography and
+Form_according_to_Source of the FormTable, English and Indonesian of the
+ParameterTable – is split into overlapping n-grams (trigrams by default, with
+`^` and `$` marking the beginning and end of the value), and the n-grams are
+stored in an SQLite file next to the dataset. Substring queries only check
+values containing all n-grams of the query, and approximate queries rank
+values by the Dice coefficient of their n-grams with the query, instead of
+scanning the whole FormTable.
+
+The index remembers which values it was built from. When a table has
+changed, only added, changed and removed values are re-indexed.
+
+Example
+-------
+    $ python -m pylexirumah.ngram_index mb --field Form --lects
+    $ python -m pylexirumah.ngram_index wai --similar
+"""
+
+import sqlite3
+import argparse
+import collections
+import unicodedata
+
+from clldutils.path import Path
+
+from pylexirumah import get_dataset, repository
+
+INDEXED = collections.OrderedDict([
+    ("FormTable", ["Form", "Local_Orthography", "Form_according_to_Source"]),
+    ("ParameterTable", ["English", "Indonesian"]),
+])
+
+Match = collections.namedtuple(
+    "Match", ["table", "id", "field", "value", "lect", "score"])
+
+
+def normalize(string):
+    """Normalize a string for searching: NFC and case-folded.
+
+    >>> normalize("Wai")
+    'wai'
+
+    """
+    return unicodedata.normalize("NFC", string).casefold()
+
+
+def ngrams(string, n=3, pad=True):
+    """Count the n-grams of a normalized string.
+
+    >>> sorted(ngrams("wai").items())
+    [('^wa', 1), ('ai$', 1), ('wai', 1)]
+    >>> sorted(ngrams("mb", pad=False))
+    []
+
+    """
+    if pad:
+        string = "^" + string + "$"
+    return collections.Counter(
+        string[i:i + n] for i in range(len(string) - n + 1))
+
+
+class NgramIndex:
+    """An on-disk n-gram index over forms and concept glosses.
+
+    Parameters
+    ----------
+    dataset : pycldf.Wordlist
+    path : str or Path, optional
+        The SQLite file to keep the index in (default: `ngrams.sqlite` next to
+        the dataset's metadata)
+    n : int
+        The length of the n-grams. An existing index with a different n is
+        rebuilt.
+
+    """
+    def __init__(self, dataset, path=None, n=3):
+        self.dataset = dataset
+        self.n = n
+        if path is None:
+            path = Path(str(dataset.directory)) / "ngrams.sqlite"
+        self.db = sqlite3.connect(str(path))
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value);
+            CREATE TABLE IF NOT EXISTS stamps (
+                tbl TEXT PRIMARY KEY, stamp TEXT);
+            CREATE TABLE IF NOT EXISTS entries (
+                pk INTEGER PRIMARY KEY, tbl TEXT, id TEXT, field TEXT,
+                value TEXT, lect TEXT, grams INTEGER,
+                UNIQUE (tbl, id, field));
+            CREATE TABLE IF NOT EXISTS postings (
+                gram TEXT, entry INTEGER, count INTEGER,
+                PRIMARY KEY (gram, entry)) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS postings_entry ON postings (entry);
+            """)
+        stored = self.db.execute(
+            "SELECT value FROM meta WHERE key = 'n'").fetchone()
+        if stored is None or stored[0] != n:
+            self.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+    def clear(self):
+        """Remove everything from the index."""
+        for table in ["stamps", "entries", "postings"]:
+            self.db.execute("DELETE FROM {:s}".format(table))
+        self.db.execute(
+            "INSERT OR REPLACE INTO meta VALUES ('n', ?)", (self.n,))
+        self.db.commit()
+
+    def stamp(self, table):
+        path = Path(str(self.dataset.directory)) / str(
+            self.dataset[table].url)
+        stat = path.stat()
+        return "{:d}:{:d}".format(stat.st_size, stat.st_mtime_ns)
+
+    def update(self):
+        """Bring the index up to date with the dataset.
+
+        Tables whose file has not changed since the last update are skipped.
+        Of the other tables, only new, changed and removed values are
+        re-indexed.
+
+        Returns
+        -------
+        dict mapping table names to the number of re-indexed values
+
+        """
+        updated = {}
+        for table, fields in INDEXED.items():
+            try:
+                stamp = self.stamp(table)
+            except KeyError:
+                continue
+            known = self.db.execute(
+                "SELECT stamp FROM stamps WHERE tbl = ?", (table,)).fetchone()
+            if known is not None and known[0] == stamp:
+                continue
+            updated[table] = self._update_table(table, fields)
+            self.db.execute(
+                "INSERT OR REPLACE INTO stamps VALUES (?, ?)", (table, stamp))
+            self.db.commit()
+        return updated
+
+    def _update_table(self, table, fields):
+        indexed = {(id, field): (pk, value, lect)
+                   for pk, id, field, value, lect in self.db.execute(
+                       "SELECT pk, id, field, value, lect FROM entries"
+                       " WHERE tbl = ?", (table,))}
+        current = {}
+        for row in self.dataset[table].iterdicts():
+            for field in fields:
+                if row.get(field):
+                    current[row["ID"], field] = (row[field], row.get("Lect_ID"))
+
+        stale = [pk for key, (pk, value, lect) in indexed.items()
+                 if current.get(key) != (value, lect)]
+        for i in range(0, len(stale), 500):
+            chunk = stale[i:i + 500]
+            marks = ", ".join("?" for pk in chunk)
+            self.db.execute(
+                "DELETE FROM postings WHERE entry IN ({:s})".format(marks),
+                chunk)
+            self.db.execute(
+                "DELETE FROM entries WHERE pk IN ({:s})".format(marks), chunk)
+
+        new = 0
+        for (id, field), (value, lect) in current.items():
+            if (id, field) in indexed and indexed[id, field][1:] == (value, lect):
+                continue
+            grams = ngrams(normalize(value), self.n)
+            pk = self.db.execute(
+                "INSERT INTO entries (tbl, id, field, value, lect, grams)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (table, id, field, value, lect,
+                 sum(grams.values()))).lastrowid
+            self.db.executemany(
+                "INSERT INTO postings VALUES (?, ?, ?)",
+                [(gram, pk, count) for gram, count in grams.items()])
+            new += 1
+        return len(stale) + new
+
+    def _restrict(self, fields):
+        if not fields:
+            return "", []
+        return (" AND e.field IN ({:s})".format(", ".join("?" for f in fields)),
+                list(fields))
+
+    def substring(self, query, fields=None, limit=None):
+        """Find all values containing `query`, ignoring case.
+
+        Values are ranked by the share of the value covered by the query, so
+        that exact matches come first.
+
+        Returns
+        -------
+        list of Match
+
+        """
+        query = normalize(query)
+        restrict, parameters = self._restrict(fields)
+        grams = list(ngrams(query, self.n, pad=False))
+        if grams:
+            # All n-grams of the query must occur in the value
+            candidates = self.db.execute(
+                "SELECT e.tbl, e.id, e.field, e.value, e.lect FROM entries e"
+                " JOIN postings p ON p.entry = e.pk"
+                " WHERE p.gram IN ({:s}){:s}"
+                " GROUP BY e.pk HAVING COUNT(*) = ?".format(
+                    ", ".join("?" for g in grams), restrict),
+                grams + parameters + [len(grams)])
+        else:
+            # Queries shorter than n are contained in some (padded) n-gram
+            candidates = self.db.execute(
+                "SELECT DISTINCT e.tbl, e.id, e.field, e.value, e.lect"
+                " FROM entries e JOIN postings p ON p.entry = e.pk"
+                " WHERE instr(p.gram, ?) > 0{:s}".format(restrict),
+                [query] + parameters)
+        matches = [
+            Match(table, id, field, value, lect,
+                  len(query) / len(normalize(value)))
+            for table, id, field, value, lect in candidates
+            if query in normalize(value)]
+        matches.sort(key=lambda m: (-m.score, m.value, m.id, m.field))
+        return matches[:limit]
+
+    def similar(self, query, fields=None, limit=20, threshold=0.0):
+        """Find the values most similar to `query`.
+
+        Similarity is the Dice coefficient of the padded n-grams of query and
+        value: twice the number of shared n-grams over their total number.
+
+        Returns
+        -------
+        list of Match, most similar first
+
+        """
+        grams = ngrams(normalize(query), self.n)
+        if not grams:
+            return []
+        restrict, parameters = self._restrict(fields)
+        self.db.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS query (gram TEXT, count INTEGER)")
+        self.db.execute("DELETE FROM query")
+        self.db.executemany("INSERT INTO query VALUES (?, ?)", grams.items())
+        total = sum(grams.values())
+        matches = [
+            Match(*row[:5], score=row[5])
+            for row in self.db.execute(
+                "SELECT e.tbl, e.id, e.field, e.value, e.lect,"
+                " 2.0 * SUM(MIN(p.count, q.count)) / (e.grams + ?) AS score"
+                " FROM query q JOIN postings p ON p.gram = q.gram"
+                " JOIN entries e ON e.pk = p.entry"
+                " WHERE 1{:s} GROUP BY e.pk HAVING score >= ?"
+                " ORDER BY score DESC, e.value, e.id LIMIT ?".format(restrict),
+                [total] + parameters + [threshold, -1 if limit is None else limit])]
+        return matches
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "query", help="The string to search for")
+    parser.add_argument(
+        "--cldf", type=Path, default=repository,
+        help="CLDF metadata file of the dataset (default: LexiRumah)")
+    parser.add_argument(
+        "--index", type=Path, default=None,
+        help="SQLite file holding the index"
+        " (default: ngrams.sqlite next to the dataset)")
+    parser.add_argument(
+        "--field", nargs="+", default=None,
+        choices=[f for fields in INDEXED.values() for f in fields],
+        help="Only search these columns (default: all indexed columns)")
+    parser.add_argument(
+        "--similar", action="store_true", default=False,
+        help="Rank values by similarity to the query, instead of listing"
+        " the values containing it")
+    parser.add_argument(
+        "--limit", type=int, default=None,
+        help="Show at most this many results (default: all substring matches,"
+        " or the 20 most similar values)")
+    parser.add_argument(
+        "--lects", action="store_true", default=False,
+        help="Only list the lects with matching forms, with their number of"
+        " matches")
+    args = parser.parse_args()
+
+    with NgramIndex(get_dataset(args.cldf), args.index) as index:
+        index.update()
+        if args.similar:
+            matches = index.similar(args.query, args.field,
+                                    limit=args.limit or 20)
+        else:
+            matches = index.substring(args.query, args.field, limit=args.limit)
+
+    if args.lects:
+        lects = collections.Counter(m.lect for m in matches if m.lect)
+        for lect, count in lects.most_common():
+            print(lect, count, sep="\t")
+    else:
+        for m in matches:
+            print("{:.3f}".format(m.score), m.table, m.id, m.field, m.value,
+                  m.lect or "", sep="\t")
@@ -1,7 +1,7 @@
 # coding: utf8
 """Plot the number of filled-in parameters for each language.
 
-parameter_sampled: map languages to sets of parameters
+parameters_sampled: map languages to numbers of parameters
 """
 import sys
 import argparse
@@ -18,14 +18,17 @@ from mpl_toolkits.basemap import Basemap
 
 import pycldf
 from clldutils.path import Path
-from pyglottolog.api import Glottolog
+
+from pylexirumah.coverage import Coverage
+from pylexirumah.glottolog_coordinates import CoordinateIndex
 
 
 def parameters_sampled(dataset):
     """Check which parameters are given for which languages.
 
     Return the dictionary mapping all language ids present in the dataset's
-    primary table to the set of parameter ids with values for that language.
+    primary table to the number of distinct parameter ids with values for
+    that language.
 
     Parameters
     ----------
@@ -36,9 +39,11 @@ def parameters_sampled(dataset):
     dict
 
     """
-    languageReference = dataset[dataset.primary_table, "languageReference"].name
-    parameterReference = dataset[dataset.primary_table, "parameterReference"].name
-    return Counter(row[languageReference] for row in dataset[dataset.primary_table])
+    coverage = Coverage.from_dataset(dataset)
+    # Lects without forms are in the bitmap, but not in the primary table
+    return {lect: n
+            for lect, n in zip(coverage.lects, coverage.per_lect().tolist())
+            if n}
 
 
 def main(args=sys.argv):
@@ -74,12 +79,9 @@ def main(args=sys.argv):
         # No language table
         pass
 
-    for lang in Glottolog(options.glottolog_repos).languoids():
-        if lang.latitude is not None:
-            if lang.id not in locations:
-                locations[lang.id] = (lang.latitude, lang.longitude)
-            if lang.iso and lang.iso not in locations:
-                locations[lang.iso] = (lang.latitude, lang.longitude)
+    # Fill in the remaining locations from Glottolog
+    for code, latlon in CoordinateIndex(options.glottolog_repos).items():
+        locations.setdefault(code, latlon)
 
     # Aggregate the data
     lats, lons, sizes = [], [], []
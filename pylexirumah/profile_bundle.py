@@ -0,0 +1,434 @@
+#!/usr/bin/env python
+
+"""Compile the orthographic profiles into one memory-mapped bundle.
+
+Every profile in `cldf/p` is compiled into two tries, one over the left hand
+sides of its rules (for applying it) and one over the right hand sides (for
+undoing it), stored as flat integer arrays. All compiled profiles live in a
+single binary file, `cldf/p.bundle`, next to a JSON manifest giving each
+profile's size, modification time and content hash, and the position of its
+arrays in the bundle. Opening the bundle maps the file into memory without
+reading it, and a profile's arrays are only decoded when it is first used.
+
+Rebuilding the bundle only recompiles profiles whose files have changed; the
+arrays of all others are copied from the previous bundle.
+
+Example
+-------
+    $ python -m pylexirumah.profile_bundle
+"""
+
+import os
+import json
+import hashlib
+import argparse
+import functools
+
+import numpy
+
+from clldutils.path import Path
+
+from pylexirumah import repository
+
+BUNDLE_VERSION = 1
+WORDBOUNDARY = "_"
+
+
+def parse_profile(lines):
+    """Parse the substitution rules of an orthographic profile.
+
+    >>> parse_profile(["aa\\taː// long a", "", "// comment", "c\\tt͡ʃ\\n"])
+    [('aa', 'aː'), ('c', 't͡ʃ')]
+
+    """
+    substitutions = []
+    for rule in lines:
+        rule = rule.strip("\n")
+        rule = rule.strip("\r")
+        if "//" in rule:
+            rule = rule[:rule.index("//")]
+        if not rule.strip():
+            continue
+        if "[" in rule or "#def" in rule:
+            raise NotImplementedError("Context groups are not supported yet.")
+        try:
+            before, after = rule.split("\t")
+        except ValueError:
+            raise ValueError("Rule {:} is not a tab-separated pair.".format(
+                repr(rule)))
+        substitutions.append((before, after))
+    return substitutions
+
+
+def compile_trie(keys):
+    """Compile strings into a trie of flat arrays.
+
+    Every node of the trie knows the index of the first key ending in it
+    (or -1), and its outgoing edges are sorted by code point.
+
+    Returns
+    -------
+    dict of numpy.array: node_key, edge_offsets, edge_chars, edge_targets
+
+    """
+    children = [{}]
+    node_key = [-1]
+    for k, key in enumerate(keys):
+        if not key:
+            # The transducer never matches an empty string
+            continue
+        node = 0
+        for char in key:
+            if char not in children[node]:
+                children[node][char] = len(children)
+                children.append({})
+                node_key.append(-1)
+            node = children[node][char]
+        if node_key[node] == -1:
+            node_key[node] = k
+    edges = [sorted((ord(c), t) for c, t in node.items()) for node in children]
+    return {
+        "node_key": numpy.array(node_key, dtype=numpy.int32),
+        "edge_offsets": numpy.cumsum(
+            [0] + [len(e) for e in edges], dtype=numpy.int32),
+        "edge_chars": numpy.array(
+            [c for e in edges for c, t in e], dtype=numpy.int32),
+        "edge_targets": numpy.array(
+            [t for e in edges for c, t in e], dtype=numpy.int32)}
+
+
+def compile_profile(rules):
+    """Compile substitution rules into the arrays stored in a bundle."""
+    strings = [s for rule in rules for s in rule]
+    encoded = [s.encode("utf-8") for s in strings]
+    arrays = {
+        "text": numpy.frombuffer(b"".join(encoded), dtype=numpy.uint8),
+        "text_offsets": numpy.cumsum(
+            [0] + [len(e) for e in encoded], dtype=numpy.int32)}
+    for direction, keys in (("forward", [left for left, right in rules]),
+                            ("backward", [right for left, right in rules])):
+        for name, array in compile_trie(keys).items():
+            arrays[direction + "_" + name] = array
+    return arrays
+
+
+class CompiledTransducer:
+    """A transducer working on the tries of a compiled profile.
+
+    It gives the same results as `check_transcription_systems.Transducer`
+    with the same rules: At every position, the first rule whose left hand
+    side matches there is applied. Instead of comparing every rule in turn,
+    the trie finds all matching rules in one walk along the string.
+
+    >>> t = CompiledTransducer(compile_profile([("qq", "a"), ("aq", "b")]))
+    >>> t("qaqqqqq")
+    'qbaa'
+    >>> t.undo(t("qaqqqqq"))
+    'qaqqqqq'
+
+    """
+    def __init__(self, arrays):
+        self.arrays = arrays
+        self.wordboundary = WORDBOUNDARY
+        self._rules = None
+        self._tries = {}
+
+    @property
+    def rules(self):
+        if self._rules is None:
+            text = self.arrays["text"].tobytes()
+            offsets = self.arrays["text_offsets"].tolist()
+            strings = [text[i:j].decode("utf-8")
+                       for i, j in zip(offsets, offsets[1:])]
+            self._rules = list(zip(strings[::2], strings[1::2]))
+        return self._rules
+
+    def __repr__(self):
+        return "CompiledTransducer({:})".format(self.rules)
+
+    def __str__(self):
+        return " / ".join("{:} → {:}".format(before, after)
+                          for before, after in self.rules)
+
+    def trie(self, direction):
+        """Decode a trie to a list of (key index, {char: node}) pairs, and
+        the outputs of the keys."""
+        if direction not in self._tries:
+            a = self.arrays
+            offsets = a[direction + "_edge_offsets"].tolist()
+            chars = [chr(c) for c in a[direction + "_edge_chars"].tolist()]
+            targets = a[direction + "_edge_targets"].tolist()
+            nodes = [(key, dict(zip(chars[i:j], targets[i:j])))
+                     for key, i, j in zip(a[direction + "_node_key"].tolist(),
+                                          offsets, offsets[1:])]
+            outputs = [rule[direction == "forward"] for rule in self.rules]
+            self._tries[direction] = nodes, outputs
+        return self._tries[direction]
+
+    def transduce(self, line, direction):
+        trie, outputs = self.trie(direction)
+        line = self.wordboundary + line + self.wordboundary
+        start = 0
+        output = []
+        while start < len(line):
+            node = 0
+            best = None
+            end = start
+            for position in range(start, len(line)):
+                node = trie[node][1].get(line[position])
+                if node is None:
+                    break
+                key = trie[node][0]
+                if key >= 0 and (best is None or key < best):
+                    best = key
+                    end = position + 1
+            if best is None:
+                output.append(line[start])
+                start += 1
+            else:
+                output.append(outputs[best])
+                start = end
+        return "".join(output).strip(self.wordboundary)
+
+    def __call__(self, line):
+        """Apply the rules, like `Transducer.__call__`."""
+        return self.transduce(line, "forward")
+
+    def undo(self, line):
+        """Undo the rules as far as possible, like `Transducer.undo`."""
+        return self.transduce(line, "backward")
+
+
+@functools.lru_cache(maxsize=None)
+def compiled(rules):
+    """Compile a tuple of rules, shared by all profiles with these rules."""
+    return CompiledTransducer(compile_profile(list(rules)))
+
+
+class FusedTransducer:
+    """A chain of transducers, such as all profiles of a source, as one.
+
+    The chain gives the same output as applying its transducers in order,
+    and its `undo` undoes them in reverse order. Every transducer is compiled
+    to tries (see `CompiledTransducer`), and the results for recent strings
+    are memoized, so repeated values cost a dictionary lookup instead of a
+    pass per transducer.
+
+    Parameters
+    ----------
+    transducers : list
+        `Transducer`s or `CompiledTransducer`s, in the order of application
+    cache_size : int
+        How many results to remember in each direction
+
+    >>> f = FusedTransducer([
+    ...     CompiledTransducer(compile_profile([("a", "b")])),
+    ...     CompiledTransducer(compile_profile([("bb", "c")]))])
+    >>> f("ab"), f.undo("c")
+    ('c', 'aa')
+    >>> f.batch(["ab", "ba", "ab", "x"])
+    ['c', 'c', 'c', 'x']
+
+    """
+    def __init__(self, transducers, cache_size=65536):
+        self.transducers = [
+            t if isinstance(t, CompiledTransducer) else compiled(tuple(t.rules))
+            for t in transducers]
+        self._forward = functools.lru_cache(maxsize=cache_size)(
+            functools.partial(self.apply, self.transducers, "forward"))
+        self._backward = functools.lru_cache(maxsize=cache_size)(
+            functools.partial(self.apply, self.transducers[::-1], "backward"))
+
+    @staticmethod
+    def apply(transducers, direction, line):
+        for transducer in transducers:
+            line = transducer.transduce(line, direction)
+        return line
+
+    def __len__(self):
+        return len(self.transducers)
+
+    def __iter__(self):
+        return iter(self.transducers)
+
+    def __repr__(self):
+        return "FusedTransducer({:})".format(self.transducers)
+
+    def __str__(self):
+        return " ".join(str(t) for t in self.transducers)
+
+    def __call__(self, line):
+        return self._forward(line)
+
+    def undo(self, line):
+        return self._backward(line)
+
+    def batch(self, lines, undo=False):
+        """Transform a list of strings, each distinct string only once."""
+        transform = self.undo if undo else self
+        results = {line: transform(line) for line in set(lines)}
+        return [results[line] for line in lines]
+
+
+def stamp(path):
+    stat = path.stat()
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+class ProfileBundle:
+    """The compiled profiles of a dataset, memory-mapped from disk.
+
+    Parameters
+    ----------
+    root : Path
+        The directory relative to which profiles are named, as in the
+        `orthographic_profile` of sources and the `Orthography` of lects
+        (default: the LexiRumah CLDF directory)
+    path : Path, optional
+        The bundle file (default: p.bundle in root). The manifest is stored
+        next to it, with suffix .json.
+
+    """
+    def __init__(self, root=repository.parent, path=None):
+        self.root = Path(root)
+        self.path = Path(path or self.root / "p.bundle")
+        self.manifest_path = Path(str(self.path) + ".json")
+        self.transducers = {}
+        try:
+            with self.manifest_path.open(encoding="utf-8") as manifest:
+                self.manifest = json.load(manifest)
+            if self.manifest.get("version") != BUNDLE_VERSION:
+                raise ValueError("Outdated bundle")
+            self.data = (numpy.memmap(str(self.path), dtype=numpy.uint8,
+                                      mode="r")
+                         if self.manifest["size"] else numpy.zeros(0, "u1"))
+        except (OSError, ValueError, KeyError):
+            self.manifest = {"version": BUNDLE_VERSION, "size": 0,
+                             "profiles": {}}
+            self.data = numpy.zeros(0, dtype=numpy.uint8)
+
+    def arrays(self, name):
+        """Map the arrays of a profile from the bundle, without copying."""
+        arrays = {}
+        for key, (offset, dtype, length) in self.manifest["profiles"][name][
+                "arrays"].items():
+            dtype = numpy.dtype(dtype)
+            arrays[key] = self.data[
+                offset:offset + length * dtype.itemsize].view(dtype)
+        return arrays
+
+    def fresh(self, name):
+        """Check whether the bundle holds a current compilation of a profile.
+        """
+        entry = self.manifest["profiles"].get(name)
+        if entry is None or "arrays" not in entry:
+            return False
+        try:
+            return entry["stamp"] == stamp(self.root / name)
+        except OSError:
+            return False
+
+    def get(self, name):
+        """Return a `CompiledTransducer` for a profile, or None if the bundle
+        has no current compilation of it."""
+        if name not in self.transducers:
+            if not self.fresh(name):
+                return None
+            self.transducers[name] = CompiledTransducer(self.arrays(name))
+        return self.transducers[name]
+
+    def build(self, directory=None):
+        """Compile all profiles in the directory, and write the bundle.
+
+        Profiles whose modification time and size, or whose content, are
+        unchanged are copied from the current bundle. Profiles that cannot be
+        parsed are listed in the manifest with their error.
+
+        Returns
+        -------
+        (int, int, list of str): The number of compiled and of copied
+        profiles, and the names of profiles that could not be compiled
+
+        """
+        directory = Path(directory or self.root / "p")
+        old = self.manifest["profiles"]
+        profiles = {}
+        chunks = []
+        size = 0
+        compiled = copied = 0
+        failed = []
+        for file in sorted(directory.iterdir()):
+            if not file.is_file():
+                continue
+            name = file.relative_to(self.root).as_posix()
+            entry = {"stamp": stamp(file)}
+            previous = old.get(name, {})
+            if previous.get("stamp") == entry["stamp"]:
+                entry["sha1"] = previous["sha1"]
+            else:
+                entry["sha1"] = hashlib.sha1(file.read_bytes()).hexdigest()
+            if previous.get("sha1") == entry["sha1"] and (
+                    "arrays" in previous or "error" in previous):
+                arrays = (self.arrays(name) if "arrays" in previous else None)
+                error = previous.get("error")
+                copied += 1
+            else:
+                try:
+                    with file.open(encoding="utf-8") as lines:
+                        arrays = compile_profile(parse_profile(lines))
+                    error = None
+                except (NotImplementedError, ValueError,
+                        UnicodeDecodeError) as e:
+                    arrays, error = None, str(e)
+                compiled += 1
+            if error is not None:
+                entry["error"] = error
+                failed.append(name)
+            else:
+                entry["arrays"] = {}
+                for key, array in sorted(arrays.items()):
+                    # Align every array to 8 bytes
+                    padding = -size % 8
+                    chunks.append(b"\0" * padding)
+                    size += padding
+                    entry["arrays"][key] = [size, array.dtype.str, len(array)]
+                    chunks.append(array.tobytes())
+                    size += array.nbytes
+            profiles[name] = entry
+
+        temporary = Path(str(self.path) + ".tmp")
+        with temporary.open("wb") as bundle:
+            for chunk in chunks:
+                bundle.write(chunk)
+        self.data = numpy.zeros(0, dtype=numpy.uint8)
+        os.replace(str(temporary), str(self.path))
+        self.manifest = {"version": BUNDLE_VERSION, "size": size,
+                         "profiles": profiles}
+        with self.manifest_path.open("w", encoding="utf-8") as manifest:
+            json.dump(self.manifest, manifest, indent=1, sort_keys=True)
+        self.data = (numpy.memmap(str(self.path), dtype=numpy.uint8, mode="r")
+                     if size else numpy.zeros(0, dtype=numpy.uint8))
+        self.transducers = {}
+        return compiled, copied, failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--root", type=Path, default=repository.parent,
+        help="The directory the profiles are named relative to"
+        " (default: the LexiRumah CLDF directory)")
+    parser.add_argument(
+        "--profiles", type=Path, default=None,
+        help="The directory containing the profiles (default: p in root)")
+    parser.add_argument(
+        "--bundle", type=Path, default=None,
+        help="The bundle file to write (default: p.bundle in root)")
+    args = parser.parse_args()
+
+    bundle = ProfileBundle(args.root, args.bundle)
+    compiled, copied, failed = bundle.build(args.profiles)
+    for name in failed:
+        print("{:}: {:}".format(name, bundle.manifest["profiles"][name]["error"]))
+    print("Compiled {:d} profiles, kept {:d} unchanged ones.".format(
+        compiled, copied))
@@ -0,0 +1,168 @@
+"""Persistent store for pairwise alignment scores.
+
+Aligning two segment sequences is by far the most expensive step when
+generating testing pairs, checking cognate codings or clustering, and the same
+pairs are aligned again on every run. A `ScoreStore` keeps the scores in an
+SQLite file, keyed by the two segment sequences and a fingerprint of the
+scoring method (aligner, sound class model, gap penalties, scorer file …), so
+that repeated analyses only align pairs they have not seen before.
+
+>>> store = ScoreStore(":memory:", max_entries=2)
+>>> f = fingerprint("pw_align", "sca")
+>>> store.put_many(f, [(("a", "b"), ("a", "p"), 0.25)])
+>>> store.get_many(f, [(("a", "b"), ("a", "p")), (("a",), ("b",))])
+[0.25, None]
+>>> store.cached(f, [(("a",), ("b",))], lambda a, b: 1.0)
+[1.0]
+"""
+
+import hashlib
+import sqlite3
+
+from clldutils.path import Path
+
+DEFAULT_STORE = Path(__file__).parent.parent / "scores.sqlite"
+
+
+def fingerprint(*parts):
+    """Summarize the parameters of a scoring method in a short hash.
+
+    Pass everything that influences the score: the name of the aligner, the
+    model, gap penalties, and for trained scorers the content (not only the
+    name) of the scorer file.
+
+    >>> fingerprint("pw_align", "sca", -2) == fingerprint("pw_align", "sca", -2)
+    True
+
+    """
+    return hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()[:16]
+
+
+def file_fingerprint(path):
+    """Hash the content of a file, such as a LexStat scorer."""
+    sha = hashlib.sha1()
+    with Path(path).open("rb") as binary:
+        for block in iter(lambda: binary.read(1 << 20), b""):
+            sha.update(block)
+    return sha.hexdigest()[:16]
+
+
+def _key(segments):
+    return " ".join(segments)
+
+
+class ScoreStore:
+    """A size-bounded on-disk cache of alignment scores.
+
+    Parameters
+    ----------
+    path : str or Path
+        The SQLite file to use (default: scores.sqlite in the repository).
+    max_entries : int
+        When more scores are stored, the least recently used ones are evicted.
+    symmetric : bool
+        Treat (a, b) and (b, a) as the same pair. This holds for the distance
+        scores of `pw_align` and LexStat, but not for every scoring method.
+
+    """
+    def __init__(self, path=DEFAULT_STORE, max_entries=5000000,
+                 symmetric=True):
+        self.db = sqlite3.connect(str(path))
+        self.max_entries = max_entries
+        self.symmetric = symmetric
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS scores ("
+            " fingerprint TEXT, a TEXT, b TEXT, score REAL, used INTEGER,"
+            " PRIMARY KEY (fingerprint, a, b)) WITHOUT ROWID")
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS scores_used ON scores (used)")
+        self.clock = self.db.execute(
+            "SELECT COALESCE(MAX(used), 0) FROM scores").fetchone()[0]
+        # Kept up to date by put_many and evict, so that checking the size
+        # does not scan the table on every batch
+        self.count = len(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM scores").fetchone()[0]
+
+    def _pair(self, a, b):
+        a, b = _key(a), _key(b)
+        if self.symmetric and b < a:
+            return b, a
+        return a, b
+
+    def get_many(self, fingerprint, pairs):
+        """Look up scores for a batch of (segments, segments) pairs.
+
+        Returns a list parallel to `pairs`, with None for unknown pairs.
+
+        """
+        keys = [self._pair(a, b) for a, b in pairs]
+        self.db.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS wanted (a TEXT, b TEXT)")
+        self.db.execute("DELETE FROM wanted")
+        self.db.executemany("INSERT INTO wanted VALUES (?, ?)", set(keys))
+        found = {
+            (a, b): score for a, b, score in self.db.execute(
+                "SELECT s.a, s.b, s.score FROM wanted w JOIN scores s"
+                " ON s.fingerprint = ? AND s.a = w.a AND s.b = w.b",
+                (fingerprint,))}
+        if found:
+            self.clock += 1
+            self.db.executemany(
+                "UPDATE scores SET used = ? WHERE fingerprint = ? AND a = ?"
+                " AND b = ?",
+                [(self.clock, fingerprint, a, b) for a, b in found])
+        return [found.get(key) for key in keys]
+
+    def put_many(self, fingerprint, scored_pairs):
+        """Store a batch of (segments, segments, score) triples."""
+        self.clock += 1
+        rows = [(score, self.clock, fingerprint) + self._pair(a, b)
+                for a, b, score in scored_pairs]
+        # Update the known pairs first, so that the insert counts new rows
+        self.db.executemany(
+            "UPDATE scores SET score = ?, used = ? WHERE fingerprint = ?"
+            " AND a = ? AND b = ?", rows)
+        self.count += self.db.executemany(
+            "INSERT OR IGNORE INTO scores (score, used, fingerprint, a, b)"
+            " VALUES (?, ?, ?, ?, ?)", rows).rowcount
+        self.evict()
+        self.db.commit()
+
+    def evict(self):
+        """Remove the least recently used scores beyond `max_entries`."""
+        excess = self.count - self.max_entries
+        if excess > 0:
+            self.count -= self.db.execute(
+                "DELETE FROM scores WHERE (fingerprint, a, b) IN ("
+                " SELECT fingerprint, a, b FROM scores ORDER BY used LIMIT ?)",
+                (excess,)).rowcount
+
+    def cached(self, fingerprint, pairs, score):
+        """Score a batch of pairs, computing only those not yet stored.
+
+        `score` is called as score(a, b) for every pair missing from the
+        store, and the new scores are stored.
+
+        """
+        pairs = list(pairs)
+        scores = self.get_many(fingerprint, pairs)
+        new = []
+        for i, ((a, b), s) in enumerate(zip(pairs, scores)):
+            if s is None:
+                scores[i] = s = score(a, b)
+                new.append((a, b, s))
+        if new:
+            self.put_many(fingerprint, new)
+        return scores
@@ -1,13 +1,30 @@
 #!/usr/bin/env python
 
-"""Segment all IPA strings in a word list."""
+"""Segment all IPA strings in a word list.
 
-# import pandas
+The FormTable is read in chunks of rows, the forms of each chunk are
+tokenized by a pool of worker processes, and the segmented rows are written
+out before the next chunk is read, so memory use does not grow with the size
+of the word list. Besides the Segments, an ASJP column with the ASJP sound
+classes of the segments is written.
 
-import sys
+Example
+-------
+    $ segment --processes 4 --output segmented.csv
+"""
+
+import os
+import csv
 import argparse
+import itertools
+import multiprocessing
 
 import pyclpa.base
+from lingpy.sequence.sound_classes import tokens2class
+
+from clldutils.path import Path
+
+from pylexirumah import get_dataset, repository
 
 
 CLPA = pyclpa.base.CLPA()
@@ -111,55 +128,106 @@ def tokenize_clpa(form, ignore_clpa_errors=True, preprocess=WHITELIST):
             index_bw -= 1
 
 
+def segment_form(form):
+    """Segment a form, and give its ASJP sound classes.
+
+    Returns
+    -------
+    (str, str): The space-separated segments and ASJP classes, which are
+    empty if LingPy knows none of the segments
+
+    """
+    if not form:
+        return "", ""
+    segments = [str(x) for x in tokenize_clpa(form)]
+    try:
+        asjp = " ".join(tokens2class(segments, "asjp"))
+    except ValueError:
+        asjp = ""
+    return " ".join(segments), asjp
+
+
+def segment_table(rows, form_column, segments_column, asjp_column, pool,
+                  chunk_size=10000):
+    """Segment the forms of a stream of CSV rows.
+
+    Parameters
+    ----------
+    rows : iterable of lists of str
+        The rows of the FormTable, without header
+    form_column, segments_column, asjp_column : int
+        The positions of the columns in the rows
+    pool : multiprocessing.Pool
+    chunk_size : int
+        How many rows to hold in memory at once
+
+    Yields
+    ------
+    list of str: The rows with Segments and ASJP filled in
+
+    """
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            return
+        results = pool.map(segment_form, [row[form_column] for row in chunk])
+        for row, (segments, asjp) in zip(chunk, results):
+            row += [""] * (asjp_column + 1 - len(row))
+            row[segments_column] = segments
+            row[asjp_column] = asjp
+            yield row
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--cldf", type=Path, default=repository,
+        help="CLDF metadata file of the dataset (default: LexiRumah)")
+    parser.add_argument(
+        "--output", type=Path, default=None,
+        help="File to write the segmented FormTable to (default: replace"
+        " the FormTable, and add the ASJP column to the metadata)")
+    parser.add_argument(
+        "--processes", type=int, default=None,
+        help="Number of worker processes (default: number of CPUs)")
+    parser.add_argument(
+        "--chunk-size", type=int, default=10000,
+        help="Number of rows to segment at a time (default: 10000)")
+    args = parser.parse_args(args)
+
+    dataset = get_dataset(args.cldf)
+    table = dataset["FormTable"]
+    path = Path(str(dataset.directory)) / str(table.url)
+    c_form = dataset["FormTable", "form"].name
+    c_segments = dataset["FormTable", "segments"].name
+    output = args.output or path.parent / (path.name + ".segmenting")
+
+    try:
+        with path.open(encoding="utf-8", newline="") as forms, \
+                output.open("w", encoding="utf-8", newline="") as out, \
+                multiprocessing.Pool(args.processes) as pool:
+            reader = csv.reader(forms)
+            header = next(reader)
+            if "ASJP" not in header:
+                header.append("ASJP")
+            writer = csv.writer(out, lineterminator="\n")
+            writer.writerow(header)
+            writer.writerows(segment_table(
+                reader, header.index(c_form), header.index(c_segments),
+                header.index("ASJP"), pool, args.chunk_size))
+    except BaseException:
+        # Do not leave a half-written table behind
+        if args.output is None and output.exists():
+            output.unlink()
+        raise
+
+    if args.output is None:
+        os.replace(str(output), str(path))
+        if "ASJP" not in [c.name for c in table.tableSchema.columns]:
+            dataset.add_columns("FormTable", "ASJP")
+            dataset.write_metadata()
+
+
 if __name__ == '__main__':
-    def main(args):
-        parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
-        parser.add_argument("input", default="all_data.tsv", nargs="?",
-                            type=argparse.FileType('r'),
-                            help="Input filename containing word list")
-        parser.add_argument("output", default=sys.stdout, nargs="?",
-                            type=argparse.FileType('w'),
-                            help="Output file to write segmented data to")
-        parser.add_argument("--keep-orthographic", default=False, action='store_true',
-                            help="Do not remove orthographic variants")
-        args = parser.parse_args(args)
-
-        data = pandas.read_csv(
-            args.input,
-            sep="\t",
-            na_values=[""],
-            keep_default_na=False,
-            encoding='utf-8')
-
-        # Drop orthographic varieties
-        if not args.keep_orthographic:
-            data = data[~data["Language_ID"].str.endswith("-o")]
-
-        # Drop empty entries
-        data = data[~pandas.isnull(data["Value"])]
-
-        # Tokenize IPA, also to ASJP
-        data["Tokens"] = [" ".join(tokenize_word_reversibly(x, clean=True))
-                          for x in data["Value"]]
-
-        from infomapcog.ipa2asjp import ipa2asjp
-
-        data["ASJP"] = [" ".join(ipa2asjp(x))
-                        for x in data["Value"]]
-
-        # Clean up NaN values in cognate sets
-        data["Cognate Set"] = [
-            float("nan") if (i == 'nan' or pandas.isnull(i) or not i) else i
-            for i in data["Cognate Set"]]
-
-        # Remove line breaks from comments
-        data["Comment"] = [
-            x.replace("\n", "; ")
-            for x in data["Comment"]]
-
-        data.to_csv(
-            args.output,
-            index=False,
-            sep='\t',
-            na_rep="",
-            encoding='utf-8')
+    main()
@@ -0,0 +1,293 @@
+#!/usr/bin/env python
+
+"""Store the segments of all forms in one integer array.
+
+Every distinct segment of the FormTable is interned to a small integer in a
+dataset-wide `SymbolTable`, in which the boundary markers `_` (word boundary)
+and `+` (morpheme boundary) have fixed IDs. The segments of all forms are
+concatenated into one contiguous array of symbol IDs, with one offset per
+form, so the segments of a form are a slice of that array, not a copy.
+
+The store is cached next to the FormTable and rebuilt when the FormTable
+changes, keeping the IDs of symbols that were interned before.
+
+Example
+-------
+    $ python -m pylexirumah.segment_store
+    $ python -m pylexirumah.segment_store --ngrams 2
+"""
+
+import argparse
+import itertools
+from collections import Counter
+
+import numpy
+
+from clldutils.path import Path
+
+from pylexirumah import get_dataset, repository
+
+BOUNDARIES = ["_", "+"]
+
+
+class SymbolTable:
+    """A bidirectional mapping between segments and small integer IDs.
+
+    The boundary markers in `BOUNDARIES` always have the lowest IDs.
+
+    >>> t = SymbolTable()
+    >>> t.encode(["m", "a", "+", "t", "a"]).tolist()
+    [2, 3, 1, 4, 3]
+    >>> t.decode([2, 3, 0]), t["t"], len(t)
+    (['m', 'a', '_'], 4, 5)
+
+    """
+    def __init__(self, symbols=()):
+        self.symbols = []
+        self.ids = {}
+        for symbol in itertools.chain(BOUNDARIES, symbols):
+            self.intern(symbol)
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def __contains__(self, symbol):
+        return symbol in self.ids
+
+    def __getitem__(self, symbol):
+        return self.ids[symbol]
+
+    def intern(self, symbol):
+        """Find the ID of a symbol, adding it if it is new."""
+        try:
+            return self.ids[symbol]
+        except KeyError:
+            self.ids[symbol] = len(self.symbols)
+            self.symbols.append(symbol)
+            return self.ids[symbol]
+
+    def encode(self, segments):
+        """Intern a sequence of segments as an array of IDs."""
+        return numpy.array([self.intern(s) for s in segments],
+                           dtype=numpy.int32)
+
+    def decode(self, ids):
+        """Turn an array of IDs back into a list of segments."""
+        return [self.symbols[i] for i in ids]
+
+    def is_boundary(self, ids):
+        """Mark which of the IDs are boundary markers."""
+        return numpy.asarray(ids) < len(BOUNDARIES)
+
+
+class SegmentStore:
+    """The segments of all forms of a FormTable as slices of one array.
+
+    Parameters
+    ----------
+    form_ids : list of str
+    lects : list of str
+        The lect of every form
+    segments : iterable of sequences of str
+        The segments of every form
+    symbols : SymbolTable, optional
+        A table to intern the segments in, for stable IDs
+
+    Attributes
+    ----------
+    data : numpy.ndarray of int32
+        The symbol IDs of the segments of all forms, one after the other
+    offsets : numpy.ndarray of int64
+        Form i has the segments `data[offsets[i]:offsets[i + 1]]`
+    form_lects : numpy.ndarray
+        The index in `lects` of the lect of every form
+
+    >>> s = SegmentStore(["f1", "f2", "f3"], ["a", "b", "a"],
+    ...                  [["m", "a"], [], ["t", "a", "+", "m", "a"]])
+    >>> s["f3"].tolist(), s.strings("f3"), s.lengths().tolist()
+    ([4, 3, 1, 2, 3], ['t', 'a', '+', 'm', 'a'], [2, 0, 5])
+    >>> s["f3"].base is s.data
+    True
+    >>> s.counts().tolist()
+    [[0, 0, 2, 3, 1], [0, 0, 0, 0, 0]]
+    >>> sorted(s.ngrams(2).items())
+    [(('m', 'a'), 2), (('t', 'a'), 1)]
+    >>> s.ngrams(2, boundaries=True)[("a", "+")]
+    1
+
+    """
+    def __init__(self, form_ids, lects, segments, symbols=None):
+        self.symbols = SymbolTable() if symbols is None else symbols
+        self.form_ids = list(form_ids)
+        self.index = {f: i for i, f in enumerate(self.form_ids)}
+        lects = list(lects)
+        self.lects = list(dict.fromkeys(lects))
+        lect_index = {l: i for i, l in enumerate(self.lects)}
+        self.form_lects = numpy.array(
+            [lect_index[l] for l in lects], dtype=numpy.int64)
+        lengths = []
+        chain = []
+        for s in segments:
+            s = s or ()
+            lengths.append(len(s))
+            chain.extend(self.symbols.intern(x) for x in s)
+        self.data = numpy.array(chain, dtype=numpy.int32)
+        self.offsets = numpy.zeros(len(lengths) + 1, dtype=numpy.int64)
+        numpy.cumsum(lengths, out=self.offsets[1:])
+        self.built_from = None
+
+    @classmethod
+    def from_dataset(cls, dataset, cache_file=None):
+        """Load the store of a dataset's FormTable, from cache if possible.
+
+        Parameters
+        ----------
+        dataset : pycldf.Wordlist
+        cache_file : str or Path, optional
+            Where to keep the store (default: next to the FormTable, with
+            suffix .segments.npz)
+
+        """
+        table = dataset["FormTable"]
+        path = Path(str(dataset.directory)) / str(table.url)
+        cache_file = Path(cache_file or str(path) + ".segments.npz")
+        stat = path.stat()
+        stamp = [stat.st_size, stat.st_mtime_ns]
+
+        symbols = None
+        try:
+            store = cls.load(cache_file)
+            if store.built_from == stamp:
+                return store
+            symbols = store.symbols
+        except (OSError, ValueError, KeyError):
+            pass
+
+        c_id = dataset["FormTable", "id"].name
+        c_language = dataset["FormTable", "languageReference"].name
+        c_segments = dataset["FormTable", "segments"].name
+        rows = [(row[c_id], row[c_language], row[c_segments])
+                for row in table.iterdicts()]
+        store = cls([r[0] for r in rows], [r[1] for r in rows],
+                    [r[2] for r in rows], symbols)
+        store.built_from = stamp
+        store.save(cache_file)
+        return store
+
+    @classmethod
+    def load(cls, path):
+        with numpy.load(str(path)) as cache:
+            store = cls.__new__(cls)
+            store.symbols = SymbolTable(
+                cache["symbols"].tolist()[len(BOUNDARIES):])
+            if store.symbols.symbols != cache["symbols"].tolist():
+                raise ValueError("Boundary markers have changed")
+            store.form_ids = cache["form_ids"].tolist()
+            store.index = {f: i for i, f in enumerate(store.form_ids)}
+            store.lects = cache["lects"].tolist()
+            store.form_lects = cache["form_lects"]
+            store.data = cache["data"]
+            store.offsets = cache["offsets"]
+            store.built_from = cache["stamp"].tolist()
+        return store
+
+    def save(self, path):
+        numpy.savez(
+            str(path),
+            stamp=numpy.array(self.built_from or [], dtype=numpy.int64),
+            symbols=numpy.array(self.symbols.symbols, dtype=str),
+            form_ids=numpy.array(self.form_ids, dtype=str),
+            lects=numpy.array(self.lects, dtype=str),
+            form_lects=self.form_lects,
+            data=self.data,
+            offsets=self.offsets)
+
+    def __len__(self):
+        return len(self.form_ids)
+
+    def __contains__(self, form_id):
+        return form_id in self.index
+
+    def row(self, i):
+        """The symbol IDs of the i-th form, as a view into `data`."""
+        return self.data[self.offsets[i]:self.offsets[i + 1]]
+
+    def __getitem__(self, form_id):
+        return self.row(self.index[form_id])
+
+    def __iter__(self):
+        return (self.row(i) for i in range(len(self)))
+
+    def strings(self, form_id):
+        """The segments of a form as a list of strings."""
+        return self.symbols.decode(self[form_id])
+
+    def lengths(self):
+        """Count the segments of every form."""
+        return numpy.diff(self.offsets)
+
+    def positions(self):
+        """The index of the form of every position in `data`."""
+        return numpy.repeat(numpy.arange(len(self)), self.lengths())
+
+    def counts(self, boundaries=False):
+        """Count every symbol in the forms of every lect.
+
+        Returns
+        -------
+        numpy.ndarray of shape (lects, symbols)
+
+        """
+        n = len(self.symbols)
+        codes = self.form_lects[self.positions()] * n + self.data
+        if not boundaries:
+            codes = codes[~self.symbols.is_boundary(self.data)]
+        return numpy.bincount(
+            codes, minlength=len(self.lects) * n).reshape(len(self.lects), n)
+
+    def ngrams(self, n=2, boundaries=False):
+        """Count the segment n-grams within forms.
+
+        Unless `boundaries` is set, n-grams across boundary markers are
+        skipped.
+
+        Returns
+        -------
+        Counter mapping tuples of segments to frequencies
+
+        """
+        if len(self.data) < n:
+            return Counter()
+        windows = numpy.lib.stride_tricks.sliding_window_view(self.data, n)
+        starts = numpy.arange(len(windows))
+        # A window is within one form if it ends before the form does
+        ends = self.offsets[1:][self.positions()[:len(windows)]]
+        keep = starts + n <= ends
+        if not boundaries:
+            keep &= ~self.symbols.is_boundary(windows).any(1)
+        grams, frequencies = numpy.unique(
+            windows[keep], axis=0, return_counts=True)
+        return Counter({tuple(self.symbols.decode(gram)): int(f)
+                        for gram, f in zip(grams, frequencies)})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--cldf", type=Path, default=repository,
+        help="CLDF metadata file of the dataset (default: LexiRumah)")
+    parser.add_argument(
+        "--ngrams", type=int, default=None, metavar="N",
+        help="List the segment n-grams of this length, most common first")
+    args = parser.parse_args()
+
+    store = SegmentStore.from_dataset(get_dataset(args.cldf))
+    if args.ngrams:
+        for gram, frequency in store.ngrams(args.ngrams).most_common():
+            print(" ".join(gram), frequency, sep="\t")
+    else:
+        for symbol, frequency in zip(store.symbols.symbols,
+                                     numpy.bincount(
+                                         store.data,
+                                         minlength=len(store.symbols))):
+            print(symbol, frequency, sep="\t")
@@ -0,0 +1,417 @@
+#!/usr/bin/env python
+
+"""Find lects near each other and assign regions to them, offline.
+
+The lects of the LanguageTable are indexed in a k-d tree over their positions
+as 3D unit vectors, where straight-line (chord) distance grows monotonically
+with great-circle distance. This answers k-nearest-neighbour and radius queries
+without comparing every pair of lects; distances are reported in kilometres,
+computed with the haversine formula.
+
+Regions can be assigned without a web service, either from a GeoNames
+gazetteer dump (such as ID.txt from http://download.geonames.org/export/dump/),
+which mimics the nearest-feature lookups of `geo_lookup`, or from a GeoJSON
+file of (multi-)polygons, such as administrative boundaries.
+
+Example
+-------
+    $ python -m pylexirumah.spatial near abui1241-takal -k 5
+    $ python -m pylexirumah.spatial within abui1241-takal 50
+    $ python -m pylexirumah.spatial regions --gazetteer ID.txt
+"""
+
+import csv
+import sys
+import json
+import heapq
+import argparse
+
+import numpy
+
+from clldutils.path import Path
+
+from pylexirumah import get_dataset, repository
+from pylexirumah.geo_lookup import detail
+
+EARTH_RADIUS = 6371.0088
+
+
+def unit_vectors(latitudes, longitudes):
+    """Convert coordinates in degrees into an (n, 3) array of unit vectors."""
+    lat = numpy.radians(numpy.asarray(latitudes, dtype=float))
+    lon = numpy.radians(numpy.asarray(longitudes, dtype=float))
+    return numpy.stack([numpy.cos(lat) * numpy.cos(lon),
+                        numpy.cos(lat) * numpy.sin(lon),
+                        numpy.sin(lat)], axis=-1)
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """Great-circle distance in km, vectorized over numpy arrays.
+
+    >>> round(float(haversine(0, 0, 0, 1)), 1)
+    111.2
+    >>> haversine([0, 0], [0, 0], 0, [0, 180]).round()
+    array([    0., 20015.])
+
+    """
+    lat1, lon1, lat2, lon2 = (numpy.radians(numpy.asarray(x, dtype=float))
+                              for x in (lat1, lon1, lat2, lon2))
+    a = (numpy.sin((lat2 - lat1) / 2) ** 2 +
+         numpy.cos(lat1) * numpy.cos(lat2) * numpy.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS * numpy.arcsin(numpy.sqrt(numpy.clip(a, 0, 1)))
+
+
+def chord(km):
+    """Convert a great-circle distance into a chord length on the unit sphere."""
+    return 2 * numpy.sin(numpy.minimum(km / EARTH_RADIUS, numpy.pi) / 2)
+
+
+class KDTree:
+    """A k-d tree for nearest-neighbour and radius queries.
+
+    Nodes split their points at the median of the widest dimension; leaves of
+    up to `leaf_size` points are searched with vectorized numpy operations.
+
+    >>> tree = KDTree(numpy.array([[0, 0], [1, 0], [5, 5], [0, 2]]), 1)
+    >>> tree.query(numpy.array([0.2, 0]), 2)
+    [(0.2, 0), (0.8, 1)]
+    >>> sorted(tree.query_radius(numpy.array([0, 0]), 2))
+    [0, 1, 3]
+
+    """
+    def __init__(self, points, leaf_size=16):
+        self.points = numpy.asarray(points, dtype=float)
+        self.leaf_size = leaf_size
+        self.index = numpy.arange(len(self.points))
+        self.nodes = []
+        if len(self.points):
+            self._build(0, len(self.points))
+
+    def _build(self, start, end):
+        points = self.points[self.index[start:end]]
+        lower, upper = points.min(0), points.max(0)
+        node = len(self.nodes)
+        self.nodes.append(None)
+        if end - start <= self.leaf_size:
+            self.nodes[node] = (start, end, lower, upper, None, None)
+            return node
+        axis = numpy.argmax(upper - lower)
+        order = numpy.argsort(points[:, axis], kind="stable")
+        self.index[start:end] = self.index[start:end][order]
+        middle = (start + end) // 2
+        left = self._build(start, middle)
+        right = self._build(middle, end)
+        self.nodes[node] = (start, end, lower, upper, left, right)
+        return node
+
+    def _box_distance(self, node, point):
+        start, end, lower, upper, left, right = self.nodes[node]
+        gap = numpy.maximum(numpy.maximum(lower - point, point - upper), 0)
+        return numpy.sqrt((gap ** 2).sum())
+
+    def query(self, point, k=1):
+        """Find the k nearest points.
+
+        Returns
+        -------
+        list of (distance, index) pairs, nearest first
+
+        """
+        if not self.nodes:
+            return []
+        best = []  # A heap of (-distance, -index)
+        frontier = [(0.0, 0)]
+        while frontier:
+            bound, node = heapq.heappop(frontier)
+            if len(best) == k and bound > -best[0][0]:
+                break
+            start, end, lower, upper, left, right = self.nodes[node]
+            if left is None:
+                indices = self.index[start:end]
+                distances = numpy.sqrt(
+                    ((self.points[indices] - point) ** 2).sum(1))
+                for d, i in zip(distances, indices):
+                    candidate = (-float(d), -int(i))
+                    if len(best) < k:
+                        heapq.heappush(best, candidate)
+                    elif candidate > best[0]:
+                        heapq.heapreplace(best, candidate)
+            else:
+                for child in (left, right):
+                    heapq.heappush(
+                        frontier, (self._box_distance(child, point), child))
+        return sorted((-d, -i) for d, i in best)
+
+    def query_radius(self, point, radius):
+        """Find the indices of all points within `radius` of `point`."""
+        found = []
+        stack = [0] if self.nodes else []
+        while stack:
+            node = stack.pop()
+            if self._box_distance(node, point) > radius:
+                continue
+            start, end, lower, upper, left, right = self.nodes[node]
+            if left is None:
+                indices = self.index[start:end]
+                distances = numpy.sqrt(
+                    ((self.points[indices] - point) ** 2).sum(1))
+                found.extend(int(i) for i in indices[distances <= radius])
+            else:
+                stack.extend((left, right))
+        return found
+
+
+class LectIndex:
+    """A spatial index of lects.
+
+    Parameters
+    ----------
+    lects : iterable of dict
+        LanguageTable rows. Lects without coordinates are not indexed.
+
+    """
+    def __init__(self, lects):
+        lects = [lect for lect in lects
+                 if lect["Latitude"] is not None
+                 and lect["Longitude"] is not None]
+        self.ids = [lect["ID"] for lect in lects]
+        self.latitudes = numpy.array([float(l["Latitude"]) for l in lects])
+        self.longitudes = numpy.array([float(l["Longitude"]) for l in lects])
+        self.tree = KDTree(unit_vectors(self.latitudes, self.longitudes))
+        self.position = {id: i for i, id in enumerate(self.ids)}
+
+    @classmethod
+    def from_dataset(cls, dataset):
+        return cls(dataset["LanguageTable"].iterdicts())
+
+    def _coordinates(self, where):
+        if isinstance(where, str):
+            i = self.position[where]
+            return self.latitudes[i], self.longitudes[i]
+        return where
+
+    def _result(self, indices, latitude, longitude):
+        indices = numpy.array(indices, dtype=int)
+        distances = haversine(latitude, longitude, self.latitudes[indices],
+                              self.longitudes[indices])
+        return sorted(zip((self.ids[i] for i in indices), map(float, distances)),
+                      key=lambda pair: (pair[1], pair[0]))
+
+    def nearest(self, where, k=5):
+        """Find the k lects nearest to a lect ID or a (lat, lon) pair.
+
+        A lect given by ID is not counted among its own neighbours.
+
+        Returns
+        -------
+        list of (Lect ID, distance in km) pairs, nearest first
+
+        """
+        latitude, longitude = self._coordinates(where)
+        extra = 1 if isinstance(where, str) else 0
+        found = self.tree.query(
+            unit_vectors(latitude, longitude), min(k + extra, len(self.ids)))
+        result = self._result([i for d, i in found], latitude, longitude)
+        if extra:
+            result = [r for r in result if r[0] != where]
+        return result[:k]
+
+    def within(self, where, km):
+        """Find all lects within `km` kilometres of a lect ID or (lat, lon)."""
+        latitude, longitude = self._coordinates(where)
+        found = self.tree.query_radius(
+            unit_vectors(latitude, longitude), chord(km) * (1 + 1e-12))
+        return [r for r in self._result(found, latitude, longitude)
+                if r[0] != where and r[1] <= km]
+
+
+class Gazetteer:
+    """Assign regions from the nearest features of a GeoNames dump.
+
+    Like `geo_lookup`, a region consists of the names of the nearest
+    administrative divisions listed in `geo_lookup.detail` for the country,
+    followed by the first-order division (ADM1) and the country. These two
+    are not taken from the nearest ADM1 and country features, whose positions
+    are far from their borders, but from the admin codes of the nearest
+    lower-level division.
+
+    """
+    LOCAL_CODES = {"ADM2", "ADM3", "ADM4"}
+
+    def __init__(self, path):
+        features = {}
+        self.admin1 = {}
+        self.countries = {}
+        with Path(path).open(encoding="utf-8", newline="") as dump:
+            for row in csv.reader(dump, delimiter="\t", quoting=csv.QUOTE_NONE):
+                if len(row) < 11:
+                    continue
+                name, code, country, admin1 = row[1], row[7], row[8], row[10]
+                if code == "PCLI":
+                    self.countries[country] = name
+                elif code == "ADM1":
+                    self.admin1[country, admin1] = name
+                if code == "ADM1" or code in self.LOCAL_CODES:
+                    feature = (name, float(row[4]), float(row[5]), country,
+                               admin1)
+                    features.setdefault(code, []).append(feature)
+                    if code in self.LOCAL_CODES:
+                        features.setdefault("local", []).append(feature)
+        self.features = {}
+        for code, rows in features.items():
+            names, latitudes, longitudes, countries, admin1 = zip(*rows)
+            self.features[code] = (
+                rows, KDTree(unit_vectors(latitudes, longitudes)))
+
+    def nearest(self, code, latitude, longitude, country=None):
+        """Find the nearest feature with this code, in the given country.
+
+        Returns
+        -------
+        (name, latitude, longitude, country, admin1 code) or None
+
+        """
+        try:
+            rows, tree = self.features[code]
+        except KeyError:
+            return None
+        point = unit_vectors(latitude, longitude)
+        for k in (1, 8, len(rows)):
+            for d, i in tree.query(point, k):
+                if country is None or rows[i][3] == country:
+                    return rows[i]
+        return None
+
+    def region(self, latitude, longitude):
+        """Look up the region of a coordinate, as a list of names."""
+        local = (self.nearest("local", latitude, longitude) or
+                 self.nearest("ADM1", latitude, longitude))
+        if local is None:
+            return None
+        country, admin1 = local[3], local[4]
+        address = [self.admin1.get((country, admin1), admin1),
+                   self.countries.get(country, country)]
+        for code in detail.get(country.upper(), []):
+            feature = self.nearest(code, latitude, longitude, country)
+            if feature:
+                address.insert(0, feature[0])
+        return address
+
+
+class PolygonRegions:
+    """Assign regions from a GeoJSON file of (multi-)polygons.
+
+    The region of a point is the list of names (the `name_property` of the
+    features) of all polygons containing it, smallest polygon first.
+
+    """
+    def __init__(self, path, name_property="name"):
+        with Path(path).open(encoding="utf-8") as geojson:
+            data = json.load(geojson)
+        self.polygons = []
+        for feature in data["features"]:
+            geometry = feature["geometry"]
+            if geometry["type"] == "Polygon":
+                polygons = [geometry["coordinates"]]
+            elif geometry["type"] == "MultiPolygon":
+                polygons = geometry["coordinates"]
+            else:
+                continue
+            rings = [numpy.array(ring, dtype=float)
+                     for polygon in polygons for ring in polygon]
+            area = sum(abs(self.area(ring)) for polygon in polygons
+                       for ring in polygon[:1])
+            box = numpy.vstack(rings)
+            self.polygons.append((
+                feature["properties"].get(name_property), rings, area,
+                box.min(0), box.max(0)))
+        self.polygons.sort(key=lambda polygon: polygon[2])
+
+    @staticmethod
+    def area(ring):
+        ring = numpy.asarray(ring, dtype=float)
+        x, y = ring[:, 0], ring[:, 1]
+        return (x * numpy.roll(y, -1) - numpy.roll(x, -1) * y).sum() / 2
+
+    @staticmethod
+    def contains(rings, x, y):
+        """Even-odd rule point-in-polygon test, vectorized over the edges.
+
+        Holes are handled by the even-odd rule, as their edges are counted
+        like those of the outer rings.
+
+        >>> PolygonRegions.contains([numpy.array([[0, 0], [2, 0], [2, 2], [0, 2]])], 1, 1)
+        True
+
+        """
+        crossings = 0
+        for ring in rings:
+            x1, y1 = ring[:, 0], ring[:, 1]
+            x2, y2 = numpy.roll(x1, -1), numpy.roll(y1, -1)
+            straddles = (y1 > y) != (y2 > y)
+            with numpy.errstate(divide="ignore", invalid="ignore"):
+                x_cross = x1 + (y - y1) * (x2 - x1) / (y2 - y1)
+            crossings += numpy.count_nonzero(straddles & (x < x_cross))
+        return bool(crossings % 2)
+
+    def region(self, latitude, longitude):
+        x, y = float(longitude), float(latitude)
+        names = [name for name, rings, area, lower, upper in self.polygons
+                 if lower[0] <= x <= upper[0] and lower[1] <= y <= upper[1]
+                 and self.contains(rings, x, y)]
+        return names or None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--cldf", type=Path, default=repository,
+        help="CLDF metadata file of the dataset (default: LexiRumah)")
+    commands = parser.add_subparsers(dest="command")
+    near = commands.add_parser("near", help="List the nearest lects")
+    near.add_argument("lect", help="Lect ID")
+    near.add_argument("-k", type=int, default=5,
+                      help="Number of lects to list (default: 5)")
+    within = commands.add_parser(
+        "within", help="List the lects within a distance")
+    within.add_argument("lect", help="Lect ID")
+    within.add_argument("km", type=float, help="Distance in km")
+    regions = commands.add_parser(
+        "regions", help="Fill in the Region column of the LanguageTable")
+    source = regions.add_mutually_exclusive_group(required=True)
+    source.add_argument("--gazetteer", type=Path,
+                        help="GeoNames dump file, such as ID.txt")
+    source.add_argument("--polygons", type=Path,
+                        help="GeoJSON file with region polygons")
+    regions.add_argument(
+        "--name-property", default="name",
+        help="Feature property holding the polygon names (default: name)")
+    args = parser.parse_args()
+
+    dataset = get_dataset(args.cldf)
+    if args.command in ("near", "within"):
+        index = LectIndex.from_dataset(dataset)
+        if args.command == "near":
+            found = index.nearest(args.lect, args.k)
+        else:
+            found = index.within(args.lect, args.km)
+        for lect, km in found:
+            print(lect, "{:.1f}".format(km), sep="\t")
+    elif args.command == "regions":
+        if args.gazetteer:
+            regions = Gazetteer(args.gazetteer)
+        else:
+            regions = PolygonRegions(args.polygons, args.name_property)
+        lects = list(dataset["LanguageTable"].iterdicts())
+        for lect in lects:
+            if lect["Latitude"] is None or lect["Longitude"] is None:
+                continue
+            region = regions.region(lect["Latitude"], lect["Longitude"])
+            if region:
+                lect["Region"] = ", ".join(region)
+            else:
+                print("No region found for {:}.".format(lect["ID"]),
+                      file=sys.stderr)
+        dataset["LanguageTable"].write(lects)
+    else:
+        parser.print_help()
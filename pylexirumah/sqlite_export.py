@@ -0,0 +1,304 @@
+#!/usr/bin/env python
+
+"""Export the LexiRumah CLDF dataset into a plain, indexed SQLite file.
+
+Unlike `clld_sqlite.py`, this does not need the clld web application: Every
+CLDF table becomes a SQLite table with the same column names, foreign keys and
+indexes on all reference columns. List-valued columns (such as Segments) are
+stored joined by their separator, except for the Source column, which becomes
+a separate association table to the `sources` table. Only the current cognate
+class assignment of every form is exported (see
+`compact_cognates.latest_assignments`). The `clades` table lists, for every
+lect, its family and – when exported with `--glottolog` – all Glottolog
+ancestors.
+
+The `LexiRumahDB` class provides some common queries on such a file.
+
+Example
+-------
+    $ python -m pylexirumah.sqlite_export lexirumah.sqlite
+    >>> db = LexiRumahDB("lexirumah.sqlite")  # doctest: +SKIP
+    >>> db.forms(cognateset="leg-1", clade="alor1247")  # doctest: +SKIP
+"""
+
+import sqlite3
+import argparse
+
+from clldutils.path import Path
+
+from pylexirumah import get_dataset, repository
+from pylexirumah.compact_cognates import latest_assignments
+
+SQL_TYPES = {
+    "decimal": "REAL",
+    "float": "REAL",
+    "double": "REAL",
+    "integer": "INTEGER",
+    "boolean": "INTEGER",
+}
+
+
+def table_name(table):
+    """Name the SQLite table for a CLDF table, after its file name.
+
+    >>> table_name(argparse.Namespace(url="missing_forms.csv"))
+    'missing_forms'
+
+    """
+    return Path(str(table.url)).stem
+
+
+def quote(name):
+    return '"{:s}"'.format(name.replace('"', '""'))
+
+
+def sql_value(column, value):
+    """Convert a value read by csvw into something SQLite can store."""
+    if value is None:
+        return None
+    if column.separator and isinstance(value, list):
+        return column.separator.join("" if v is None else str(v) for v in value)
+    if isinstance(value, (int, float, str, bool)):
+        return value
+    return str(value)
+
+
+def create_table(db, dataset, table):
+    """Create the SQLite table for a CLDF table, and its source table.
+
+    Returns
+    -------
+    (list, bool): The exported columns, and whether the table has sources
+
+    """
+    name = table_name(table)
+    columns = [c for c in table.tableSchema.columns if c.name != "Source"]
+    has_sources = len(columns) < len(table.tableSchema.columns)
+    primary_key = table.tableSchema.primaryKey or []
+    definitions = []
+    for column in columns:
+        datatype = column.datatype.base if column.datatype else "string"
+        definitions.append("{:s} {:s}{:s}".format(
+            quote(column.name), SQL_TYPES.get(datatype, "TEXT"),
+            " PRIMARY KEY" if primary_key == [column.name] else ""))
+    references = []
+    for foreign_key in table.tableSchema.foreignKeys:
+        target = Path(str(foreign_key.reference.resource)).stem
+        definitions.append("FOREIGN KEY ({:s}) REFERENCES {:s} ({:s})".format(
+            ", ".join(map(quote, foreign_key.columnReference)), quote(target),
+            ", ".join(map(quote, foreign_key.reference.columnReference))))
+        references.extend(foreign_key.columnReference)
+    db.execute("CREATE TABLE {:s} ({:s})".format(
+        quote(name), ", ".join(definitions)))
+    for column in references + [c.name for c in columns
+                                if c.name == "Cognateset_ID"]:
+        db.execute("CREATE INDEX {:s} ON {:s} ({:s})".format(
+            quote("{:s}_{:s}".format(name, column)), quote(name),
+            quote(column)))
+
+    if has_sources:
+        db.execute(
+            "CREATE TABLE {:s} (ID TEXT REFERENCES {:s} (ID),"
+            " Source_ID TEXT REFERENCES sources (ID),"
+            " PRIMARY KEY (ID, Source_ID))".format(
+                quote(name + "_sources"), quote(name)))
+        db.execute("CREATE INDEX {:s} ON {:s} (Source_ID)".format(
+            quote(name + "_sources_Source_ID"), quote(name + "_sources")))
+    return columns, has_sources
+
+
+def export(dataset, path, clades=None):
+    """Write the dataset into a new SQLite file.
+
+    Parameters
+    ----------
+    dataset : pycldf.Wordlist
+    path : str or Path
+        The SQLite file to write. An existing file is replaced.
+    clades : dict, optional
+        Additional clades for lects: Lect IDs mapped to lists of (clade ID,
+        clade name) pairs, such as their Glottolog ancestors. The family of
+        every lect is always included.
+
+    Returns
+    -------
+    int: The number of rows violating a foreign key constraint
+
+    """
+    path = Path(path)
+    if path.exists():
+        path.unlink()
+    db = sqlite3.connect(str(path))
+    db.execute(
+        "CREATE TABLE sources (ID TEXT PRIMARY KEY, Genre TEXT, Author TEXT,"
+        " Year TEXT, Title TEXT, BibTeX TEXT)")
+    db.executemany("INSERT INTO sources VALUES (?, ?, ?, ?, ?, ?)", (
+        (source.id, source.genre, source.get("author"), source.get("year"),
+         source.get("title"), source.bibtex())
+        for source in dataset.sources.items()))
+
+    for table in dataset.tables:
+        columns, has_sources = create_table(db, dataset, table)
+        if str(table.url) == str(dataset["CognateTable"].url):
+            rows = latest_assignments(dataset).values()
+        else:
+            rows = table.iterdicts()
+        name = table_name(table)
+        insert = "INSERT INTO {:s} VALUES ({:s})".format(
+            quote(name), ", ".join("?" for c in columns))
+        sources = []
+        batch = []
+        for row in rows:
+            batch.append([sql_value(c, row[c.name]) for c in columns])
+            if has_sources:
+                sources.extend((row["ID"], s) for s in set(row["Source"] or []))
+        db.executemany(insert, batch)
+        if has_sources:
+            db.executemany("INSERT INTO {:s} VALUES (?, ?)".format(
+                quote(name + "_sources")), sources)
+
+    db.execute(
+        "CREATE TABLE clades (Lect_ID TEXT REFERENCES lects (ID),"
+        " Clade TEXT, Name TEXT, PRIMARY KEY (Lect_ID, Clade))")
+    db.execute("CREATE INDEX clades_Clade ON clades (Clade)")
+    lect_clades = set()
+    for lect in dataset["LanguageTable"].iterdicts():
+        if lect["Family"]:
+            lect_clades.add((lect["ID"], lect["Family"], lect["Family"]))
+        for clade, clade_name in (clades or {}).get(lect["ID"], []):
+            lect_clades.add((lect["ID"], clade, clade_name))
+    db.executemany("INSERT INTO clades VALUES (?, ?, ?)", sorted(lect_clades))
+
+    violations = len(db.execute("PRAGMA foreign_key_check").fetchall())
+    db.execute("ANALYZE")
+    db.commit()
+    db.close()
+    return violations
+
+
+def glottolog_clades(dataset):
+    """List the Glottolog ancestors of every lect, for `export`.
+
+    This looks up every lect in Glottolog, locally if pyglottolog is
+    available and online otherwise.
+
+    """
+    from pylexirumah.util import lexirumah_glottocodes
+    clades = {}
+    for lect, languoid in lexirumah_glottocodes(dataset, {}).items():
+        if languoid is None:
+            continue
+        clades[lect] = [(parent["id"], parent["name"])
+                        for parent in languoid.classification]
+        clades[lect].append((languoid.id, languoid.name))
+    return clades
+
+
+class LexiRumahDB:
+    """Query an SQLite file written by `export`.
+
+    All query methods return lists of `sqlite3.Row`s, which can be indexed
+    like dicts by column name.
+
+    """
+    def __init__(self, path):
+        self.db = sqlite3.connect(str(path))
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA foreign_keys = ON")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.db.close()
+
+    def query(self, sql, *parameters):
+        """Run an arbitrary SQL query."""
+        return self.db.execute(sql, parameters).fetchall()
+
+    def forms(self, cognateset=None, clade=None, concept=None, lect=None):
+        """List forms, with their lect, concept and cognate class.
+
+        Parameters
+        ----------
+        cognateset : str, optional
+            Only forms currently assigned to this cognate class
+        clade : str, optional
+            Only forms of lects in this clade (a family name, or – if exported
+            with Glottolog clades – a Glottocode)
+        concept : str, optional
+            Only forms for this Concept ID
+        lect : str, optional
+            Only forms of this Lect ID
+
+        """
+        conditions = []
+        parameters = []
+        if cognateset is not None:
+            conditions.append("c.Cognateset_ID = ?")
+            parameters.append(cognateset)
+        if clade is not None:
+            conditions.append(
+                "f.Lect_ID IN (SELECT Lect_ID FROM clades WHERE Clade = ?)")
+            parameters.append(clade)
+        if concept is not None:
+            conditions.append("f.Concept_ID = ?")
+            parameters.append(concept)
+        if lect is not None:
+            conditions.append("f.Lect_ID = ?")
+            parameters.append(lect)
+        return self.query(
+            "SELECT f.*, l.Name AS Lect, p.English AS Concept,"
+            " c.Cognateset_ID, c.Alignment FROM forms f"
+            " JOIN lects l ON f.Lect_ID = l.ID"
+            " JOIN concepts p ON f.Concept_ID = p.ID"
+            " LEFT JOIN cognates c ON c.Form_ID = f.ID" +
+            (" WHERE " + " AND ".join(conditions) if conditions else "") +
+            " ORDER BY f.Concept_ID, f.Lect_ID, f.ID", *parameters)
+
+    def cognatesets(self, concept=None):
+        """List cognate classes with their concept and number of forms."""
+        return self.query(
+            "SELECT c.Cognateset_ID, f.Concept_ID, COUNT(*) AS Forms,"
+            " COUNT(DISTINCT f.Lect_ID) AS Lects FROM cognates c"
+            " JOIN forms f ON c.Form_ID = f.ID" +
+            (" WHERE f.Concept_ID = ?" if concept is not None else "") +
+            " GROUP BY c.Cognateset_ID, f.Concept_ID ORDER BY c.Cognateset_ID",
+            *([concept] if concept is not None else []))
+
+    def clades(self, lect):
+        """List the clades a lect belongs to."""
+        return self.query(
+            "SELECT Clade, Name FROM clades WHERE Lect_ID = ?", lect)
+
+    def sources(self, form):
+        """List the sources of a form."""
+        return self.query(
+            "SELECT s.* FROM sources s JOIN forms_sources fs"
+            " ON fs.Source_ID = s.ID WHERE fs.ID = ?", form)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "output", type=Path, nargs="?", default=Path("lexirumah.sqlite"),
+        help="SQLite file to write (default: lexirumah.sqlite)")
+    parser.add_argument(
+        "--cldf", type=Path, default=repository,
+        help="CLDF metadata file of the dataset (default: LexiRumah)")
+    parser.add_argument(
+        "--glottolog", action="store_true", default=False,
+        help="Also store the Glottolog ancestors of every lect as clades."
+        " This looks up every lect in Glottolog, online if no local copy is"
+        " available through pyglottolog.")
+    args = parser.parse_args()
+
+    dataset = get_dataset(args.cldf)
+    clades = glottolog_clades(dataset) if args.glottolog else None
+    violations = export(dataset, args.output, clades=clades)
+    if violations:
+        print("Warning: {:d} rows refer to missing rows in other tables."
+              .format(violations))
@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+
+"""Sweep autocode clustering parameters and score them against a gold standard
+
+The word list and the LexStat scorer are loaded (or computed and cached, see
+`autocode.load_scorer`) only once. Every combination of the given thresholds,
+gap opening penalties, alignment modes and cluster methods is then clustered
+in a pool of worker processes, and scored against the gold standard like in
+`check_cognate_coding.py`. The output is a table of all configurations, best
+first.
+
+The gold standard is either a CSV file of pairwise judgements, which must
+refer to forms by their CLDF form IDs, or with `--gold-format cldf` another
+CLDF Wordlist, whose cognate classes are compared to the clusters by B-cubed
+precision and recall. The pairs in `goldstandard/AggregatePairJudgements.csv`
+use the legacy numerical form IDs, so they do not match any form.
+
+Example
+-------
+    $ python -m pylexirumah.sweep_autocode cldf/cldf-metadata.json \\
+        gold/cldf-metadata.json --gold-format cldf \\
+        --threshold 0.45 0.5 0.55 0.6 --cluster-method infomap upgma
+"""
+
+import sys
+import math
+import argparse
+import itertools
+import multiprocessing
+
+from clldutils.path import Path
+
+from pylexirumah.autocode import load_wordlist, load_scorer
+from pylexirumah.check_cognate_coding import (
+    load_gold_pairs, load_gold_partition, pair_statistics, pair_scores,
+    partition_statistics, partition_scores)
+
+# The output columns for pairwise and for CLDF gold standards
+COLUMNS = {
+    "pairs": ["f-score", "precision", "recall", "threshold", "gop", "mode",
+              "cluster_method", "clusters", "tp", "fn", "fp", "tn"],
+    "cldf": ["f-score", "precision", "recall", "pairwise f-score",
+             "threshold", "gop", "mode", "cluster_method", "clusters",
+             "forms"]}
+
+# Set in each worker process by `_initialize`
+_lex = None
+_gold = None
+
+
+def _initialize(lex, gold):
+    global _lex, _gold
+    _lex = lex
+    _gold = gold
+
+
+def codings(lex, ref):
+    """Map form IDs to the cognate class in column `ref` of a LingPy object."""
+    result = {}
+    for idx in lex:
+        code = lex[idx, ref]
+        if isinstance(code, list):
+            code = tuple(code)
+        result[lex[idx, "reference"]] = code
+    return result
+
+
+def gold_overlap(lex, gold_format, gold):
+    """Count the gold pairs or gold forms that are in the word list."""
+    forms = {lex[idx, "reference"] for idx in lex}
+    if gold_format == "cldf":
+        return sum(form in forms for form in gold[0])
+    ids1, ids2, judgements = gold
+    return sum(a in forms and b in forms for a, b in zip(ids1, ids2))
+
+
+def score_configuration(configuration):
+    """Cluster the worker's word list with one configuration and score it.
+
+    Parameters
+    ----------
+    configuration : tuple
+        (threshold, gop, mode, cluster_method, partial)
+
+    Returns
+    -------
+    dict
+        The configuration, the number of clusters found and the scores. With
+        a CLDF gold standard, precision, recall and f-score are the B-cubed
+        ones.
+
+    """
+    threshold, gop, mode, cluster_method, partial = configuration
+    ref = "sweepids" if partial else "sweepid"
+    if partial:
+        _lex.partial_cluster(
+            method='lexstat', threshold=threshold, ref=ref,
+            cluster_method=cluster_method, override=True, verbose=False,
+            gop=gop, mode=mode)
+    else:
+        _lex.cluster(
+            method='lexstat', threshold=threshold, ref=ref,
+            cluster_method=cluster_method, override=True, verbose=False,
+            gop=gop, mode=mode)
+    coded = codings(_lex, ref)
+    gold_format, gold = _gold
+    result = {
+        "threshold": threshold,
+        "gop": gop,
+        "mode": mode,
+        "cluster_method": cluster_method,
+        "clusters": len(set(coded.values()))}
+    if gold_format == "cldf":
+        form_ids, concepts, classes = gold
+        # Uncoded forms are singletons of their own
+        predicted = [coded.get(form, ("uncoded", form)) for form in form_ids]
+        statistics, _ = partition_statistics(concepts, classes, predicted)
+        scores = partition_scores(statistics.sum(0))
+        result.update({
+            "forms": len(form_ids),
+            "f-score": scores["B-cubed f-score"],
+            "precision": scores["B-cubed precision"],
+            "recall": scores["B-cubed recall"],
+            "pairwise f-score": scores["pairwise f-score"]})
+    else:
+        ids1, ids2, judgements = gold
+        statistics = pair_statistics(ids1, ids2, judgements, coded).sum(0)
+        result.update({
+            "tp": statistics[0],
+            "fn": statistics[1],
+            "fp": statistics[2],
+            "tn": statistics[3]})
+        result.update(pair_scores(statistics))
+    return result
+
+
+def ranking(result):
+    """Sort by F-score, best first, and configurations without one last."""
+    f = result["f-score"]
+    return (math.isnan(f), -f if not math.isnan(f) else 0,
+            result["threshold"])
+
+
+def sweep(lex, gold, thresholds, gops, modes, cluster_methods,
+          partial=False, processes=None, gold_format="pairs"):
+    """Score all parameter combinations, ranked by F-score, best first.
+
+    Raises
+    ------
+    ValueError
+        If no gold pair (or gold form, for a CLDF gold standard) is in the
+        word list, so that every configuration would score the same.
+
+    """
+    if not gold_overlap(lex, gold_format, gold):
+        raise ValueError(
+            "None of the gold {:} refer to forms of the word list. Gold pairs"
+            " must use CLDF form IDs.".format(
+                "forms" if gold_format == "cldf" else "pairs"))
+    grid = list(itertools.product(
+        thresholds, gops, modes, cluster_methods, [partial]))
+    with multiprocessing.Pool(
+            processes, initializer=_initialize,
+            initargs=(lex, (gold_format, gold))) as pool:
+        results = pool.map(score_configuration, grid, chunksize=1)
+    return sorted(results, key=ranking)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("input", type=Path,
+                        help="Input file containing the CLDF word list.")
+    parser.add_argument("gold", type=Path,
+                        help="A CSV file listing pairs of forms and whether"
+                        " they should be considered cognates or not, or a"
+                        " CLDF dataset if --gold-format is 'cldf'.")
+    parser.add_argument("output", nargs="?", default=sys.stdout,
+                        type=argparse.FileType('w'),
+                        help="File to write the ranked table to"
+                        " (default: stdout)")
+    parser.add_argument("--soundclass", default="sca",
+                        choices=["sca", "dolgo", "asjp", "art"],
+                        help="Sound class model to use. (default: sca)")
+    parser.add_argument("--threshold", nargs="+", type=float,
+                        default=[0.45, 0.5, 0.55, 0.6, 0.65],
+                        help="Cognate clustering threshold values."
+                        " (default: 0.45 0.5 0.55 0.6 0.65)")
+    parser.add_argument("--cluster-method", nargs="+", default=["infomap"],
+                        help="Cognate clustering method names."
+                        " (default: infomap)")
+    parser.add_argument("--gop", nargs="+", type=float, default=[-2],
+                        help="Gap opening penalties. (default: -2)")
+    parser.add_argument("--mode", nargs="+", default=["overlap"],
+                        choices=['global', 'local', 'overlap', 'dialign'],
+                        help="Alignment modes. (default: overlap)")
+    parser.add_argument("--partial", action="store_true", default=False,
+                        help="Score partial instead of monolithic cognate"
+                        " classes")
+    parser.add_argument("--ratio", default=1.5, type=float,
+                        help="Ratio of language-pair specific vs. general"
+                        " scores in the LexStat algorithm. (default: 1.5)")
+    parser.add_argument("--initial-threshold", default=0.7, type=float,
+                        help="Threshold value for the initial pairs used to"
+                        "bootstrap the calculation. (default: 0.7)")
+    parser.add_argument("--runs", default=10000, type=int,
+                        help="Number of permutation runs if the scorer is not"
+                        " cached yet. (default: 10000)")
+    parser.add_argument("--processes", default=None, type=int,
+                        help="Number of worker processes"
+                        " (default: number of CPUs)")
+    parser.add_argument("--gold-format", default="pairs",
+                        choices=["pairs", "cldf"],
+                        help="Whether GOLD contains pairwise judgements or"
+                        " a full cognate coding (default: pairs)")
+    parser.add_argument("--column-id-1", default="ID1",
+                        help="Header of first column containing Form_IDs in"
+                        " GOLD (default: ID1)")
+    parser.add_argument("--column-id-2", default="ID2",
+                        help="Header of second column containing Form_IDs in"
+                        " GOLD (default: ID2)")
+    parser.add_argument("--gold-column", default="Cognate",
+                        help="Header of column containing cognate judgements"
+                        " (default: Cognate)")
+    args = parser.parse_args()
+
+    lex = load_wordlist(args.input, args.soundclass)
+    load_scorer(lex, args.input, args.soundclass, args.ratio,
+                args.initial_threshold, runs=args.runs)
+    if args.gold_format == "cldf":
+        gold = load_gold_partition(args.gold)
+    else:
+        gold = load_gold_pairs(
+            args.gold, args.column_id_1, args.column_id_2, args.gold_column)
+
+    try:
+        results = sweep(lex, gold, args.threshold, args.gop, args.mode,
+                        args.cluster_method, partial=args.partial,
+                        processes=args.processes,
+                        gold_format=args.gold_format)
+    except ValueError as e:
+        parser.error(str(e))
+
+    columns = COLUMNS[args.gold_format]
+    print(*columns, sep="\t", file=args.output)
+    for result in results:
+        print(*("{:.4f}".format(result[c]) if isinstance(result[c], float)
+                else result[c]
+                for c in columns),
+              sep="\t", file=args.output)
@@ -0,0 +1,432 @@
+#!/usr/bin/env python
+
+"""Synthesize a larger CLDF word list from the statistics of a real one.
+
+Every lect of the dataset is cloned `scale` times, with the same family,
+Glottocode and orthographic profiles, slightly moved coordinates and the
+same concepts and numbers of synonyms. Forms are sampled from a bigram
+model of the segments of the real forms, and their local orthography is
+derived by undoing the lect's profiles.
+
+Cognate classes are drawn from a two-level Chinese restaurant process per
+concept: lects of one language (one Glottocode) mostly share classes, and
+languages of one family share classes less often. Each class has a
+proto-form, which changes a little in every language and every lect.
+
+Alongside the CognateTable, Edictor files with the cognate classes and
+alignments of all forms are written, each with a different random fraction
+of forms moved to other classes and alignments changed, as input for
+`append_changed_cognate_classes`.
+
+Example
+-------
+    $ python -m pylexirumah.synthesize synthetic-100x --scale 100
+"""
+
+import sys
+import csv
+import random
+import shutil
+import argparse
+import itertools
+from collections import Counter, OrderedDict
+
+from clldutils.path import Path
+
+from pylexirumah import get_dataset, repository
+from pylexirumah.segment_store import SegmentStore
+from pylexirumah.profile_bundle import compiled, parse_profile, FusedTransducer
+
+SOURCE = "synthetic"
+
+
+class SegmentModel:
+    """A bigram model of the segments of forms.
+
+    Parameters
+    ----------
+    bigrams : Counter mapping (segment, segment) to frequencies
+        None stands for the start and end of a form.
+
+    >>> m = SegmentModel(Counter({(None, "t"): 1, ("t", "a"): 1,
+    ...                           ("a", None): 1}))
+    >>> m.sample(random.Random(0)), m.successor(random.Random(0), "a")
+    (['t', 'a'], 't')
+
+    """
+    def __init__(self, bigrams):
+        following = OrderedDict()
+        for (a, b), n in sorted(bigrams.items(), key=lambda x: (
+                x[0][0] or "", x[0][1] or "")):
+            following.setdefault(a, []).append((b, n))
+        self.transitions = {}
+        self.inner = {}
+        for a, options in following.items():
+            self.transitions[a] = self._cumulative(options)
+            inner = [(b, n) for b, n in options if b is not None]
+            self.inner[a] = self._cumulative(inner) if inner else (
+                self._cumulative(following[None]))
+
+    @staticmethod
+    def _cumulative(options):
+        return ([b for b, n in options],
+                list(itertools.accumulate(n for b, n in options)))
+
+    @classmethod
+    def from_store(cls, store):
+        """Count the bigrams, starts and ends of the forms in a store."""
+        lengths = store.lengths()
+        nonempty = lengths > 0
+        bigrams = Counter(store.ngrams(2, boundaries=True))
+        for i in store.data[store.offsets[:-1][nonempty]]:
+            bigrams[None, store.symbols.symbols[i]] += 1
+        for i in store.data[store.offsets[1:][nonempty] - 1]:
+            bigrams[store.symbols.symbols[i], None] += 1
+        return cls(bigrams)
+
+    def sample(self, rng, max_length=20):
+        """Draw a form as a list of segments."""
+        segments = []
+        state = None
+        while len(segments) < max_length:
+            symbols, weights = self.transitions.get(state, self.inner[None])
+            state = rng.choices(symbols, cum_weights=weights)[0]
+            if state is None:
+                break
+            segments.append(state)
+        while segments and segments[-1] in ("_", "+"):
+            segments.pop()
+        return segments or self.sample(rng, max_length)
+
+    def successor(self, rng, previous):
+        """Draw a segment that may follow `previous` (None: the start)."""
+        symbols, weights = self.inner.get(previous, self.inner[None])
+        return rng.choices(symbols, cum_weights=weights)[0]
+
+
+def mutate(rng, model, segments, rate):
+    """Change every segment with probability `rate`, mostly by substitution
+    and sometimes by deletion."""
+    result = []
+    for segment in segments:
+        r = rng.random()
+        if r < rate / 5 and len(segments) > 2:
+            continue
+        elif r < rate:
+            segment = model.successor(rng, result[-1] if result else None)
+        result.append(segment)
+    return result
+
+
+class CognateProcess:
+    """Draw the cognate classes of lects with a two-level Chinese restaurant
+    process per concept.
+
+    A lect takes a class already used in its language with a probability
+    proportional to how often it is used there, or otherwise one used in its
+    family, or with a probability growing with `alpha_family` a new class.
+
+    >>> p = CognateProcess(random.Random(0), 0, 0)
+    >>> [p.draw("leg", "fam", "lang") for _ in range(3)]
+    [(0, True), (0, False), (0, False)]
+    >>> p.new_class("leg"), p.draw("leg", "other", "lang2")
+    (1, (2, True))
+
+    """
+    def __init__(self, rng, alpha_language=0.3, alpha_family=1.0):
+        self.rng = rng
+        self.alpha_language = alpha_language
+        self.alpha_family = alpha_family
+        self.classes = Counter()
+        self.families = {}
+        self.languages = {}
+
+    def draw(self, concept, family, language):
+        """Draw a class for a lect.
+
+        Returns
+        -------
+        (int, bool): The number of the class among those of the concept, and
+        whether it is new
+
+        """
+        language_counts = self.languages.setdefault((concept, language),
+                                                    Counter())
+        total = sum(language_counts.values())
+        if total and self.rng.random() * (
+                total + self.alpha_language) < total:
+            k = self.choose(language_counts)
+            language_counts[k] += 1
+            return k, False
+        family_counts = self.families.setdefault((concept, family), Counter())
+        total = sum(family_counts.values())
+        new = not total or self.rng.random() * (
+            total + self.alpha_family) >= total
+        if new:
+            k = self.new_class(concept)
+        else:
+            k = self.choose(family_counts)
+        family_counts[k] += 1
+        language_counts[k] += 1
+        return k, new
+
+    def new_class(self, concept):
+        """Number a class of a concept that was never handed out before."""
+        k = self.classes[concept]
+        self.classes[concept] += 1
+        return k
+
+    def choose(self, counts):
+        classes = sorted(counts)
+        return self.rng.choices(
+            classes, weights=[counts[k] for k in classes])[0]
+
+
+def formatter(table):
+    """Build a function turning dicts into CSV rows of a table."""
+    columns = [(c.name, c.separator) for c in table.tableSchema.columns]
+
+    def format_row(row):
+        result = []
+        for name, separator in columns:
+            value = row.get(name)
+            if value is None:
+                value = ""
+            elif separator and not isinstance(value, str):
+                value = separator.join(str(v) for v in value)
+            result.append(value)
+        return result
+    return [name for name, _ in columns], format_row
+
+
+def lect_profiles(lects, root):
+    """Fuse the orthographic profiles of every lect, skipping broken ones."""
+    files = {}
+    profiles = {}
+    for lect in lects:
+        transducers = []
+        orthography = lect.get("Orthography") or []
+        if isinstance(orthography, str):
+            orthography = orthography.split(":")
+        for name in orthography:
+            if name and name not in files:
+                try:
+                    with (root / name).open(encoding="utf-8") as lines:
+                        files[name] = compiled(tuple(parse_profile(lines)))
+                except (OSError, ValueError, NotImplementedError):
+                    files[name] = None
+            if name and files[name] is not None:
+                transducers.append(files[name])
+        profiles[lect["ID"]] = FusedTransducer(transducers)
+    return profiles
+
+
+def synthesize(metadata, output, scale=10, seed=0, changes=1, moved=0.05,
+               realigned=0.02, log=sys.stderr):
+    """Write a synthetic dataset `scale` times the size of a real one.
+
+    Parameters
+    ----------
+    metadata : Path
+        CLDF metadata file of the real dataset
+    output : Path
+        The directory to write the dataset to
+    scale : int
+        How many synthetic lects to create for every lect
+    seed : int
+    changes : int
+        How many Edictor change files to write
+    moved, realigned : float
+        The fractions of forms moved to a different cognate class and with
+        a changed alignment in each Edictor file
+
+    Returns
+    -------
+    int: The number of forms written
+
+    """
+    rng = random.Random(seed)
+    metadata = Path(metadata)
+    dataset = get_dataset(metadata)
+    root = metadata.parent
+    output = Path(output)
+    output.mkdir(parents=True, exist_ok=True)
+
+    store = SegmentStore.from_dataset(dataset)
+    if not len(store):
+        raise ValueError(
+            "The FormTable of {:} has no forms to take statistics from."
+            .format(root))
+    model = SegmentModel.from_store(store)
+    concepts = OrderedDict()
+    for form in dataset["FormTable"].iterdicts():
+        concepts.setdefault(form["Lect_ID"], Counter())[
+            form["Concept_ID"]] += 1
+    lects = [lect for lect in dataset["LanguageTable"].iterdicts()
+             if lect["ID"] in concepts]
+
+    # Static parts of the dataset are copied
+    shutil.copy(str(metadata), str(output))
+    shutil.copy(str(root / str(dataset["ParameterTable"].url)), str(output))
+    if (root / "p").exists() and not (output / "p").exists():
+        shutil.copytree(str(root / "p"), str(output / "p"))
+    with (root / "sources.bib").open(encoding="utf-8") as bib:
+        sources = bib.read()
+    with (output / "sources.bib").open("w", encoding="utf-8") as bib:
+        bib.write(sources)
+        bib.write("\n@misc{{{:}, title={{Synthetic forms}}}}\n".format(
+            SOURCE))
+    for table in ("ValueTable", "BorrowingTable"):
+        try:
+            header, _ = formatter(dataset[table])
+        except KeyError:
+            continue
+        with (output / str(dataset[table].url)).open(
+                "w", encoding="utf-8", newline="") as empty:
+            csv.writer(empty).writerow(header)
+
+    # Synthetic lects
+    header, format_lect = formatter(dataset["LanguageTable"])
+    clones = []
+    with (output / str(dataset["LanguageTable"].url)).open(
+            "w", encoding="utf-8", newline="") as table:
+        writer = csv.writer(table)
+        writer.writerow(header)
+        for lect in lects:
+            for k in range(1, scale + 1):
+                clone = dict(lect)
+                clone["ID"] = "{:}-s{:d}".format(lect["ID"], k)
+                clone["Name"] = "{:} {:d}".format(lect["Name"], k)
+                for coordinate in ("Latitude", "Longitude"):
+                    if clone.get(coordinate) is not None:
+                        clone[coordinate] = round(
+                            float(clone[coordinate]) +
+                            rng.uniform(-0.05, 0.05), 4)
+                writer.writerow(format_lect(clone))
+                clones.append((lect, clone["ID"]))
+    print("Wrote {:d} lects.".format(len(clones)), file=log)
+
+    profiles = lect_profiles(lects, root)
+    process = CognateProcess(rng)
+    protoforms = {}
+    languages = {}
+    codes = {}
+    # The change files have their own random generator and their own new
+    # classes, so that the base dataset does not depend on them
+    change_rng = random.Random(seed + 1)
+    splits = Counter()
+
+    form_header, format_form = formatter(dataset["FormTable"])
+    cognate_header, format_cognate = formatter(dataset["CognateTable"])
+    form_file = (output / str(dataset["FormTable"].url)).open(
+        "w", encoding="utf-8", newline="")
+    cognate_file = (output / str(dataset["CognateTable"].url)).open(
+        "w", encoding="utf-8", newline="")
+    edictor_files = [(output / "edictor-changes-{:d}.tsv".format(i)).open(
+        "w", encoding="utf-8", newline="") for i in range(1, changes + 1)]
+    forms = csv.writer(form_file)
+    forms.writerow(form_header)
+    cognates = csv.writer(cognate_file)
+    cognates.writerow(cognate_header)
+    edictors = [csv.writer(f, delimiter="\t", lineterminator="\n")
+                for f in edictor_files]
+    for edictor in edictors:
+        edictor.writerow(["ID", "DOCULECT", "CONCEPT", "REFERENCE", "TOKENS",
+                          "COGID", "ALIGNMENT"])
+    n = 0
+    try:
+        for lect, lect_id in clones:
+            family = lect.get("Family") or ""
+            language = lect.get("Glottocode") or lect["ID"]
+            for concept, synonyms in concepts[lect["ID"]].items():
+                for i in range(1, synonyms + 1):
+                    k, new = process.draw(concept, family, language)
+                    cognateset = "{:}-{:d}".format(concept, k + 1)
+                    if new:
+                        protoforms[cognateset] = model.sample(rng)
+                    if (cognateset, language) not in languages:
+                        languages[cognateset, language] = mutate(
+                            rng, model, protoforms[cognateset], 0.15)
+                    segments = mutate(
+                        rng, model, languages[cognateset, language], 0.05)
+                    value = "".join(
+                        " " if s == "_" else s for s in segments
+                        if s != "+")
+                    n += 1
+                    form_id = "{:}-{:}-{:d}".format(lect_id, concept, i)
+                    forms.writerow(format_form({
+                        "ID": form_id,
+                        "Lect_ID": lect_id,
+                        "Concept_ID": concept,
+                        "Form_according_to_Source": value,
+                        "Form": value,
+                        "Local_Orthography": profiles[lect["ID"]].undo(
+                            value).strip(),
+                        "Segments": segments,
+                        "Source": [SOURCE]}))
+                    cognates.writerow(format_cognate({
+                        "ID": str(n),
+                        "Form_ID": form_id,
+                        "Cognateset_ID": cognateset,
+                        "Alignment": segments,
+                        "Source": [SOURCE]}))
+                    code = codes.setdefault(cognateset, len(codes) + 1)
+                    for edictor in edictors:
+                        changed_code, alignment = code, list(segments)
+                        if change_rng.random() < moved:
+                            other = change_rng.randrange(
+                                process.classes[concept] + 1)
+                            if other < process.classes[concept]:
+                                target = "{:}-{:d}".format(concept, other + 1)
+                            else:
+                                # A class of its own, named apart from those
+                                # the process hands out later
+                                splits[concept] += 1
+                                target = "{:}-split-{:d}".format(
+                                    concept, splits[concept])
+                            changed_code = codes.setdefault(
+                                target, len(codes) + 1)
+                        if change_rng.random() < realigned:
+                            alignment.insert(
+                                change_rng.randrange(len(alignment) + 1), "-")
+                        edictor.writerow([
+                            n, lect_id, concept, form_id, " ".join(segments),
+                            changed_code, " ".join(alignment)])
+    finally:
+        for f in [form_file, cognate_file] + edictor_files:
+            f.close()
+    print("Wrote {:d} forms in {:d} cognate classes.".format(
+        n, sum(process.classes.values())), file=log)
+    return n
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "output", type=Path,
+        help="Directory to write the synthetic dataset to")
+    parser.add_argument(
+        "--cldf", type=Path, default=repository,
+        help="CLDF metadata file of the dataset to take statistics from"
+        " (default: LexiRumah)")
+    parser.add_argument(
+        "--scale", type=int, default=10,
+        help="Number of synthetic lects per real lect (default: 10)")
+    parser.add_argument(
+        "--seed", type=int, default=0,
+        help="Seed of the random generator (default: 0)")
+    parser.add_argument(
+        "--changes", type=int, default=1,
+        help="Number of Edictor change files to write (default: 1)")
+    parser.add_argument(
+        "--moved", type=float, default=0.05,
+        help="Fraction of forms moved to another cognate class in each"
+        " change file (default: 0.05)")
+    parser.add_argument(
+        "--realigned", type=float, default=0.02,
+        help="Fraction of forms with a changed alignment in each change file"
+        " (default: 0.02)")
+    args = parser.parse_args()
+
+    synthesize(args.cldf, args.output, args.scale, args.seed,
+               args.changes, args.moved, args.realigned)
@@ -25,6 +25,7 @@ except (ValueError, ImportError):
     local_glottolog = None
 
 from . import get_dataset, repository
+from .brackets import resolve_brackets
 
 REPLACE = {
     " ": "_",
@@ -55,31 +56,6 @@ def identifier(string):
     return re.sub('(\W|^(?=\d))+', '_', string).strip("_")
 
 
-def resolve_brackets(string):
-    """Resolve a string into all description without brackets
-
-    For a `string` with matching parentheses, but without nested parentheses,
-    yield every combination of the contents of any parenthesis being present or
-    absent.
-
-    >>> list(resolve_brackets("no brackets"))
-    ["no brackets"]
-
-    >>> sorted(list(resolve_brackets("(no )bracket(s)")))
-    ["bracket", "brackets", "no bracket", "no brackets"]
-
-    """
-    if "(" in string:
-        opening = string.index("(")
-        closing = string.index(")")
-        for form in resolve_brackets(string[:opening] + string[closing+1:]):
-            yield form
-        for form in resolve_brackets(string[:opening] + string[opening+1:closing] + string[closing+1:]):
-            yield form
-    else:
-        yield string
-
-
 def online_languoid(iso_or_glottocode):
     """Look the glottocode or ISO-639-3 code up in glottolog online.
 
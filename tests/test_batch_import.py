@@ -0,0 +1,59 @@
+from unittest import TestCase, skipUnless
+import shutil
+import tempfile
+
+from clldutils.path import Path
+
+try:
+    from pylexirumah.batch_import import (
+        parse_template, LECTS_DIRECTORY, SOURCES_DIRECTORY,
+        WORDLIST_DIRECTORY)
+except Exception:
+    # Loading BIPA needs the CLTS data
+    parse_template = None
+
+TEMPLATE = {
+    (LECTS_DIRECTORY, "lects.csv"): """\
+ID,Name,Family,Latitude,Longitude,Region,Glottocode,Iso,Culture,Description,Orthography,Comment
+newl1234-a,New A,Austronesian,-8,120,,newl1234,,,,,
+""",
+    (SOURCES_DIRECTORY, "src.bib"): """\
+@misc{new2020a, title={New list A}, year={2020}}
+""",
+    (WORDLIST_DIRECTORY, "wordlist.csv"): """\
+Concept_ID,Lect_ID,Form_according_to_Source,Form,Local_Orthography,Comment
+arm,newl1234-a,tana,tana,,
+leg,unkn1234-x,kaki,kaki,,
+eye,unkn1234-x,,,,not in source
+""",
+} if parse_template else {}
+
+
+@skipUnless(parse_template, "BIPA is not available")
+class Tests(TestCase):
+    def setUp(self):
+        self.tmp = Path(tempfile.mkdtemp())
+        for (directory, name), content in TEMPLATE.items():
+            (self.tmp / directory).mkdir(exist_ok=True)
+            with (self.tmp / directory / name).open(
+                    "w", encoding="utf-8") as table:
+                table.write(content)
+
+    def tearDown(self):
+        shutil.rmtree(str(self.tmp))
+
+    def test_forms_of_unknown_lects_are_dropped(self):
+        template = parse_template((self.tmp, self.tmp, {}))
+        self.assertEqual([f["Concept_ID"] for f in template.forms], ["arm"])
+        self.assertEqual(template.missing, [])
+        self.assertEqual(
+            [p for p in template.problems if "without metadata" in p],
+            ["Form for leg belongs to lect unkn1234-x without metadata.",
+             "Form for eye belongs to lect unkn1234-x without metadata."])
+
+    def test_unreadable_template(self):
+        shutil.rmtree(str(self.tmp / SOURCES_DIRECTORY))
+        template = parse_template((self.tmp, self.tmp, {}))
+        self.assertEqual(template.forms, [])
+        self.assertTrue(
+            template.problems[0].startswith("Could not read template"))
@@ -0,0 +1,83 @@
+from unittest import TestCase
+import shutil
+import tempfile
+
+import numpy
+from clldutils.path import Path
+
+from pylexirumah import repository
+from pylexirumah.check_cognate_coding import (
+    pair_statistics, pair_scores, partition_statistics, partition_scores,
+    load_gold_pairs, load_gold_partition, load_lingpy_codings)
+
+from .test_sqlite_export import TABLES
+
+WORDLIST = """\
+ID\tDOCULECT\tCONCEPT\tIPA\tTOKENS\tPARTIAL_IDS
+1\tA\thand\ttaŋa\tt a ŋ a\t1
+2\tB\thand\ttaŋan\tt a ŋ a n\t1
+3\tC\thand\tlima\tl i m a\t2
+"""
+
+GOLD = """\
+ID1,ID2,Cognate
+1,2,1
+1,3,-1
+2,3,1
+"""
+
+
+class Tests(TestCase):
+    def test_pair_statistics(self):
+        codings = {"a": 1, "b": 1, "c": 2}
+        statistics = pair_statistics(
+            ["a", "a", "a", "x"], ["b", "c", "b", "a"],
+            numpy.array([True, False, False, True]), codings)
+        self.assertEqual(list(statistics.sum(0)), [1, 1, 1, 1])
+        self.assertAlmostEqual(pair_scores(statistics.sum(0))["f-score"], 0.5)
+
+    def test_partition_scores(self):
+        concepts = ["c1"] * 4 + ["c2"] * 2
+        gold = [1, 1, 2, 2, 1, 1]
+        predicted = [1, 1, 1, 2, 1, 2]
+        statistics, concept_list = partition_statistics(
+            concepts, gold, predicted)
+        self.assertEqual(concept_list, ["c1", "c2"])
+        scores = partition_scores(statistics.sum(0))
+        # Gold pairs: (1,2), (3,4), (5,6); predicted pairs: (1,2), (1,3), (2,3)
+        self.assertAlmostEqual(scores["pairwise precision"], 1 / 3)
+        self.assertAlmostEqual(scores["pairwise recall"], 1 / 3)
+        # B-cubed precision per form: 2/3, 2/3, 1/3, 1, 1, 1
+        self.assertAlmostEqual(scores["B-cubed precision"], 14 / 18)
+
+    def test_lingpy_pair_statistics(self):
+        tmp = Path(tempfile.mkdtemp())
+        try:
+            with (tmp / "wordlist.tsv").open("w", encoding="utf-8") as f:
+                f.write(WORDLIST)
+            with (tmp / "gold.csv").open("w", encoding="utf-8") as f:
+                f.write(GOLD)
+            forms, codings = load_lingpy_codings(tmp / "wordlist.tsv")
+            ids1, ids2, judgements = load_gold_pairs(tmp / "gold.csv")
+        finally:
+            shutil.rmtree(str(tmp))
+        self.assertEqual(sorted(forms), ["1", "2", "3"])
+        statistics = pair_statistics(ids1, ids2, judgements, codings)
+        # (tp, fn, fp, tn): 1–2 found, 2–3 missed, 1–3 correctly apart
+        self.assertEqual(list(statistics.sum(0)), [1, 1, 0, 1])
+
+    def test_gold_partition(self):
+        tmp = Path(tempfile.mkdtemp())
+        try:
+            shutil.copy(str(repository), str(tmp / repository.name))
+            for name, content in TABLES.items():
+                with (tmp / name).open("w", encoding="utf-8") as table:
+                    table.write(content)
+            form_ids, concepts, codes = load_gold_partition(
+                tmp / repository.name)
+        finally:
+            shutil.rmtree(str(tmp))
+        self.assertEqual(
+            form_ids, ["abui1241-takal-leg-1", "alor1247-besar-leg-1"])
+        self.assertEqual(concepts, ["leg", "leg"])
+        self.assertEqual(len(codes), 2)
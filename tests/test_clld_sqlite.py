@@ -0,0 +1,52 @@
+from unittest import TestCase, skipUnless, mock
+import shutil
+import tempfile
+
+from clldutils.path import Path
+
+from pylexirumah import get_dataset, repository
+
+from .test_sqlite_export import TABLES
+
+try:
+    import transaction
+    from sqlalchemy import create_engine
+    from clld.db.meta import Base, DBSession
+    from pylexirumah import clld_sqlite
+except ImportError:
+    clld_sqlite = None
+
+
+@skipUnless(clld_sqlite, "clld and the lexirumah app are not installed")
+class Tests(TestCase):
+    def setUp(self):
+        self.tmp = Path(tempfile.mkdtemp())
+        shutil.copy(str(repository), str(self.tmp / repository.name))
+        for name, content in TABLES.items():
+            with (self.tmp / name).open("w", encoding="utf-8") as table:
+                table.write(content)
+        # A concept without forms, which neither import path adds
+        with (self.tmp / "concepts.csv").open("a", encoding="utf-8") as table:
+            table.write("arm,,arm,lengan,,,true,1673,\n")
+        engine = create_engine("sqlite://")
+        DBSession.remove()
+        DBSession.configure(bind=engine)
+        Base.metadata.create_all(engine)
+
+    def tearDown(self):
+        DBSession.remove()
+        shutil.rmtree(str(self.tmp))
+
+    def test_bulk_valuesets_have_parameters(self):
+        dataset = get_dataset(self.tmp / repository.name)
+        with mock.patch.object(clld_sqlite, "get_dataset",
+                               return_value=dataset):
+            with transaction.manager:
+                clld_sqlite.db_main(bulk=True)
+        valuesets = DBSession.query(clld_sqlite.ValueSet).all()
+        self.assertEqual(len(valuesets), 2)
+        self.assertNotIn(None, [v.parameter_pk for v in valuesets])
+        self.assertEqual(
+            {v.parameter.id for v in valuesets}, {"leg"})
+        self.assertEqual(
+            [p.id for p in DBSession.query(clld_sqlite.Concept)], ["leg"])
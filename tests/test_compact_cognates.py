@@ -0,0 +1,43 @@
+from unittest import TestCase
+import shutil
+import tempfile
+
+from clldutils.path import Path
+
+from pylexirumah import get_dataset, repository
+from pylexirumah.compact_cognates import latest_assignments, CognateIndex
+
+from .test_sqlite_export import TABLES
+
+
+class Tests(TestCase):
+    def setUp(self):
+        self.tmp = Path(tempfile.mkdtemp())
+        shutil.copy(str(repository), str(self.tmp / repository.name))
+        for name, content in TABLES.items():
+            with (self.tmp / name).open("w", encoding="utf-8") as table:
+                table.write(content)
+        self.dataset = get_dataset(self.tmp / repository.name)
+
+    def tearDown(self):
+        shutil.rmtree(str(self.tmp))
+
+    def test_lookup_by_form(self):
+        assignments = latest_assignments(
+            self.dataset, ["alor1247-besar-leg-1", "unkn1234-x-leg-1"])
+        self.assertEqual(list(assignments), ["alor1247-besar-leg-1"])
+        self.assertEqual(
+            assignments["alor1247-besar-leg-1"]["Cognateset_ID"], "leg-2")
+        self.assertEqual(
+            assignments["alor1247-besar-leg-1"],
+            latest_assignments(self.dataset)["alor1247-besar-leg-1"])
+        self.assertTrue((self.tmp / "cognates.csv.idx").exists())
+
+    def test_index_is_rebuilt_after_appending(self):
+        index = CognateIndex(self.dataset)
+        self.assertEqual(len(index), 2)
+        with (self.tmp / "cognates.csv").open("a", encoding="utf-8") as table:
+            table.write("4,abui1241-takal-leg-1,leg-3,t ɛ k,src\n")
+        self.assertEqual(
+            latest_assignments(self.dataset, ["abui1241-takal-leg-1"])[
+                "abui1241-takal-leg-1"]["Cognateset_ID"], "leg-3")
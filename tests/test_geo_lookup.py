@@ -0,0 +1,87 @@
+from unittest import TestCase
+import json
+import shutil
+import tempfile
+import threading
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from clldutils.path import Path
+
+from pylexirumah.geo_lookup import GeoNamesClient, RegionCache, update_regions
+
+
+class StubGeoNames(BaseHTTPRequestHandler):
+    """Answer like the GeoNames findNearby(PlaceName)JSON methods."""
+    protocol_version = "HTTP/1.1"
+    requests = []
+    overloaded = 0
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        StubGeoNames.requests.append((url.path, query))
+        if StubGeoNames.overloaded:
+            StubGeoNames.overloaded -= 1
+            data = {"status": {"message": "overloaded", "value": 22}}
+        elif url.path == "/findNearbyPlaceNameJSON":
+            data = {"geonames": [{
+                "adminName1": "Nusa Tenggara Timur",
+                "countryName": "Indonesia", "countryCode": "ID"}]}
+        else:
+            data = {"geonames": [{"name": "{:}-{:}".format(
+                query["featureCode"], query["lat"])}]}
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class Tests(TestCase):
+    def setUp(self):
+        StubGeoNames.requests = []
+        StubGeoNames.overloaded = 0
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubGeoNames)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = "http://127.0.0.1:{:d}".format(self.server.server_port)
+        self.tmp = Path(tempfile.mkdtemp())
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(str(self.tmp))
+
+    def client(self):
+        return GeoNamesClient("test", self.url, rate=100, backoff=0.01)
+
+    def test_cached_regions(self):
+        lects = [{"Latitude": -8.2, "Longitude": 124.5, "Region": None},
+                 {"Latitude": -8.2, "Longitude": 124.5, "Region": None},
+                 {"Latitude": None, "Longitude": None, "Region": "Alor"}]
+        cache = RegionCache(self.tmp / "regions.json")
+        self.assertEqual(update_regions(lects, self.client(), cache), 1)
+        self.assertEqual(len(StubGeoNames.requests), 3)
+        self.assertEqual(
+            lects[0]["Region"],
+            "ADM3--8.2, ADM2--8.2, Nusa Tenggara Timur, Indonesia")
+        self.assertEqual(lects[1]["Region"], lects[0]["Region"])
+        self.assertEqual(lects[2]["Region"], "Alor")
+        cache.save()
+
+        lects[0]["Region"] = None
+        cache = RegionCache(self.tmp / "regions.json")
+        self.assertEqual(update_regions(lects, self.client(), cache), 0)
+        self.assertEqual(len(StubGeoNames.requests), 3)
+        self.assertEqual(lects[0]["Region"], lects[1]["Region"])
+
+    def test_retry(self):
+        StubGeoNames.overloaded = 2
+        lects = [{"Latitude": -8.5, "Longitude": 124.5, "Region": None}]
+        update_regions(lects, self.client(), RegionCache(self.tmp / "r.json"))
+        self.assertEqual(len(StubGeoNames.requests), 5)
+        self.assertTrue(lects[0]["Region"].endswith("Indonesia"))
@@ -0,0 +1,62 @@
+from unittest import TestCase
+import shutil
+import tempfile
+
+from clldutils.path import Path
+
+from pylexirumah import get_dataset, repository
+from pylexirumah.sqlite_export import export, LexiRumahDB
+
+TABLES = {
+    "lects.csv": """\
+ID,Name,Family,Latitude,Longitude,Region,Glottocode,Iso,Culture,Description,Orthography,Comment
+abui1241-takal,"Abui, Takalelang",Timor-Alor-Pantar,-8.2,124.7,,abui1241,abz,,,,
+alor1247-besar,"Alorese, Alor Besar",Austronesian,-8.2,124.4,,alor1247,aol,,,,
+""",
+    "concepts.csv": """\
+ID,Description,English,Indonesian,Semantic_Field,Elicitation_Notes,Core_Set,Concepticon_ID,Comment
+leg,,leg,kaki,,,true,1297,
+""",
+    "forms.csv": """\
+ID,Lect_ID,Concept_ID,Form_according_to_Source,Form,Local_Orthography,Segments,Comment,Source
+abui1241-takal-leg-1,abui1241-takal,leg,tɛk,tɛk,tek,t ɛ k,,src
+alor1247-besar-leg-1,alor1247-besar,leg,lei,lei,lei,l e i,,src
+""",
+    "missing_forms.csv": "ID,Lect_ID,Concept_ID,Form_according_to_Source,"
+    "Comment,Source\n",
+    "cognates.csv": """\
+ID,Form_ID,Cognateset_ID,Alignment,Source
+1,abui1241-takal-leg-1,leg-1,t ɛ k,src
+2,alor1247-besar-leg-1,leg-1,l e i,src
+3,alor1247-besar-leg-1,leg-2,l e i,src
+""",
+    "borrowings.csv": "ID,Form_ID_Target,Form_ID_Source,Comment,Source,"
+    "Status\n",
+    "sources.bib": "@misc{src, title={A word list}, year={2017}}\n",
+}
+
+
+class Tests(TestCase):
+    def setUp(self):
+        self.tmp = Path(tempfile.mkdtemp())
+        shutil.copy(str(repository), str(self.tmp / repository.name))
+        for name, content in TABLES.items():
+            with (self.tmp / name).open("w", encoding="utf-8") as table:
+                table.write(content)
+        self.db = self.tmp / "lexirumah.sqlite"
+        self.assertEqual(
+            export(get_dataset(self.tmp / repository.name), self.db), 0)
+
+    def tearDown(self):
+        shutil.rmtree(str(self.tmp))
+
+    def test_forms(self):
+        with LexiRumahDB(self.db) as db:
+            forms = db.forms(concept="leg")
+            self.assertEqual([f["Cognateset_ID"] for f in forms],
+                             ["leg-1", "leg-2"])
+            self.assertEqual(forms[0]["Segments"], "t ɛ k")
+            forms = db.forms(cognateset="leg-1", clade="Timor-Alor-Pantar")
+            self.assertEqual([f["ID"] for f in forms], ["abui1241-takal-leg-1"])
+            self.assertEqual(
+                [s["ID"] for s in db.sources("alor1247-besar-leg-1")], ["src"])